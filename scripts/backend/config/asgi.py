@@ -0,0 +1,11 @@
+"""ASGI config for the project (serves the async detect endpoint)."""
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django_application = get_asgi_application()
+
+# Import after setup: sheds async detect requests past DETECTION_ASYNC['MAX_PENDING']
+from detection.async_inference import LoadSheddingMiddleware  # noqa: E402
+
+application = LoadSheddingMiddleware(django_application)
@@ -55,6 +55,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 DATABASES = {
     'default': {
@@ -92,5 +93,152 @@ REST_FRAMEWORK = {
     ],
 }
 
-# ML Models path
-ML_MODELS_PATH = BASE_DIR / 'ml_models'
+# ML Models path: holds manifest.json and the model bundle it names
+ML_MODELS_PATH = Path(os.environ.get('ML_MODELS_PATH', BASE_DIR / 'ml_models'))
+
+# Load the models when the app starts instead of on the first request
+ML_PRELOAD_MODELS = os.environ.get('ML_PRELOAD_MODELS', 'True').lower() == 'true'
+
+# Seconds between checks for models retrained by another process (a training job);
+# 0 disables the check and new models are only served after a restart
+ML_RELOAD_CHECK_INTERVAL = float(os.environ.get('ML_RELOAD_CHECK_INTERVAL', 5))
+
+# Labeled JSONL/CSV corpus to train from (see detection/corpus.py). When set, training
+# streams it in mini-batches into hashed features and SGD models (out of core);
+# unset trains on the built-in sample data
+ML_TRAINING_CORPUS = os.environ.get('ML_TRAINING_CORPUS') or None
+ML_STREAMING_TRAINING = {
+    'BATCH_SIZE': int(os.environ.get('ML_STREAMING_BATCH_SIZE', 1000)),
+    'EPOCHS': int(os.environ.get('ML_STREAMING_EPOCHS', 3)),
+    'HOLDOUT_PERCENT': int(os.environ.get('ML_STREAMING_HOLDOUT_PERCENT', 10)),
+    'HASH_FEATURES': 2 ** 20,
+    'SHUFFLE_BATCHES': 10,
+}
+
+# Latency histograms (per detect stage and per model) and counters, served in the Prometheus
+# text format at /api/metrics/; each worker process keeps its own. SERVER_TIMING also returns
+# the stage timings of every detect request in a Server-Timing header.
+DETECTION_METRICS = {
+    'ENABLED': os.environ.get('DETECTION_METRICS_ENABLED', 'True').lower() == 'true',
+    'SERVER_TIMING': os.environ.get('DETECTION_METRICS_SERVER_TIMING', 'False').lower() == 'true',
+}
+
+# Micro-batching of POST /api/detect/ (see detection/micro_batcher.py): concurrent requests
+# of a worker are collected for up to MAX_WAIT_MS milliseconds or MAX_BATCH_SIZE messages
+# and scored in one ensemble pass. Only useful when a worker serves several requests at
+# once (gunicorn --threads, ASGI); with sync workers it only adds MAX_WAIT_MS of latency.
+# A request whose batch is not scored within TIMEOUT_MS (the wait plus the scoring of a full
+# batch, with a wide margin) is scored in its own thread.
+DETECTION_MICRO_BATCH = {
+    'ENABLED': os.environ.get('DETECTION_MICRO_BATCH_ENABLED', 'False').lower() == 'true',
+    'MAX_WAIT_MS': float(os.environ.get('DETECTION_MICRO_BATCH_MAX_WAIT_MS', 2.0)),
+    'MAX_BATCH_SIZE': int(os.environ.get('DETECTION_MICRO_BATCH_SIZE', 32)),
+    'MAX_QUEUE': 1000,
+    'TIMEOUT_MS': float(os.environ.get('DETECTION_MICRO_BATCH_TIMEOUT_MS', 1000)),
+}
+
+# Async detect endpoint under ASGI (POST /api/detect/async/, see detection/async_inference.py):
+# predictions run in MAX_WORKERS threads per worker process, and once MAX_PENDING of these
+# requests are in flight, new ones are rejected right away with 503 and Retry-After.
+DETECTION_ASYNC = {
+    'MAX_WORKERS': int(os.environ.get('DETECTION_ASYNC_WORKERS', 2)),
+    'MAX_PENDING': int(os.environ.get('DETECTION_ASYNC_MAX_PENDING', 16)),
+    'RETRY_AFTER': 1,
+}
+
+# Online learning from POST /api/feedback/ (see detection/feedback.py): pending corrections
+# are applied every BATCH_SIZE corrections or FLUSH_INTERVAL seconds, as one gradient step on the
+# mean loss of the batch: LEARNING_RATE for the log loss of the logistic regression and the pipeline,
+# LINEAR_LEARNING_RATE for the squared loss of the linear regression. The SVM is refreshed from at most
+# SVM_MAX_EXAMPLES corrections every SVM_REFRESH_INTERVAL seconds (0 never refreshes it).
+ML_FEEDBACK = {
+    'BATCH_SIZE': int(os.environ.get('ML_FEEDBACK_BATCH_SIZE', 32)),
+    'FLUSH_INTERVAL': float(os.environ.get('ML_FEEDBACK_FLUSH_INTERVAL', 10.0)),
+    'LEARNING_RATE': float(os.environ.get('ML_FEEDBACK_LEARNING_RATE', 0.5)),
+    'LINEAR_LEARNING_RATE': float(os.environ.get('ML_FEEDBACK_LINEAR_LEARNING_RATE', 0.1)),
+    'SVM_REFRESH_INTERVAL': float(os.environ.get('ML_SVM_REFRESH_INTERVAL', 3600)),
+    'SVM_MAX_EXAMPLES': 5000,
+}
+
+# Inference engine: 'sklearn' or 'fast' (NumPy-only scorer, see detection/fast_inference.py)
+ML_INFERENCE_ENGINE = os.environ.get('ML_INFERENCE_ENGINE', 'sklearn')
+
+# SVM mode: 'exact' (RBF SVC) or 'nystroem' (kernel approximation + calibrated linear SVM)
+ML_SVM_MODE = os.environ.get('ML_SVM_MODE', 'exact')
+
+# Model selection in train_models (see detection/model_selection.py): every candidate of a
+# hyperparameter grid per model is scored with FOLDS-fold cross-validation on the training
+# split, in N_JOBS processes (-1: one per CPU), and the best ones are trained. GRID_PATH is a
+# JSON file replacing the grids of the models it lists; CACHE_DIR keeps the fold TF-IDF
+# matrices between runs (unset: a temporary directory per run).
+ML_MODEL_SELECTION = {
+    'ENABLED': os.environ.get('ML_MODEL_SELECTION_ENABLED', 'False').lower() == 'true',
+    'GRID_PATH': os.environ.get('ML_MODEL_SELECTION_GRID') or None,
+    'FOLDS': int(os.environ.get('ML_MODEL_SELECTION_FOLDS', 5)),
+    'N_JOBS': int(os.environ.get('ML_MODEL_SELECTION_JOBS', -1)),
+    'CACHE_DIR': os.environ.get('ML_MODEL_SELECTION_CACHE_DIR') or None,
+}
+
+# Post-training compaction (see detection/compaction.py): drop the pipeline's features whose
+# weight is below PRUNE_THRESHOLD times its classifier's largest weight (the vectorizer shared
+# with the kernel SVM keeps all of them), store the vocabularies as sorted arrays and the
+# linear weights as float32
+ML_COMPACTION = {
+    'ENABLED': os.environ.get('ML_COMPACTION_ENABLED', 'False').lower() == 'true',
+    'PRUNE_THRESHOLD': float(os.environ.get('ML_COMPACTION_PRUNE_THRESHOLD', 0.05)),
+}
+
+# JSON keyword lexicon for reasons, spam_score and ham_score (see detection/keywords.py);
+# unset uses the built-in lexicon
+ML_KEYWORD_LEXICON_PATH = os.environ.get('ML_KEYWORD_LEXICON_PATH') or None
+
+# Early-exit cascade voting: stop scoring a message once its majority vote is settled.
+# ML_CASCADE_CONFIDENCE (0-100) also stops once every model so far agrees with at
+# least that confidence, which can differ from the full vote; unset keeps results exact.
+ML_CASCADE = os.environ.get('ML_CASCADE', 'False').lower() == 'true'
+ML_CASCADE_CONFIDENCE = (
+    float(os.environ['ML_CASCADE_CONFIDENCE']) if os.environ.get('ML_CASCADE_CONFIDENCE') else None
+)
+
+# Prediction cache in front of the ensemble, keyed on normalized content + model version.
+# BACKEND: 'local' (in-process LRU/TTL), 'django' (CACHES[CACHE_ALIAS], shared between
+# workers when that alias is a shared backend) or 'none'
+PREDICTION_CACHE = {
+    'BACKEND': os.environ.get('PREDICTION_CACHE_BACKEND', 'local'),
+    'MAX_ENTRIES': int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 10000)),
+    'TTL': int(os.environ.get('PREDICTION_CACHE_TTL', 3600)),
+    'CACHE_ALIAS': os.environ.get('PREDICTION_CACHE_ALIAS', 'default'),
+}
+
+# Near-duplicate index (see detection/near_duplicates.py): a message whose MinHash similarity
+# to a recently classified one reaches THRESHOLD reuses its model votes without running the
+# models (keyword scores and reasons are computed for the message itself).
+# Only unanimous verdicts with at least MIN_CONFIDENCE are indexed, for TTL seconds each.
+NEAR_DUPLICATE_INDEX = {
+    'ENABLED': os.environ.get('NEAR_DUPLICATE_ENABLED', 'False').lower() == 'true',
+    'THRESHOLD': float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.85)),
+    'TTL': int(os.environ.get('NEAR_DUPLICATE_TTL', 3600)),
+    'MAX_ENTRIES': int(os.environ.get('NEAR_DUPLICATE_MAX_ENTRIES', 50000)),
+    'MIN_CONFIDENCE': float(os.environ.get('NEAR_DUPLICATE_MIN_CONFIDENCE', 70)),
+}
+
+# DetectionLog writes: 'async' queues rows and a background thread inserts them with
+# bulk_create every BATCH_SIZE rows or FLUSH_INTERVAL seconds; 'sync' inserts in the
+# request (use it for tests). OVERFLOW is 'drop' or 'block' (wait up to BLOCK_TIMEOUT per write, then drop).
+DETECTION_LOG_WRITER = {
+    'MODE': os.environ.get('DETECTION_LOG_MODE', 'async'),
+    'BATCH_SIZE': int(os.environ.get('DETECTION_LOG_BATCH_SIZE', 200)),
+    'FLUSH_INTERVAL': float(os.environ.get('DETECTION_LOG_FLUSH_INTERVAL', 1.0)),
+    'MAX_QUEUE': int(os.environ.get('DETECTION_LOG_MAX_QUEUE', 10000)),
+    'OVERFLOW': os.environ.get('DETECTION_LOG_OVERFLOW', 'drop'),
+    'BLOCK_TIMEOUT': 0.5,
+}
+
+# Retention of DetectionLog rows (manage.py prune_logs): rows older than DAYS are deleted in
+# batches of BATCH_SIZE rows, PAUSE seconds apart. /api/stats/ reads the hourly rollups,
+# which are kept.
+DETECTION_LOG_RETENTION = {
+    'DAYS': float(os.environ.get('DETECTION_LOG_RETENTION_DAYS', 30)),
+    'BATCH_SIZE': int(os.environ.get('DETECTION_LOG_RETENTION_BATCH_SIZE', 1000)),
+    'PAUSE': 0.1,
+}
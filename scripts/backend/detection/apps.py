@@ -1,6 +1,21 @@
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'detection'
+    
+    def ready(self):
+        # Load the models before the first request. Under gunicorn --preload
+        # this runs once in the master and the workers inherit the models.
+        if not settings.ML_PRELOAD_MODELS:
+            return
+        # Management commands other than runserver do not serve requests
+        if sys.argv[0].endswith('manage.py') and len(sys.argv) > 1 and sys.argv[1] != 'runserver':
+            return
+        
+        from .ml_models import model_registry
+        model_registry.preload()
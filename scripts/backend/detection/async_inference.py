@@ -0,0 +1,150 @@
+"""
+Bounded inference for the async detect view.
+Scoring a message is CPU-bound, so under ASGI it cannot run on the event
+loop: it runs in a small thread pool instead. The number of async detect
+requests in flight per worker is capped by LoadSheddingMiddleware, which
+wraps the ASGI application (config/asgi.py): past the cap a request is
+answered 503 right away, before Django spends any work on it, rather than
+queued behind requests the worker cannot finish in time. That keeps the
+latency of accepted requests bounded and the worker responsive to health
+checks when it is saturated.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.urls import reverse
+
+from . import metrics
+
+
+class InferenceExecutor:
+    """
+    Run predictions in max_workers threads, and count the async detect
+    requests in flight, admitting at most max_pending of them.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, retry_after=1):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+
+        self.completed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def try_admit(self):
+        """Count a new request in flight; False when max_pending are already"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending += 1
+            return True
+
+    def release(self):
+        """A request admitted with try_admit finished"""
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def run(self, func, *args):
+        """Await func(*args) in the pool"""
+        # The stage timers of the request keep working in the pool thread
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(context.run, func, *args))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def _get_executor(self):
+        # Threads do not survive fork (gunicorn --preload), so each worker
+        # process creates its own pool on first use
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='detection-inference'
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware admitting at most DETECTION_ASYNC['MAX_PENDING'] async
+    detect requests in flight; the others get a 503 with Retry-After.
+    Other paths are not limited, so health checks keep being served.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self._limited_paths():
+            return await self.app(scope, receive, send)
+
+        executor = get_inference_executor()
+        if not executor.try_admit():
+            if metrics.enabled():
+                metrics.REQUESTS.inc('detect_async', '503')
+            return await self._busy(send, executor.retry_after)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            executor.release()
+
+    def _limited_paths(self):
+        if self._paths is None:
+            self._paths = {reverse('detect-async')}
+        return self._paths
+
+    @staticmethod
+    async def _busy(send, retry_after):
+        body = json.dumps({'error': 'Server busy, retry later'}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode('ascii')),
+                (b'retry-after', str(retry_after).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+_executor_instance = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    """Get or create the executor configured in settings.DETECTION_ASYNC"""
+    global _executor_instance
+    if _executor_instance is None:
+        with _executor_lock:
+            if _executor_instance is None:
+                config = settings.DETECTION_ASYNC
+                _executor_instance = InferenceExecutor(
+                    max_workers=config.get('MAX_WORKERS', 2),
+                    max_pending=config.get('MAX_PENDING', 16),
+                    retry_after=config.get('RETRY_AFTER', 1)
+                )
+    return _executor_instance
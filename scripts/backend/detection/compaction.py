@@ -0,0 +1,178 @@
+"""
+Post-training compaction of the ensemble for serving.
+A fitted TfidfVectorizer keeps its vocabulary as a dict of str -> int,
+which every worker rebuilds on its own heap when it loads the bundle, and
+the models keep a float64 weight for every feature, including the many
+whose weight is close to zero. Compaction stores the vocabularies as NumPy
+arrays (memory-mapped and shared between workers like the other weights of
+the bundle), casts the linear weights to float32 and, where only a linear
+model reads a vectorizer, drops the features with near-zero weights. See
+SpamDetectionModels.compact.
+"""
+import copy
+import hashlib
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import chain
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import clone
+from sklearn.kernel_approximation import Nystroem
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+
+
+# Most n-grams of a message are common words and phrases, so their hashes are cached
+@lru_cache(maxsize=1 << 14)
+def term_hash(term):
+    """64-bit hash of a term, the same in every process (unlike the salted hash())"""
+    digest = hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def _term_hashes(terms):
+    terms = list(terms)
+    return np.fromiter(map(term_hash, terms), dtype=np.int64, count=len(terms))
+
+
+class CompactVocabulary(Mapping):
+    """
+    Read-only term -> column map of a vectorizer, stored as arrays.
+
+    Terms are sorted, column i being the i-th term, and stored as one
+    UTF-8 byte array plus offsets. Lookups go through the sorted
+    term_hash() values of the terms, which are stable across processes
+    and so saved (and memory-mapped) with the arrays. An out-of-vocabulary
+    n-gram matches a term only if their 64-bit hashes collide, about
+    len(self) / 2**64 odds per lookup.
+    """
+
+    def __init__(self, terms):
+        terms = sorted(terms)
+        encoded = [term.encode('utf-8') for term in terms]
+        self.data = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+        self.offsets = np.cumsum([0] + [len(term) for term in encoded], dtype=np.int64)
+        self._build_index(terms)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return iter(self._terms())
+
+    def __getitem__(self, term):
+        column = self.columns([term])[0]
+        if column < 0:
+            raise KeyError(term)
+        return int(column)
+
+    def columns(self, terms):
+        """Column of each of a sequence of terms, -1 for the ones not in the vocabulary"""
+        keys, order = self.hashes, self.hash_order
+        hashes = _term_hashes(terms)
+        if not len(keys):
+            return np.full(len(terms), -1, dtype=np.intp)
+        positions = np.minimum(np.searchsorted(keys, hashes), len(keys) - 1)
+        return np.where(keys[positions] == hashes, order[positions], -1)
+
+    def count_matrix(self, docs_terms, dtype):
+        """CSR matrix of term counts, one row per list of terms"""
+        n_docs, n_features = len(docs_terms), len(self)
+        columns = self.columns(list(chain.from_iterable(docs_terms)))
+        rows = np.repeat(np.arange(n_docs), [len(terms) for terms in docs_terms])
+        known = columns >= 0
+        # Sorted unique (row, column) cells and their counts give the CSR arrays directly
+        cells, counts = np.unique(rows[known] * n_features + columns[known], return_counts=True)
+        indptr = np.searchsorted(cells, np.arange(n_docs + 1) * n_features)
+        return sp.csr_matrix(
+            (counts.astype(dtype), cells % n_features, indptr), shape=(n_docs, n_features)
+        )
+
+    def _terms(self):
+        raw = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [raw[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+    def _build_index(self, terms):
+        hashes = _term_hashes(terms)
+        # Sorted hashes, and the column of each
+        self.hash_order = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[self.hash_order]
+        if len(np.unique(self.hashes)) != len(self.hashes):
+            raise ValueError("Two vocabulary terms have the same hash")
+
+
+def _select_columns(matrix, columns):
+    if columns is None:
+        return matrix
+    if sp.issparse(matrix):
+        return sp.csr_matrix(matrix)[:, columns]
+    return np.ascontiguousarray(np.asarray(matrix)[:, columns])
+
+
+def feature_importance(estimator):
+    """
+    Weight of each input feature in a fitted linear model, relative to its
+    largest one (between 0 and 1)
+    """
+    weights = np.abs(np.asarray(estimator.coef_)).reshape(-1, estimator.n_features_in_).max(axis=0)
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    largest = weights.max() if len(weights) else 0.0
+    return weights / largest if largest > 0 else weights
+
+
+def compact_vectorizer(vectorizer, keep=None):
+    """
+    Copy of a fitted vectorizer producing float32 features, so their
+    products with float32 weights do not convert the weights back to
+    float64 on every call. With keep, a TfidfVectorizer is also restricted
+    to the features where keep is True, as a new vectorizer with the same
+    parameters, a CompactVocabulary and float32 idf weights.
+    Returns it with the original column of each of its features (None
+    when not restricted), for slicing the weights of the models it feeds.
+    """
+    if keep is None:
+        compacted = copy.copy(vectorizer)
+        compacted.dtype = np.float32
+        return compacted, None
+
+    terms = {term: column for term, column in vectorizer.vocabulary_.items() if keep[column]}
+    if not terms:
+        raise ValueError("Compaction would remove every feature, lower the prune threshold")
+    vocabulary = CompactVocabulary(terms)
+    columns = np.fromiter((terms[term] for term in vocabulary), dtype=np.intp, count=len(vocabulary))
+
+    compacted = clone(vectorizer).set_params(dtype=np.float32)
+    compacted.vocabulary_ = vocabulary
+    # The idf_ setter builds the TF-IDF step for the narrower vocabulary
+    compacted.idf_ = np.asarray(vectorizer.idf_)[columns].astype(np.float32)
+    return compacted, columns
+
+
+def compact_estimator(estimator, columns=None):
+    """
+    Copy of a fitted ensemble member reading only the given input columns
+    (all of them when None), with its linear weights cast to float32.
+    For a kernel SVM, columns must be a reordering of all of them: its
+    RBF distances depend on every feature.
+    The kernel SVMs keep their float64 support vectors and Nystroem
+    components, libsvm only accepting float64.
+    """
+    if isinstance(estimator, Pipeline):
+        (name, first), rest = estimator.steps[0], estimator.steps[1:]
+        return Pipeline([(name, compact_estimator(first, columns))] + rest)
+
+    compacted = copy.copy(estimator)
+    if isinstance(estimator, SVC):
+        compacted.support_vectors_ = _select_columns(estimator.support_vectors_, columns)
+    elif isinstance(estimator, Nystroem):
+        compacted.components_ = _select_columns(estimator.components_, columns)
+    else:
+        coef = np.asarray(estimator.coef_)
+        if columns is not None:
+            coef = coef[..., columns]
+        compacted.coef_ = np.ascontiguousarray(coef, dtype=np.float32)
+    if columns is not None:
+        compacted.n_features_in_ = len(columns)
+    return compacted
@@ -0,0 +1,139 @@
+"""
+Streaming readers for message corpora (JSONL, CSV, mbox).
+Each reader yields one CorpusRecord at a time, so memory use does not
+depend on the size of the file.
+"""
+import csv
+import json
+import sys
+from collections import namedtuple
+from email import message_from_bytes, policy
+from email.utils import parseaddr
+from itertools import islice
+from pathlib import Path
+
+
+# label is 'spam', 'ham' or None; id is an optional caller-supplied identifier
+CorpusRecord = namedtuple('CorpusRecord', ['email', 'content', 'label', 'id'])
+
+FORMATS = ('jsonl', 'csv', 'mbox')
+
+_EXTENSIONS = {
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+    '.mbox': 'mbox',
+}
+
+
+class CorpusError(ValueError):
+    """Raised for unreadable or malformed corpus files"""
+
+
+def detect_format(path):
+    """Corpus format from the file extension"""
+    fmt = _EXTENSIONS.get(Path(path).suffix.lower())
+    if fmt is None:
+        raise CorpusError(f"Cannot tell the format of {path}, expected one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def read_corpus(path, fmt=None):
+    """Iterate over the CorpusRecords of a JSONL, CSV or mbox file"""
+    fmt = fmt or detect_format(path)
+    if fmt == 'jsonl':
+        return _read_jsonl(path)
+    if fmt == 'csv':
+        return _read_csv(path)
+    if fmt == 'mbox':
+        return _read_mbox(path)
+    raise CorpusError(f"Unknown corpus format: {fmt}")
+
+
+def read_chunks(records, chunk_size):
+    """Group an iterator of records into lists of up to chunk_size"""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _record(item, where):
+    content = item.get('content')
+    if content is None:
+        raise CorpusError(f"{where}: missing 'content'")
+    label = item.get('label') or None
+    if label is not None:
+        label = str(label).lower()
+        if label not in ('spam', 'ham'):
+            raise CorpusError(f"{where}: label must be spam or ham, got {item.get('label')!r}")
+    record_id = item.get('id')
+    return CorpusRecord(
+        str(item.get('email') or ''), str(content), label, None if record_id in (None, '') else record_id
+    )
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CorpusError(f"{path}:{line_number}: invalid JSON ({e})")
+            if not isinstance(item, dict):
+                raise CorpusError(f"{path}:{line_number}: expected a JSON object")
+            yield _record(item, f"{path}:{line_number}")
+
+
+def _read_csv(path):
+    # Message bodies can exceed the csv module's default field limit
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or 'content' not in reader.fieldnames:
+            raise CorpusError(f"{path}: expected a header row with a 'content' column")
+        for row in reader:
+            yield _record(row, f"{path}:{reader.line_num}")
+
+
+def _read_mbox(path):
+    # Split on "From " separator lines while streaming, instead of letting
+    # mailbox.mbox index the whole file first
+    lines = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From ') and lines:
+                yield _mbox_record(lines)
+                lines = []
+            if lines or line.startswith(b'From '):
+                lines.append(line)
+            elif line.strip():
+                raise CorpusError(f"{path}: not an mbox file (no 'From ' separator line)")
+    if lines:
+        yield _mbox_record(lines)
+
+
+def _mbox_record(lines):
+    # Drop the separator line and undo mboxrd ">From " quoting
+    body = b''.join(line[1:] if line.startswith(b'>From ') else line for line in lines[1:])
+    message = message_from_bytes(body, policy=policy.default)
+
+    parts = [str(message['Subject'] or '')]
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain' and not part.is_attachment():
+            try:
+                parts.append(part.get_content())
+            except (LookupError, UnicodeDecodeError):
+                payload = part.get_payload(decode=True) or b''
+                parts.append(payload.decode('utf-8', errors='replace'))
+
+    return CorpusRecord(
+        parseaddr(str(message['From'] or ''))[1],
+        '\n'.join(p for p in parts if p).strip(),
+        None,
+        str(message['Message-ID']) if message['Message-ID'] else None
+    )
@@ -0,0 +1,229 @@
+"""
+Fast-path inference engine for the spam detection ensemble.
+Exports the trained scikit-learn models to plain NumPy weight arrays and
+scores them with sparse dot products, skipping sklearn's per-call input
+validation and dispatch.
+"""
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import SGDClassifier
+from sklearn.svm import SVC
+
+
+# libsvm clips Platt-scaled probabilities to [MIN_PROB, 1 - MIN_PROB]
+LIBSVM_MIN_PROB = 1e-7
+
+# Maximum absolute difference allowed between fast and sklearn outputs
+PARITY_TOLERANCE = 1e-6
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _binary_probas(p_second):
+    """Stack P(classes_[1]) into a (n, 2) matrix in classes_ order"""
+    return np.column_stack([1.0 - p_second, p_second])
+
+
+def _squared_norms(X):
+    return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+
+
+def _rbf_kernel(X, Y_t, y_norms, gamma):
+    """
+    RBF kernel between the rows of X and the columns of Y_t, using
+    ||x - y||^2 = ||x||^2 + ||y||^2 - 2 x.y with precomputed ||y||^2
+    """
+    cross = (X @ Y_t).toarray()
+    sq_dist = _squared_norms(X)[:, None] + y_norms[None, :] - 2.0 * cross
+    np.maximum(sq_dist, 0, out=sq_dist)
+    return np.exp(-gamma * sq_dist)
+
+
+def _libsvm_pairwise_coupling(r01, max_iter=100):
+    """
+    Vectorized port of libsvm's multiclass_probability for 2 classes.
+    sklearn's bundled libsvm runs the iterative coupling even for binary
+    problems, so P(classes_[0]) is not exactly r01; this reproduces the
+    same iterations and early stop, row by row.
+    """
+    r10 = 1.0 - r01
+    Q = np.empty((2, 2) + r01.shape)
+    Q[0, 0] = r10 * r10
+    Q[1, 1] = r01 * r01
+    Q[0, 1] = Q[1, 0] = -r10 * r01
+    p = np.full((2,) + r01.shape, 0.5)
+    eps = 0.005 / 2
+    active = np.ones(r01.shape, dtype=bool)
+    for _ in range(max_iter):
+        Qp = np.einsum('tjn,jn->tn', Q, p)
+        pQp = (p * Qp).sum(axis=0)
+        active &= np.abs(Qp - pQp).max(axis=0) >= eps
+        if not active.any():
+            break
+        for t in range(2):
+            diff = np.where(active, (pQp - Qp[t]) / Q[t, t], 0.0)
+            p[t] += diff
+            pQp = (pQp + diff * (diff * Q[t, t] + 2 * Qp[t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff * Q[t]) / (1 + diff)
+            p /= 1 + diff
+    return p.T
+
+
+class FastInferenceEngine:
+    """
+    NumPy-only scorer for the 4 ensemble models.
+
+    Feature extraction is not part of the engine: the shared extraction
+    stage in SpamDetectionModels already builds the CSR matrices from the
+    vectorizers' vocabulary maps and idf weights without calling into
+    sklearn, and the engine scores those matrices directly.
+    """
+
+    def __init__(self, models):
+        # 1. Linear Regression: raw score = X . w + b
+        self.linear_coef = np.asarray(models.linear_model.coef_, dtype=np.float64).ravel()
+        self.linear_intercept = float(np.ravel(models.linear_model.intercept_)[0])
+
+        # 2./3. Logistic models: P(classes_[1]) = sigmoid(X . w + b)
+        self.logistic_coef, self.logistic_intercept, self.logistic_classes = \
+            self._export_logistic(models.logistic_model)
+        self.pipeline_coef, self.pipeline_intercept, self.pipeline_classes = \
+            self._export_logistic(models.pipeline_model[-1])
+
+        # 4. SVM, exact RBF SVC, Nystroem approximation or streaming-trained SGD
+        if isinstance(models.svm_model, SVC):
+            self._export_exact_svm(models.svm_model)
+        elif isinstance(models.svm_model, SGDClassifier):
+            self._export_sgd_svm(models.svm_model)
+        else:
+            self._export_approximate_svm(models.svm_model)
+
+    def _export_exact_svm(self, svm):
+        """RBF SVC with precomputed support-vector norms"""
+        if svm.kernel != 'rbf' or len(svm.classes_) != 2:
+            raise ValueError("Fast inference only supports a binary RBF SVC")
+        support_vectors = sp.csr_matrix(svm.support_vectors_)
+        self.svm_mode = 'exact'
+        self.svm_support_vectors_t = support_vectors.T.tocsr()
+        self.svm_sv_norms = _squared_norms(support_vectors)
+        self.svm_dual_coef = sp.csr_matrix(svm.dual_coef_).toarray().ravel()
+        self.svm_intercept = float(svm.intercept_[0])
+        self.svm_gamma = float(svm._gamma)
+        self.svm_prob_a = float(svm.probA_[0])
+        self.svm_prob_b = float(svm.probB_[0])
+
+    def _export_approximate_svm(self, svm):
+        """Nystroem features followed by sigmoid-calibrated linear SVMs"""
+        nystroem, calibrated = svm[0], svm[-1]
+        if nystroem.kernel != 'rbf' or calibrated.method != 'sigmoid' or len(calibrated.classes_) != 2:
+            raise ValueError("Fast inference only supports an RBF Nystroem + sigmoid-calibrated SVM")
+        components = sp.csr_matrix(nystroem.components_)
+        self.svm_mode = 'nystroem'
+        self.nystroem_components_t = components.T.tocsr()
+        self.nystroem_norms = _squared_norms(components)
+        self.nystroem_gamma = float(nystroem.gamma)
+        self.nystroem_normalization_t = np.ascontiguousarray(nystroem.normalization_.T)
+        self.calibrated_svms = [
+            (
+                np.asarray(classifier.estimator.coef_, dtype=np.float64).ravel(),
+                float(classifier.estimator.intercept_[0]),
+                float(classifier.calibrators[0].a_),
+                float(classifier.calibrators[0].b_),
+            )
+            for classifier in calibrated.calibrated_classifiers_
+        ]
+
+    def _export_sgd_svm(self, svm):
+        """Linear SVM trained with SGD and the modified Huber loss"""
+        if svm.loss != 'modified_huber' or len(svm.classes_) != 2:
+            raise ValueError("Fast inference only supports a binary modified_huber SGDClassifier")
+        self.svm_mode = 'sgd'
+        self.sgd_coef = np.asarray(svm.coef_, dtype=np.float64).ravel()
+        self.sgd_intercept = float(svm.intercept_[0])
+
+    @staticmethod
+    def _export_logistic(model):
+        if len(model.classes_) != 2:
+            raise ValueError("Fast inference only supports binary classifiers")
+        return (
+            np.asarray(model.coef_, dtype=np.float64).ravel(),
+            float(model.intercept_[0]),
+            model.classes_,
+        )
+
+    def predict_linear(self, X):
+        """Raw linear regression scores for a CSR matrix"""
+        return X @ self.linear_coef + self.linear_intercept
+
+    def predict_proba_logistic(self, X):
+        return _binary_probas(_sigmoid(X @ self.logistic_coef + self.logistic_intercept))
+
+    def predict_proba_pipeline(self, X):
+        return _binary_probas(_sigmoid(X @ self.pipeline_coef + self.pipeline_intercept))
+
+    def predict_proba_svm(self, X):
+        if self.svm_mode == 'sgd':
+            # modified_huber probabilities: (clip(decision, -1, 1) + 1) / 2
+            p_second = np.clip(X @ self.sgd_coef + self.sgd_intercept, -1, 1)
+            return _binary_probas((p_second + 1) / 2)
+
+        if self.svm_mode == 'nystroem':
+            features = _rbf_kernel(
+                X, self.nystroem_components_t, self.nystroem_norms, self.nystroem_gamma
+            ) @ self.nystroem_normalization_t
+            # CalibratedClassifierCV averages its per-fold calibrated models
+            p_second = np.mean([
+                _sigmoid(-(a * (features @ coef + intercept) + b))
+                for coef, intercept, a, b in self.calibrated_svms
+            ], axis=0)
+            return _binary_probas(p_second)
+
+        return self._svm_platt(self._svm_decision(X))
+
+    def predict_svm(self, X):
+        """
+        Index of the predicted class and the class probabilities of the SVM.
+        The exact SVC predicts from the sign of its decision function, like
+        SVC.predict, which its Platt-scaled probabilities can disagree with.
+        """
+        if self.svm_mode != 'exact':
+            probas = self.predict_proba_svm(X)
+            return probas.argmax(axis=1), probas
+        decision = self._svm_decision(X)
+        return (decision > 0).astype(np.intp), self._svm_platt(decision)
+
+    def _svm_decision(self, X):
+        kernel = _rbf_kernel(X, self.svm_support_vectors_t, self.svm_sv_norms, self.svm_gamma)
+        return kernel @ self.svm_dual_coef + self.svm_intercept
+
+    def _svm_platt(self, decision):
+        # Platt scaling as done by libsvm, whose decision values have the
+        # opposite sign of sklearn's for binary problems
+        r01 = _sigmoid(decision * self.svm_prob_a - self.svm_prob_b)
+        np.clip(r01, LIBSVM_MIN_PROB, 1 - LIBSVM_MIN_PROB, out=r01)
+        return _libsvm_pairwise_coupling(r01)
+
+    def check_parity(self, models, texts, tolerance=PARITY_TOLERANCE):
+        """
+        Compare fast outputs against sklearn on the given texts.
+        Returns the largest absolute difference found, raising ValueError
+        if it exceeds the tolerance.
+        """
+        X_tfidf, X_pipe = models._extract_features(texts)
+        pairs = [
+            (self.predict_linear(X_tfidf), models.linear_model.predict(X_tfidf)),
+            (self.predict_proba_logistic(X_tfidf), models.logistic_model.predict_proba(X_tfidf)),
+            (self.predict_proba_pipeline(X_pipe), models.pipeline_model[-1].predict_proba(X_pipe)),
+            (self.predict_proba_svm(X_tfidf), models.svm_model.predict_proba(X_tfidf)),
+        ]
+        max_diff = max(float(np.max(np.abs(fast - reference))) for fast, reference in pairs)
+        if max_diff > tolerance:
+            raise ValueError(
+                f"Fast inference differs from sklearn by {max_diff:.2e} (tolerance {tolerance:.0e})"
+            )
+        svm_labels = models.svm_model.classes_[self.predict_svm(X_tfidf)[0]]
+        if not np.array_equal(svm_labels, models.svm_model.predict(X_tfidf)):
+            raise ValueError("Fast inference SVM labels differ from sklearn")
+        return max_diff
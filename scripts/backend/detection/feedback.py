@@ -0,0 +1,240 @@
+"""
+Online learning from user feedback.
+POST /api/feedback/ stores the correct label on the DetectionLog entry of a
+detection. A background thread applies the pending corrections in
+micro-batches: the linear-family models take a gradient step on copies of
+their weights, and the updated models are saved and published through the
+model registry like a retrain, so inference never waits on an update and
+the other workers pick it up on their next reload check. The SVM is not
+updated per correction but refreshed from the feedback on a schedule.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .log_writer import get_log_writer
+from .ml_models import models_lock, model_registry
+from .models import DetectionLog
+
+
+# How long to wait for this worker's queued logs when a detection is not found
+LOG_FLUSH_TIMEOUT = 5.0
+
+
+def record_feedback(detection_id, label):
+    """
+    Record label ('spam' or 'ham') as the correct verdict of a detection
+    and queue it for the online learner. Returns the DetectionLog entry;
+    raises DetectionLog.DoesNotExist for an unknown detection_id.
+    """
+    try:
+        log = DetectionLog.objects.get(detection_id=detection_id)
+    except DetectionLog.DoesNotExist:
+        # The log may still be queued in this worker's log writer
+        get_log_writer().flush(timeout=LOG_FLUSH_TIMEOUT)
+        log = DetectionLog.objects.get(detection_id=detection_id)
+
+    # Repeating the same correction is a no-op; a different one is applied again
+    if log.corrected_at is None or log.corrected_label != label:
+        log.corrected_label = label
+        log.corrected_at = timezone.now()
+        log.feedback_applied_at = None
+        log.save(update_fields=['corrected_label', 'corrected_at', 'feedback_applied_at'])
+        get_online_learner().notify()
+    return log
+
+
+class OnlineLearner:
+    """
+    Apply pending feedback to the published models in the background.
+
+    The learner wakes up every batch_size corrections received by this
+    worker or every flush_interval seconds, whichever comes first, and
+    applies up to batch_size pending corrections from the database (so
+    feedback received by a worker that has since stopped is not lost).
+    Every svm_refresh_interval seconds, if there is new feedback, the SVM
+    is refreshed from at most svm_max_examples corrections.
+    """
+
+    def __init__(self, batch_size=32, flush_interval=10.0, learning_rate=0.5,
+                 linear_learning_rate=0.1, svm_refresh_interval=3600.0, svm_max_examples=5000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.learning_rate = learning_rate
+        self.linear_learning_rate = linear_learning_rate
+        self.svm_refresh_interval = svm_refresh_interval
+        self.svm_max_examples = svm_max_examples
+
+        self.applied = 0
+        self.svm_refreshes = 0
+        self.failed = 0
+        self._received = 0
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def notify(self):
+        """Count a new correction, waking the learner once a batch is ready"""
+        self._ensure_started()
+        with self._stats_lock:
+            self._received += 1
+            if self._received >= self.batch_size:
+                self._wake.set()
+
+    def close(self, timeout=5.0):
+        """Stop the background thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'running': self._thread is not None and self._pid == os.getpid(),
+                'applied': self.applied,
+                'svm_refreshes': self.svm_refreshes,
+                'failed': self.failed,
+            }
+
+    def run_once(self):
+        """
+        Apply one micro-batch of pending feedback and refresh the SVM if
+        due, then save and publish the updated models.
+        Returns the number of corrections applied.
+        """
+        with models_lock(settings.ML_MODELS_PATH):
+            # Build on the latest saved models, not on a stale published copy
+            model_registry.reload_if_changed(wait=True)
+            models = model_registry.get()
+            started_at = timezone.now()
+
+            pending = list(
+                DetectionLog.objects
+                .filter(corrected_at__isnull=False, feedback_applied_at__isnull=True)
+                .order_by('corrected_at')
+                .values_list('pk', 'email', 'content', 'corrected_label')[:self.batch_size]
+            )
+            updated = models
+            if pending:
+                updated = updated.apply_feedback(
+                    [f"{email} {content}" for _, email, content, _ in pending],
+                    [label for *_, label in pending],
+                    self.learning_rate,
+                    self.linear_learning_rate
+                )
+
+            refreshed = self._refresh_svm(updated, started_at)
+            if refreshed is not None:
+                updated = refreshed
+            if updated is models:
+                return 0
+
+            updated.save_models()
+            model_registry.publish(updated)
+            # A correction changed after it was read stays pending
+            DetectionLog.objects.filter(
+                pk__in=[pk for pk, *_ in pending], corrected_at__lte=started_at
+            ).update(feedback_applied_at=timezone.now())
+
+        with self._stats_lock:
+            self.applied += len(pending)
+            self.svm_refreshes += refreshed is not None
+        print(
+            f"Published models version {updated.version} with {len(pending)} feedback corrections"
+            + (" and a refreshed SVM" if refreshed is not None else "")
+        )
+        return len(pending)
+
+    def _refresh_svm(self, models, now):
+        """Models with a refreshed SVM when the refresh is due and there is new feedback, else None"""
+        if not self.svm_refresh_interval:
+            return None
+        last = models.svm_refreshed_at
+        if last is not None and now - last < timedelta(seconds=self.svm_refresh_interval):
+            return None
+
+        feedback = DetectionLog.objects.filter(corrected_at__isnull=False, corrected_at__lte=now)
+        if last is not None and not feedback.filter(corrected_at__gt=last).exists():
+            return None
+        if models.svm_mode == 'sgd' and last is not None:
+            # The SGD SVM continues from its weights: only the new corrections
+            feedback = feedback.filter(corrected_at__gt=last)
+        rows = list(
+            feedback.order_by('-corrected_at')
+            .values_list('email', 'content', 'corrected_label')[:self.svm_max_examples]
+        )
+        if not rows:
+            return None
+        return models.refresh_svm(
+            [f"{email} {content}" for email, content, _ in rows],
+            [label for *_, label in rows],
+            now
+        )
+
+    def _ensure_started(self):
+        # Threads do not survive fork (gunicorn --preload), so each worker
+        # process starts its own thread on first use
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._stopping = False
+                    self._thread = threading.Thread(
+                        target=self._run, name='online-learner', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+                    atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._stats_lock:
+                self._received = 0
+            if self._stopping:
+                break
+            try:
+                # Keep going without waiting while full batches are pending
+                while self.run_once() >= self.batch_size and not self._stopping:
+                    pass
+            except Exception as e:
+                with self._stats_lock:
+                    self.failed += 1
+                print(f"Failed to apply feedback: {e}")
+                time.sleep(self.flush_interval)
+            finally:
+                close_old_connections()
+
+
+_learner_instance = None
+_learner_lock = threading.Lock()
+
+
+def get_online_learner():
+    """Get or create the learner configured in settings.ML_FEEDBACK"""
+    global _learner_instance
+    if _learner_instance is None:
+        with _learner_lock:
+            if _learner_instance is None:
+                config = settings.ML_FEEDBACK
+                _learner_instance = OnlineLearner(
+                    batch_size=config.get('BATCH_SIZE', 32),
+                    flush_interval=config.get('FLUSH_INTERVAL', 10.0),
+                    learning_rate=config.get('LEARNING_RATE', 0.5),
+                    linear_learning_rate=config.get('LINEAR_LEARNING_RATE', 0.1),
+                    svm_refresh_interval=config.get('SVM_REFRESH_INTERVAL', 3600.0),
+                    svm_max_examples=config.get('SVM_MAX_EXAMPLES', 5000)
+                )
+    return _learner_instance
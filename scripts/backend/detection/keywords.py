@@ -0,0 +1,180 @@
+"""
+Keyword lexicon behind the reasons, spam_score and ham_score of a result.
+A KeywordMatcher is built once from the lexicon and lower-cases each
+message once. Lexicons up to KeywordMatcher.REGEX_MIN_TERMS terms, like
+the built-in one, are matched with one substring search per term; only
+larger custom lexicons (ML_KEYWORD_LEXICON_PATH) are compiled into a
+regex that finds every term in a single scan. Terms match as substrings
+of the lower-cased text ("win" also matches "window").
+"""
+import json
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+
+LABELS = ('spam', 'ham')
+
+# term, label ('spam'/'ham'), score points, listed in reasons
+KeywordEntry = namedtuple('KeywordEntry', ['term', 'label', 'weight', 'reason'])
+
+DEFAULT_LEXICON = (
+    KeywordEntry('win', 'spam', 10, True),
+    KeywordEntry('free', 'spam', 10, True),
+    KeywordEntry('click', 'spam', 10, True),
+    KeywordEntry('urgent', 'spam', 10, True),
+    KeywordEntry('prize', 'spam', 10, True),
+    KeywordEntry('money', 'spam', 10, True),
+    KeywordEntry('offer', 'spam', 10, True),
+    KeywordEntry('limited', 'spam', 10, False),
+    KeywordEntry('act now', 'spam', 10, False),
+    KeywordEntry('meeting', 'ham', 10, True),
+    KeywordEntry('project', 'ham', 10, True),
+    KeywordEntry('thanks', 'ham', 10, True),
+    KeywordEntry('please', 'ham', 10, True),
+    KeywordEntry('team', 'ham', 10, True),
+    KeywordEntry('review', 'ham', 10, True),
+    KeywordEntry('attached', 'ham', 10, False),
+    KeywordEntry('follow up', 'ham', 10, False),
+)
+
+
+def load_lexicon(path):
+    """
+    Read a JSON lexicon file: a list of objects with "term", "label"
+    ('spam' or 'ham') and optionally "weight" (score points, default 10)
+    and "reason" (list the term in reasons, default false)
+    """
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)
+
+    entries = []
+    for item in items:
+        if item.get('label') not in LABELS or not item.get('term'):
+            raise ValueError(f"Invalid lexicon entry in {path}: {item}")
+        entries.append(KeywordEntry(
+            item['term'], item['label'], int(item.get('weight', 10)), bool(item.get('reason', False))
+        ))
+    return entries
+
+
+def _trie_pattern(terms):
+    """
+    Regex matching the longest of the terms at a position. Terms share
+    their common prefixes, so the engine does not retry every term.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def emit(node):
+        children = sorted((char, child) for char, child in node.items() if char)
+        if not children:
+            return ''
+        branches = [re.escape(char) + emit(child) for char, child in children]
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A term ending here is still a match when no longer one does
+        return f'(?:{pattern})?' if '' in node else pattern
+
+    return emit(trie)
+
+
+class KeywordMatcher:
+    """
+    Finds which lexicon entries occur in a text.
+
+    Lexicons of up to REGEX_MIN_TERMS terms (the built-in one has 17)
+    are checked with one C-level substring search per term, which is
+    faster than a Python regex at that size, so each term costs a pass
+    over the text. Larger ones are compiled into a single trie regex run
+    once over the text, whose cost barely depends on the lexicon size:
+    at each position it yields the longest term starting there, and a
+    prefix map adds the shorter terms that start at the same position.
+    """
+
+    # Above this many distinct terms, use the compiled single-scan regex. Per
+    # 200-character message: 17 terms 5.4 us by substring vs 9.5 us by regex,
+    # 64 terms 13.3 vs 16.9, 96 terms 18.6 vs 17.5, 256 terms 48.0 vs 27.6
+    REGEX_MIN_TERMS = 96
+
+    def __init__(self, entries):
+        self.entries = []
+        seen = set()
+        for entry in entries:
+            entry = entry._replace(term=entry.term.lower())
+            if (entry.term, entry.label) not in seen:
+                seen.add((entry.term, entry.label))
+                self.entries.append(entry)
+
+        self._term_entries = {}
+        for index, entry in enumerate(self.entries):
+            self._term_entries.setdefault(entry.term, []).append(index)
+        terms = list(self._term_entries)
+
+        self._pattern = None
+        if len(terms) > self.REGEX_MIN_TERMS:
+            self._pattern = re.compile('(?=(' + _trie_pattern(terms) + '))')
+            self._prefix_entries = {
+                term: [
+                    index
+                    for end in range(1, len(term) + 1)
+                    for index in self._term_entries.get(term[:end], ())
+                ]
+                for term in terms
+            }
+
+    def match(self, text: str):
+        """Lexicon entries found in text, in lexicon order"""
+        text = text.lower()
+        if self._pattern is None:
+            found = [
+                index
+                for term, indexes in self._term_entries.items() if term in text
+                for index in indexes
+            ]
+        else:
+            found = {
+                index
+                for term in set(self._pattern.findall(text))
+                for index in self._prefix_entries[term]
+            }
+        return [self.entries[index] for index in sorted(found)]
+
+    def analyze(self, text: str, max_reasons: int):
+        """
+        Match text once. Returns (reason entries, spam score, ham score);
+        reason entries list spam terms before ham terms, at most max_reasons.
+        """
+        matched = self.match(text)
+        scores = dict.fromkeys(LABELS, 0)
+        for entry in matched:
+            scores[entry.label] += entry.weight
+        reasons = [
+            entry
+            for label in LABELS
+            for entry in matched if entry.reason and entry.label == label
+        ]
+        return reasons[:max_reasons], scores['spam'], scores['ham']
+
+
+_matcher_instance = None
+_matcher_lock = threading.Lock()
+
+
+def get_keyword_matcher():
+    """
+    Get or create the matcher for settings.ML_KEYWORD_LEXICON_PATH,
+    or for the built-in lexicon when it is not set
+    """
+    global _matcher_instance
+    if _matcher_instance is None:
+        with _matcher_lock:
+            if _matcher_instance is None:
+                path = settings.ML_KEYWORD_LEXICON_PATH
+                _matcher_instance = KeywordMatcher(load_lexicon(path) if path else DEFAULT_LEXICON)
+    return _matcher_instance
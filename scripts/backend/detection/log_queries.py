@@ -0,0 +1,105 @@
+"""
+Filtering and keyset (cursor) pagination for DetectionLog listings.
+Rows are always walked newest first on (created_at, id), which matches
+the composite indexes declared on the model.
+"""
+import base64
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DetectionLog
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidLogQuery(ValueError):
+    """Raised for malformed filter or cursor parameters"""
+
+
+def encode_cursor(log):
+    """Opaque cursor pointing just after the given log in listing order"""
+    raw = f"{log.created_at.isoformat()}|{log.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidLogQuery('Invalid cursor')
+
+
+def parse_time(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise InvalidLogQuery(f'Invalid {name}: expected an ISO 8601 datetime')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def filter_logs(params):
+    """
+    DetectionLog queryset for the filters in params, newest first:
+    prediction (spam/ham), domain (sender domain), since and until
+    (ISO 8601 datetimes, since inclusive, until exclusive)
+    """
+    queryset = DetectionLog.objects.order_by('-created_at', '-id')
+
+    prediction = params.get('prediction')
+    if prediction:
+        prediction = prediction.upper()
+        if prediction not in ('SPAM', 'HAM'):
+            raise InvalidLogQuery('Invalid prediction: expected spam or ham')
+        queryset = queryset.filter(prediction=prediction)
+
+    domain = params.get('domain')
+    if domain:
+        queryset = queryset.filter(sender_domain=domain.lower().lstrip('@'))
+
+    since = parse_time(params, 'since')
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    until = parse_time(params, 'until')
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+
+    return queryset
+
+
+def paginate_logs(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the queryset after the cursor.
+    Returns (logs, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    logs = list(queryset[:limit + 1])
+    if len(logs) <= limit:
+        return logs, None
+    logs = logs[:limit]
+    return logs, encode_cursor(logs[-1])
+
+
+def parse_limit(params):
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise InvalidLogQuery('Invalid limit')
+    if limit < 1:
+        raise InvalidLogQuery('Invalid limit')
+    return min(limit, MAX_PAGE_SIZE)
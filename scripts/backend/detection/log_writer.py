@@ -0,0 +1,214 @@
+"""
+Buffered writer for DetectionLog rows.
+In 'async' mode the detect views only enqueue the rows; a background
+thread inserts them with bulk_create, in batches of up to batch_size rows
+or every flush_interval seconds, so the SQLite write lock stays off the
+request path. 'sync' mode inserts immediately and is meant for tests.
+Each batch is counted in the hourly rollups (see rollups.py) in the same
+transaction as its insert.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import DetectionLog
+from .rollups import add_to_rollups
+
+
+_STOP = object()
+
+
+class DetectionLogWriter:
+    """
+    Queue DetectionLog instances and insert them in bulk.
+
+    When the queue is full, overflow='drop' discards the new rows right
+    away and overflow='block' waits up to block_timeout seconds for room
+    (backpressure) before discarding them, that wait being shared by all
+    the rows of a write_many call. Dropped rows are counted.
+    """
+
+    MODES = ('async', 'sync')
+    OVERFLOW_POLICIES = ('drop', 'block')
+
+    def __init__(self, mode='async', batch_size=200, flush_interval=1.0, max_queue=10000,
+                 overflow='drop', block_timeout=0.5):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown log writer mode: {mode}")
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log writer overflow policy: {overflow}")
+
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def write(self, log, block=True):
+        """Write (or enqueue) a single unsaved DetectionLog"""
+        self.write_many([log], block)
+
+    def write_many(self, logs, block=True):
+        """
+        Write (or enqueue) a list of unsaved DetectionLog instances.
+        block=False never waits for room in the queue, whatever the overflow
+        policy, for callers that must not block (the async detect view).
+        """
+        if self.mode == 'sync':
+            self._insert(logs)
+            return
+
+        log_queue = self._ensure_started()
+        # One block_timeout for the whole call, not for each row
+        deadline = time.monotonic() + self.block_timeout
+        dropped = 0
+        for log in logs:
+            try:
+                remaining = deadline - time.monotonic()
+                if block and self.overflow == 'block' and remaining > 0:
+                    log_queue.put(log, timeout=remaining)
+                else:
+                    log_queue.put_nowait(log)
+            except queue.Full:
+                dropped += 1
+        if dropped:
+            with self._stats_lock:
+                self.dropped += dropped
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been inserted"""
+        if self._queue is not None and self._pid == os.getpid():
+            if timeout is None:
+                self._queue.join()
+                return
+            deadline = time.monotonic() + timeout
+            while self._queue.unfinished_tasks and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+    def close(self, timeout=5.0):
+        """Flush the queue and stop the background thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'mode': self.mode,
+                'queued': self._queue.qsize() if self._queue is not None else 0,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+    def _ensure_started(self):
+        # Threads do not survive fork (gunicorn --preload), so each worker
+        # process starts its own queue and thread on first use
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                    self._thread = threading.Thread(
+                        target=self._run, name='detection-log-writer', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+                    atexit.register(self.close)
+        return self._queue
+
+    def _run(self):
+        log_queue = self._queue
+        stopping = False
+        while not stopping:
+            try:
+                item = log_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            taken = 1
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = log_queue.get(timeout=remaining)
+                    taken += 1
+                except queue.Empty:
+                    break
+
+            # Drain whatever is left when shutting down
+            while stopping:
+                try:
+                    item = log_queue.get_nowait()
+                    taken += 1
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    batch.append(item)
+
+            if batch:
+                self._insert(batch)
+            for _ in range(taken):
+                log_queue.task_done()
+
+        close_old_connections()
+
+    def _insert(self, logs):
+        try:
+            with transaction.atomic():
+                DetectionLog.objects.bulk_create(logs, batch_size=self.batch_size)
+                add_to_rollups(logs)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += len(logs)
+            print(f"Failed to write {len(logs)} detection logs: {e}")
+            return
+        with self._stats_lock:
+            self.written += len(logs)
+
+
+_writer_instance = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """Get or create the writer configured in settings.DETECTION_LOG_WRITER"""
+    global _writer_instance
+    if _writer_instance is None:
+        with _writer_lock:
+            if _writer_instance is None:
+                config = settings.DETECTION_LOG_WRITER
+                _writer_instance = DetectionLogWriter(
+                    mode=config.get('MODE', 'async'),
+                    batch_size=config.get('BATCH_SIZE', 200),
+                    flush_interval=config.get('FLUSH_INTERVAL', 1.0),
+                    max_queue=config.get('MAX_QUEUE', 10000),
+                    overflow=config.get('OVERFLOW', 'drop'),
+                    block_timeout=config.get('BLOCK_TIMEOUT', 0.5)
+                )
+    return _writer_instance
@@ -0,0 +1,307 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import sklearn
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+from detection.ml_models import SpamDetectionModels, build_models
+from detection.synthetic import generate_corpus, write_jsonl
+
+
+# Leaf metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'messages_per_second': True,
+    'wall_seconds': False,
+    'peak_rss_mb': False,
+}
+
+
+def _parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',') if size.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma-separated list of integers, got {value!r}")
+    if any(size < 1 for size in sizes):
+        raise CommandError(f"Sizes must be at least 1, got {value!r}")
+    return sizes
+
+
+def _latency_stats(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        'samples': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, None where it cannot be read"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _train(models, records, mode, workdir):
+    """Train models on records in-memory or streaming; returns train_models' results"""
+    if mode == 'streaming':
+        corpus_path = os.path.join(workdir, 'corpus.jsonl')
+        write_jsonl(records, corpus_path)
+        return models.train_models_streaming(corpus_path)
+    # train_models reads its training set from SAMPLE_DATA, unless a corpus is configured
+    models.SAMPLE_DATA = [(record.content, record.label) for record in records]
+    with override_settings(ML_TRAINING_CORPUS=None):
+        return models.train_models()
+
+
+def _train_once(mode, size, spam_ratio, seed):
+    """
+    Run in a fresh process per corpus size, so peak RSS belongs to this
+    training run alone
+    """
+    records = generate_corpus(size, spam_ratio, seed)
+    baseline_rss = _peak_rss_mb()
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        models = build_models(models_path=workdir)
+        started = time.perf_counter()
+        results = _train(models, records, mode, workdir)
+        wall_seconds = time.perf_counter() - started
+        bundle_bytes = SpamDetectionModels.read_manifest(workdir)['size']
+    return {
+        'messages': size,
+        'wall_seconds': wall_seconds,
+        'peak_rss_mb': _peak_rss_mb(),
+        'baseline_rss_mb': baseline_rss,
+        'bundle_bytes': bundle_bytes,
+        'models': results,
+    }
+
+
+def _flatten(report, prefix=''):
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)):
+            yield path, key, value
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the ensemble on a synthetic corpus: per-model and predict_all_models '
+        'latency (p50/p95/p99), batch throughput, and train_models wall time and peak '
+        'memory as the corpus grows. Writes a JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the JSON report to this file (default: stdout)')
+        parser.add_argument('--compare', help='Earlier JSON report to compare the results against')
+        parser.add_argument(
+            '--mode', choices=('memory', 'streaming'),
+            help='Train in memory (train_models) or out of core (train_models_streaming); '
+                 'default: streaming when ML_TRAINING_CORPUS is set'
+        )
+        parser.add_argument('--corpus-size', type=int, default=2000,
+                            help='Messages the inference benchmark models are trained on (default: 2000)')
+        parser.add_argument('--spam-ratio', type=float, default=0.4, help='Share of spam in the corpus (default: 0.4)')
+        parser.add_argument('--seed', type=int, default=42, help='Synthetic corpus seed (default: 42)')
+        parser.add_argument('--iterations', type=int, default=300,
+                            help='Single-message predictions timed per latency measurement (default: 300)')
+        parser.add_argument('--batch-sizes', default='1,10,100,1000',
+                            help='Batch sizes for the throughput measurement (default: 1,10,100,1000)')
+        parser.add_argument('--train-sizes', default='1000,4000',
+                            help='Corpus sizes for the training measurement (default: 1000,4000)')
+        parser.add_argument('--saved', action='store_true',
+                            help='Benchmark inference on the models in ML_MODELS_PATH instead of training new ones')
+        parser.add_argument('--skip-inference', action='store_true', help='Only measure training')
+        parser.add_argument('--skip-training', action='store_true', help='Only measure inference')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['corpus_size'] < 10:
+            raise CommandError('--iterations must be at least 1 and --corpus-size at least 10')
+        if not 0 < options['spam_ratio'] < 1:
+            raise CommandError('--spam-ratio must be between 0 and 1')
+        batch_sizes = _parse_sizes(options['batch_sizes'])
+        train_sizes = _parse_sizes(options['train_sizes'])
+        mode = options['mode'] or ('streaming' if settings.ML_TRAINING_CORPUS else 'memory')
+
+        report = {'meta': self._meta(mode, options)}
+        if not options['skip_inference']:
+            report['inference'] = self._benchmark_inference(mode, batch_sizes, options)
+        if not options['skip_training']:
+            report['training'] = self._benchmark_training(mode, train_sizes, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self._compare(options['compare'], report)
+
+    def _meta(self, mode, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sklearn_version': sklearn.__version__,
+            'numpy_version': np.__version__,
+            'mode': mode,
+            'inference_engine': settings.ML_INFERENCE_ENGINE,
+            'svm_mode': settings.ML_SVM_MODE,
+            'cascade': settings.ML_CASCADE,
+            'options': {
+                key: options[key] for key in (
+                    'corpus_size', 'spam_ratio', 'seed', 'iterations',
+                    'batch_sizes', 'train_sizes', 'saved',
+                )
+            },
+        }
+
+    def _benchmark_inference(self, mode, batch_sizes, options):
+        # Messages the models were not trained on
+        messages = [
+            (record.email, record.content)
+            for record in generate_corpus(
+                max(options['iterations'], max(batch_sizes)), options['spam_ratio'], options['seed'] + 1
+            )
+        ]
+
+        with tempfile.TemporaryDirectory() as workdir:
+            if options['saved']:
+                models = build_models()
+                if not models.load_models():
+                    raise CommandError('No trained models found, run manage.py train_models first')
+            else:
+                self.stderr.write(f"Training {mode} models on {options['corpus_size']} synthetic messages...")
+                models = build_models(models_path=workdir)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _train(
+                        models, generate_corpus(options['corpus_size'], options['spam_ratio'], options['seed']),
+                        mode, workdir
+                    )
+
+            # Warm up caches and lazily built state
+            models.predict_all_models_batch(messages[:10])
+
+            self.stderr.write('Measuring per-model latency...')
+            timings = {'features': []}
+            timings.update({key: [] for key, _ in models.MODEL_STAGES})
+            for email, content in messages[:options['iterations']]:
+                text = f"{email} {content}"
+                started = time.perf_counter()
+                X_tfidf, X_pipe = models._extract_features([text])
+                timings['features'].append(time.perf_counter() - started)
+                for key, _ in models.MODEL_STAGES:
+                    X = X_pipe if key == 'pipeline' else X_tfidf
+                    started = time.perf_counter()
+                    models._run_model(key, X)
+                    timings[key].append(time.perf_counter() - started)
+
+            self.stderr.write('Measuring predict_all_models latency...')
+            ensemble = []
+            for email, content in messages[:options['iterations']]:
+                started = time.perf_counter()
+                models.predict_all_models(email, content)
+                ensemble.append(time.perf_counter() - started)
+
+            self.stderr.write('Measuring batch throughput...')
+            batches = {}
+            for batch_size in batch_sizes:
+                batch = messages[:batch_size]
+                scored = 0
+                started = time.perf_counter()
+                # At least 3 batches and about a second per size
+                while scored < 3 * batch_size or time.perf_counter() - started < 1.0:
+                    models.predict_all_models_batch(batch)
+                    scored += batch_size
+                elapsed = time.perf_counter() - started
+                batches[str(batch_size)] = {
+                    'messages': scored,
+                    'seconds': elapsed,
+                    'messages_per_second': scored / elapsed,
+                }
+
+        return {
+            'model_version': models.version,
+            'stages': {key: _latency_stats(seconds) for key, seconds in timings.items()},
+            'predict_all_models': _latency_stats(ensemble),
+            'batch': batches,
+        }
+
+    def _benchmark_training(self, mode, train_sizes, options):
+        results = {}
+        context = multiprocessing.get_context('spawn')
+        for size in train_sizes:
+            self.stderr.write(f"Training {mode} models on {size} synthetic messages...")
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                result = pool.submit(_train_once, mode, size, options['spam_ratio'], options['seed']).result()
+            peak_rss = result['peak_rss_mb']
+            self.stderr.write(
+                f"  {result['wall_seconds']:.2f}s"
+                + (f", peak RSS {peak_rss:.0f} MB" if peak_rss is not None else "")
+            )
+            results[str(size)] = result
+        return {mode: results}
+
+    def _compare(self, path, report, threshold=0.10):
+        """Print each metric next to its value in an earlier report, flagging regressions"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        previous = {path: value for path, _, value in _flatten(baseline)}
+        commit = baseline.get('meta', {}).get('commit') or path
+        self.stderr.write(f"\nCompared with {commit}:")
+        regressions = 0
+        for metric_path, metric, value in _flatten(report):
+            old = previous.get(metric_path)
+            if not old:
+                continue
+            change = (value - old) / old
+            worse = -change if COMPARED_METRICS[metric] else change
+            flag = ''
+            if worse > threshold:
+                flag = '  <- regression'
+                regressions += 1
+            self.stderr.write(f"  {metric_path}: {old:.3f} -> {value:.3f} ({change:+.1%}){flag}")
+        self.stderr.write(f"{regressions} metrics regressed by more than {threshold:.0%}")
@@ -0,0 +1,180 @@
+import contextlib
+import copy
+import io
+import json
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.corpus import CorpusError, read_corpus
+from detection.ml_models import SpamDetectionModels, build_models, models_lock
+from detection.synthetic import generate_corpus
+
+
+# /proc/self/status fields reported by _resident_mb, in kB
+MEMORY_FIELDS = {'VmRSS': 'rss_mb', 'RssAnon': 'anonymous_mb', 'RssFile': 'file_mb'}
+
+
+def _resident_mb():
+    """
+    Resident memory of this process (Linux only, else empty): anonymous
+    pages are private to the process, file pages include the memory-mapped
+    bundle arrays that workers share
+    """
+    memory = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in MEMORY_FIELDS:
+                    memory[MEMORY_FIELDS[name]] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def _loaded_memory(models_path, messages):
+    """
+    Run in a fresh process: memory added by loading the bundle in
+    models_path the way a worker does and scoring messages with it
+    """
+    models = build_models(models_path=models_path)
+    before = _resident_mb()
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.load_models()
+    models.predict_all_models_batch(messages)
+    after = _resident_mb()
+    return {key: after[key] - before[key] for key in after}
+
+
+def _bundle_size(models, models_path):
+    """Size in bytes of the bundle save_models writes for models"""
+    saved = copy.copy(models)
+    saved.models_path = Path(models_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        saved.save_models()
+    return SpamDetectionModels.read_manifest(models_path)['size']
+
+
+def _accuracy(models, texts, labels, messages):
+    """Accuracy of each model and of the ensemble vote, and the ensemble verdicts"""
+    X_tfidf, X_pipe = models._extract_features(texts)
+    accuracy = {
+        models.RESULT_KEYS[key]: float(np.mean(
+            models._run_model(key, X_pipe if key == 'pipeline' else X_tfidf)[0] == labels
+        ))
+        for key, _ in models.MODEL_STAGES
+    }
+    verdicts = np.array([
+        'spam' if result['is_spam'] else 'ham' for result in models.predict_all_models_batch(messages)
+    ])
+    accuracy['ensemble'] = float(np.mean(verdicts == labels))
+    return accuracy, verdicts
+
+
+class Command(BaseCommand):
+    help = (
+        'Compact the saved models (prune near-zero features, compact vocabularies, float32 '
+        'weights) and report bundle size, memory and accuracy against the original models. '
+        'Writes a JSON report; --save replaces the saved models with the compacted ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prune-threshold', type=float, default=settings.ML_COMPACTION.get('PRUNE_THRESHOLD', 0.05),
+            help='Keep a feature when its weight reaches this share of the largest weight in some model '
+                 '(default: ML_COMPACTION_PRUNE_THRESHOLD)'
+        )
+        parser.add_argument(
+            '--corpus',
+            help='Labeled JSONL/CSV corpus to measure accuracy on (default: a synthetic corpus)'
+        )
+        parser.add_argument('--eval-size', type=int, default=2000,
+                            help='Synthetic messages to measure accuracy on (default: 2000)')
+        parser.add_argument('--seed', type=int, default=7, help='Synthetic corpus seed (default: 7)')
+        parser.add_argument('--output', help='Write the JSON report to this file (default: stdout)')
+        parser.add_argument('--save', action='store_true',
+                            help='Save the compacted models as a new version in ML_MODELS_PATH')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['prune_threshold'] < 1:
+            raise CommandError('--prune-threshold must be between 0 and 1')
+        if options['eval_size'] < 1:
+            raise CommandError('--eval-size must be at least 1')
+
+        original = build_models()
+        with contextlib.redirect_stdout(io.StringIO()):
+            loaded = original.load_models()
+        if not loaded:
+            raise CommandError('No trained models found, run manage.py train_models first')
+
+        if options['corpus']:
+            try:
+                records = [record for record in read_corpus(options['corpus']) if record.label is not None]
+            except (CorpusError, OSError) as e:
+                raise CommandError(str(e))
+            if not records:
+                raise CommandError(f"No labeled messages in {options['corpus']}")
+        else:
+            records = generate_corpus(options['eval_size'], seed=options['seed'])
+        messages = [(record.email, record.content) for record in records]
+        texts = [f"{email} {content}" for email, content in messages]
+        labels = np.array([record.label for record in records])
+
+        self.stderr.write(f"Compacting models version {original.version}...")
+        compacted = original._derived()
+        with contextlib.redirect_stdout(io.StringIO()):
+            features = compacted.compact(options['prune_threshold'])
+            compacted._build_inference_engine()
+
+        self.stderr.write(f"Measuring accuracy on {len(records)} messages...")
+        original_accuracy, original_verdicts = _accuracy(original, texts, labels, messages)
+        compacted_accuracy, compacted_verdicts = _accuracy(compacted, texts, labels, messages)
+
+        self.stderr.write('Measuring bundle size and memory after loading...')
+        bundle_bytes = {}
+        memory_mb = {}
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, models in (('original', original), ('compacted', compacted)):
+                models_path = Path(workdir) / name
+                models_path.mkdir()
+                bundle_bytes[name] = _bundle_size(models, models_path)
+                # A fresh process per bundle, so nothing else is resident in it
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    memory_mb[name] = pool.submit(_loaded_memory, str(models_path), messages[:100]).result()
+
+        report = {
+            'model_version': original.version,
+            'prune_threshold': options['prune_threshold'],
+            'features': features,
+            'bundle_bytes': bundle_bytes,
+            'memory_mb': memory_mb,
+            'accuracy': {'original': original_accuracy, 'compacted': compacted_accuracy},
+            'evaluated_messages': len(records),
+            'verdict_agreement': float(np.mean(original_verdicts == compacted_verdicts)),
+            'saved_version': None,
+        }
+
+        if options['save']:
+            with models_lock(original.models_path):
+                # Do not replace models retrained (or updated by feedback) in the meantime
+                if SpamDetectionModels.saved_version(original.models_path) != original.version:
+                    raise CommandError('The saved models changed while compacting, run the command again')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    compacted.save_models()
+            report['saved_version'] = compacted.version
+            self.stderr.write(f"Saved compacted models version {compacted.version}")
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
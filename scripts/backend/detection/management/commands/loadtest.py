@@ -0,0 +1,429 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.management.commands.benchmark import _latency_stats, _train
+from detection.ml_models import build_models
+from detection.synthetic import generate_corpus
+
+
+ENDPOINTS = ('detect', 'logs', 'train')
+
+# Responses that count as served; 409 is a training job already running
+SUCCESS_STATUSES = {'detect': {200}, 'logs': {200}, 'train': {202, 409}}
+
+# Upper bounds, except throughput_rps (a lower bound)
+SLO_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'error_rate', 'throughput_rps')
+DEFAULT_SLOS = 'detect.p95_ms=500,detect.p99_ms=1000,logs.p95_ms=500,error_rate=0.01'
+
+# Settings of the server under test: the project settings with its own
+# SQLite database and models, and DEBUG off as in production
+SERVER_SETTINGS = """from pathlib import Path
+
+from config.settings import *  # noqa: F401,F403
+
+DEBUG = False
+DATABASES = {{'default': {{'ENGINE': 'django.db.backends.sqlite3', 'NAME': {database!r}}}}}
+ML_MODELS_PATH = Path({models_path!r})
+"""
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise CommandError(f"Unknown endpoint in --mix: {name!r} (expected {', '.join(ENDPOINTS)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Expected endpoint=weight in --mix, got {part!r}")
+        if mix[name] < 0:
+            raise CommandError(f"Weights in --mix must not be negative, got {part!r}")
+    if not sum(mix.values()):
+        raise CommandError('--mix needs at least one positive weight')
+    return mix
+
+
+def _parse_slos(values):
+    """[(endpoint or None, metric, target)] from endpoint.metric=value specs"""
+    slos = {}
+    for value in values:
+        for part in filter(None, (part.strip() for part in value.split(','))):
+            name, _, target = part.partition('=')
+            endpoint, _, metric = name.strip().rpartition('.')
+            if endpoint and endpoint not in ENDPOINTS or metric not in SLO_METRICS:
+                raise CommandError(
+                    f"Invalid SLO {part!r}: expected [endpoint.]metric=value with a metric "
+                    f"among {', '.join(SLO_METRICS)}"
+                )
+            try:
+                slos[(endpoint or None, metric)] = float(target)
+            except ValueError:
+                raise CommandError(f"Invalid SLO {part!r}: the value must be a number")
+    return [(endpoint, metric, target) for (endpoint, metric), target in slos.items()]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _Server:
+    """The app under gunicorn, in its own process group"""
+
+    def __init__(self, workdir, options):
+        self.workdir = Path(workdir)
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        (self.workdir / 'loadtest_settings.py').write_text(SERVER_SETTINGS.format(
+            database=str(self.workdir / 'db.sqlite3'),
+            models_path=str(self.workdir / 'ml_models'),
+        ))
+        self.env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='loadtest_settings',
+            PYTHONPATH=os.pathsep.join(filter(None, (
+                str(self.workdir), str(settings.BASE_DIR), os.environ.get('PYTHONPATH')
+            ))),
+        )
+        self.command = [
+            sys.executable, '-m', 'gunicorn', 'config.wsgi:application',
+            '--bind', f"127.0.0.1:{self.port}",
+            '--workers', str(options['workers']),
+            '--threads', str(options['threads']),
+            '--chdir', str(settings.BASE_DIR),
+            '--log-level', 'warning',
+        ] + shlex.split(options['gunicorn_args'])
+        self.log_file = self.workdir / 'gunicorn.log'
+        self.process = None
+
+    def migrate(self):
+        result = subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'migrate', '-v', '0'],
+            env=self.env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Could not create the load test database:\n{result.stderr}")
+
+    def start(self, timeout=60):
+        with open(self.log_file, 'w') as log:
+            self.process = subprocess.Popen(
+                self.command, env=self.env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+            )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError(f"gunicorn exited with code {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                with urllib.request.urlopen(f"{self.url}/api/health/", timeout=2) as response:
+                    if response.status == 200:
+                        return
+            except (OSError, urllib.error.URLError):
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise CommandError(f"gunicorn did not answer within {timeout}s:\n{self.log_tail()}")
+
+    def stop(self, timeout=30):
+        """Stop gunicorn and anything it started (training jobs)"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+    def log_tail(self, lines=30):
+        try:
+            return '\n'.join(self.log_file.read_text(errors='replace').splitlines()[-lines:])
+        except OSError:
+            return ''
+
+
+def _send(url, method, body, timeout):
+    """(status or None, response body, error) of one request"""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read(), None
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), None
+    except (OSError, urllib.error.URLError) as e:
+        return None, b'', type(getattr(e, 'reason', e)).__name__
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the API end to end: start the app under gunicorn on a temporary SQLite '
+        'database and synthetic-corpus models, send a mix of detect, logs and train requests '
+        'at a target rate, and report throughput, error rate and p50/p95/p99 latency as JSON. '
+        'Fails when a service-level target (--slo) is missed. Needs no network access.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (default: 2)')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker (default: 4)')
+        parser.add_argument('--gunicorn-args', default='',
+                            help='Extra gunicorn arguments, e.g. "--preload --worker-class gthread"')
+        parser.add_argument('--rate', type=float, default=20, help='Target requests per second (default: 20)')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds of measured traffic (default: 30)')
+        parser.add_argument('--warmup', type=float, default=5,
+                            help='Seconds of traffic before the measurement, not reported (default: 5)')
+        parser.add_argument('--mix', default='detect=90,logs=9,train=1',
+                            help='Relative weights of the endpoints (default: detect=90,logs=9,train=1)')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Most requests in flight at once (default: 64)')
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds before a request fails (default: 10)')
+        parser.add_argument(
+            '--slo', action='append', default=None,
+            help=f'Service-level target [endpoint.]metric=value, repeatable or comma-separated; metrics: '
+                 f'{", ".join(SLO_METRICS)} (default: {DEFAULT_SLOS})'
+        )
+        parser.add_argument('--corpus-size', type=int, default=2000,
+                            help='Synthetic messages the served models are trained on (default: 2000)')
+        parser.add_argument('--seed', type=int, default=7, help='Synthetic corpus and traffic seed (default: 7)')
+        parser.add_argument('--train-timeout', type=float, default=120,
+                            help='Seconds to wait for the training jobs started by the traffic (default: 120)')
+        parser.add_argument('--output', help='Write the JSON report to this file (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['threads'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--workers, --threads and --concurrency must be at least 1')
+        if options['rate'] <= 0 or options['duration'] <= 0 or options['warmup'] < 0:
+            raise CommandError('--rate and --duration must be positive and --warmup not negative')
+        if options['corpus_size'] < 10:
+            raise CommandError('--corpus-size must be at least 10')
+        if importlib.util.find_spec('gunicorn') is None:
+            raise CommandError('gunicorn is not installed (pip install -r requirements.txt)')
+        mix = _parse_mix(options['mix'])
+        slos = _parse_slos(options['slo'] or [DEFAULT_SLOS])
+
+        with tempfile.TemporaryDirectory() as workdir:
+            server = _Server(workdir, options)
+            self.stderr.write('Creating the database...')
+            server.migrate()
+            self.stderr.write(f"Training the models on {options['corpus_size']} synthetic messages...")
+            models = build_models(models_path=Path(workdir) / 'ml_models')
+            with contextlib.redirect_stdout(io.StringIO()):
+                _train(models, generate_corpus(options['corpus_size'], seed=options['seed']), 'memory', workdir)
+
+            self.stderr.write(
+                f"Starting gunicorn ({options['workers']} workers x {options['threads']} threads)..."
+            )
+            server.start()
+            try:
+                samples = self._run_traffic(server.url, mix, options)
+                jobs = self._wait_for_training(server.url, samples, options['train_timeout'])
+            finally:
+                server.stop()
+            server_errors = [
+                line for line in server.log_tail(200).splitlines()
+                if 'Traceback' in line or 'Error' in line
+            ]
+
+        report = self._report(samples, mix, options)
+        report['training_jobs'] = jobs
+        report['server_log_errors'] = server_errors[-20:]
+        report['slos'] = self._check_slos(report, slos)
+        report['passed'] = all(slo['passed'] for slo in report['slos'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        missed = [slo for slo in report['slos'] if not slo['passed']]
+        if missed:
+            raise CommandError('Missed SLOs: ' + ', '.join(
+                f"{slo['name']} = {slo['actual']} (target {slo['target']})" for slo in missed
+            ))
+
+    def _requests(self, mix, options):
+        """Scheduled (offset seconds, endpoint, method, path, body) for the whole run"""
+        rng = random.Random(options['seed'])
+        messages = generate_corpus(2000, seed=options['seed'] + 1)
+        domains = sorted({record.email.rsplit('@', 1)[-1] for record in messages})
+        endpoints, weights = zip(*mix.items())
+        total = int((options['warmup'] + options['duration']) * options['rate'])
+        planned = []
+        for index in range(total):
+            endpoint = rng.choices(endpoints, weights)[0]
+            if endpoint == 'detect':
+                record = messages[index % len(messages)]
+                request = ('POST', '/api/detect/', {'email': record.email, 'content': record.content})
+            elif endpoint == 'logs':
+                params = {'limit': 50}
+                filter_kind = rng.choice(('prediction', 'domain', None))
+                if filter_kind == 'prediction':
+                    params['prediction'] = rng.choice(('spam', 'ham'))
+                elif filter_kind == 'domain':
+                    params['domain'] = rng.choice(domains)
+                request = ('GET', f"/api/logs/?{urllib.parse.urlencode(params)}", None)
+            else:
+                request = ('POST', '/api/train/', None)
+            planned.append((index / options['rate'], endpoint) + request)
+        return planned
+
+    def _run_traffic(self, url, mix, options):
+        """
+        Send the planned requests on schedule (open loop: a slow server does
+        not slow the sending down). Latency is measured from the scheduled
+        time, so it includes any wait for a free client thread.
+        """
+        planned = self._requests(mix, options)
+        samples = []
+        lock = threading.Lock()
+        self.stderr.write(
+            f"Sending {len(planned)} requests at {options['rate']:g}/s "
+            f"({options['warmup']:g}s warmup + {options['duration']:g}s)..."
+        )
+
+        def call(scheduled, offset, endpoint, method, path, body):
+            status, content, error = _send(url + path, method, body, options['timeout'])
+            latency = time.perf_counter() - scheduled
+            sample = {'offset': offset, 'endpoint': endpoint, 'latency': latency, 'status': status, 'error': error}
+            if endpoint == 'train' and status == 202:
+                sample['job_id'] = json.loads(content)['job_id']
+            with lock:
+                samples.append(sample)
+
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            started = time.perf_counter()
+            for offset, *request in planned:
+                delay = started + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(call, started + offset, offset, *request)
+        return samples
+
+    def _wait_for_training(self, url, samples, timeout):
+        """Final status of the training jobs the traffic started"""
+        jobs = {sample['job_id']: None for sample in samples if 'job_id' in sample}
+        if jobs:
+            self.stderr.write(f"Waiting for {len(jobs)} training jobs...")
+        deadline = time.monotonic() + timeout
+        while any(job is None or job['status'] == 'running' for job in jobs.values()):
+            for job_id in jobs:
+                status, content, _ = _send(f"{url}/api/train/{job_id}/", 'GET', None, 10)
+                if status == 200:
+                    jobs[job_id] = json.loads(content)
+            if time.monotonic() > deadline:
+                break
+            time.sleep(1)
+        return [
+            {
+                'job_id': job_id,
+                'status': job['status'] if job else 'unknown',
+                'seconds': (
+                    (datetime.fromisoformat(job['finished_at']) - datetime.fromisoformat(job['created_at']))
+                    .total_seconds() if job and job['finished_at'] else None
+                ),
+            }
+            for job_id, job in jobs.items()
+        ]
+
+    def _stats(self, samples, seconds):
+        served = [
+            sample for sample in samples if sample['status'] in SUCCESS_STATUSES[sample['endpoint']]
+        ]
+        errors = len(samples) - len(served)
+        stats = {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'throughput_rps': len(served) / seconds,
+            'statuses': dict(Counter(
+                str(sample['status'] or sample['error']) for sample in samples
+            ).most_common()),
+        }
+        if served:
+            stats.update(_latency_stats([sample['latency'] for sample in served]))
+        return stats
+
+    def _report(self, samples, mix, options):
+        measured = [sample for sample in samples if sample['offset'] >= options['warmup']]
+        # Until the last measured response, when a saturated server answers after the schedule ends
+        seconds = max([options['duration']] + [
+            sample['offset'] + sample['latency'] - options['warmup'] for sample in measured
+        ])
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'cpu_count': os.cpu_count(),
+                'options': {
+                    key: options[key] for key in (
+                        'workers', 'threads', 'gunicorn_args', 'rate', 'duration', 'warmup',
+                        'concurrency', 'timeout', 'corpus_size', 'seed',
+                    )
+                },
+                'mix': mix,
+                'settings': {
+                    'inference_engine': settings.ML_INFERENCE_ENGINE,
+                    'svm_mode': settings.ML_SVM_MODE,
+                    'log_mode': settings.DETECTION_LOG_WRITER.get('MODE'),
+                    'micro_batch': settings.DETECTION_MICRO_BATCH.get('ENABLED'),
+                },
+            },
+            'overall': self._stats(measured, seconds),
+            'endpoints': {
+                endpoint: self._stats(
+                    [sample for sample in measured if sample['endpoint'] == endpoint], seconds
+                )
+                for endpoint in mix if mix[endpoint] > 0
+            },
+        }
+        report['overall']['target_rps'] = options['rate']
+        report['overall']['seconds'] = seconds
+        return report
+
+    def _check_slos(self, report, slos):
+        results = []
+        for endpoint, metric, target in slos:
+            stats = report['endpoints'].get(endpoint) if endpoint else report['overall']
+            actual = stats.get(metric) if stats else None
+            if actual is None:
+                passed = False
+            elif metric == 'throughput_rps':
+                passed = actual >= target
+            else:
+                passed = actual <= target
+            results.append({
+                'name': f"{endpoint}.{metric}" if endpoint else metric,
+                'target': target,
+                'actual': actual,
+                'passed': passed,
+            })
+        return results
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from detection.models import DetectionLog
+from detection.rollups import truncate_hour
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete detection logs older than --days, in batches of --batch-size rows with a '
+        'short transaction each, so detect requests are not blocked on the write lock. '
+        'Their counts stay in the hourly rollups served by /api/stats/. Logs with feedback '
+        'are kept (the SVM is refreshed from them) unless --include-feedback is given.'
+    )
+
+    def add_arguments(self, parser):
+        retention = settings.DETECTION_LOG_RETENTION
+        parser.add_argument('--days', type=float, default=retention.get('DAYS', 30),
+                            help='Delete logs older than this many days (default: DETECTION_LOG_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=retention.get('BATCH_SIZE', 1000),
+                            help='Rows deleted per transaction (default: DETECTION_LOG_RETENTION_BATCH_SIZE)')
+        parser.add_argument('--pause', type=float, default=retention.get('PAUSE', 0.1),
+                            help='Seconds to wait between batches (default: 0.1)')
+        parser.add_argument('--include-feedback', action='store_true',
+                            help='Also delete logs that received feedback')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the logs that would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['pause'] < 0:
+            raise CommandError('--pause must not be negative')
+
+        # Whole hours only, so no rollup hour is left with part of its logs
+        cutoff = truncate_hour(timezone.now() - timedelta(days=options['days']))
+        old_logs = DetectionLog.objects.filter(created_at__lt=cutoff)
+        if not options['include_feedback']:
+            old_logs = old_logs.filter(corrected_at__isnull=True)
+
+        if options['dry_run']:
+            self.stdout.write(f"{old_logs.count()} detection logs older than {cutoff.isoformat()} would be deleted")
+            return
+
+        deleted = 0
+        batches = 0
+        started = time.perf_counter()
+        while True:
+            with transaction.atomic():
+                ids = list(old_logs.order_by('created_at', 'id').values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                count, _ = DetectionLog.objects.filter(id__in=ids).delete()
+            deleted += count
+            batches += 1
+            if batches % 100 == 0:
+                self.stderr.write(f"{deleted} detection logs deleted...")
+            if len(ids) < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} detection logs older than {cutoff.isoformat()} "
+            f"in {batches} batches ({time.perf_counter() - started:.1f}s)"
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from detection.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the hourly rollups served by /api/stats/ from the detection logs, e.g. '
+        'for logs written before the rollups existed. A rollup counting more detections than '
+        'the logs left in its hour and domain (pruned by prune_logs) is kept.'
+    )
+
+    def handle(self, *args, **options):
+        self.stderr.write('Rebuilding rollups from the detection logs...')
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} hourly rollups"))
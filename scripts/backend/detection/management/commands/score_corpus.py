@@ -0,0 +1,220 @@
+import json
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.corpus import FORMATS, CorpusError, read_chunks, read_corpus
+from detection.ml_models import SpamDetectionModels, build_models
+
+
+# Result fields written per message unless --full is given
+COMPACT_FIELDS = (
+    'final_prediction', 'is_spam', 'confidence', 'spam_votes', 'ham_votes',
+    'spam_score', 'ham_score', 'model_version',
+)
+
+_worker_models = None
+
+
+def _init_worker():
+    # Each pool process loads the bundle once (memory-mapped, so shared).
+    # Ctrl-C is handled by the parent, which shuts the pool down.
+    global _worker_models
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_models = build_models()
+    if not _worker_models.load_models():
+        raise RuntimeError('No trained models found')
+
+
+def _score_chunk(messages):
+    return _worker_models.predict_all_models_batch(messages)
+
+
+class Command(BaseCommand):
+    help = (
+        'Score a JSONL, CSV or mbox corpus with the 4-model ensemble, streaming it in '
+        'chunks across a process pool and appending one JSON line per message to OUTPUT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Corpus file (.jsonl/.ndjson, .csv or .mbox)')
+        parser.add_argument('output', help='JSONL file the results are appended to')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the extension)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Messages per chunk (default: 500)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Scoring processes; 1 scores in this process (default: CPU count)'
+        )
+        parser.add_argument('--full', action='store_true', help='Write the full result, including reasons and model_results')
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from the end of OUTPUT')
+        parser.add_argument('--overwrite', action='store_true', help='Start over, truncating OUTPUT')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be at least 1')
+        if options['resume'] and options['overwrite']:
+            raise CommandError('Use either --resume or --overwrite, not both')
+
+        model_version = SpamDetectionModels.saved_version(settings.ML_MODELS_PATH)
+        if model_version is None:
+            raise CommandError('No trained models found, run manage.py train_models first')
+
+        done = self._prepare_output(options['output'], options['resume'], options['overwrite'], model_version)
+        if done:
+            self.stderr.write(f"Resuming after {done} already scored messages")
+
+        self._progress = _Progress(self.stderr, done)
+        try:
+            records = read_corpus(options['input'], options['format'])
+            chunks = read_chunks(islice(records, done, None), options['chunk_size'])
+            with open(options['output'], 'a', encoding='utf-8') as output:
+                if options['workers'] == 1:
+                    self._score_in_process(chunks, output, options['full'], model_version)
+                else:
+                    self._score_in_pool(chunks, output, options['full'], model_version, options['workers'])
+        except CorpusError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            self._progress.finish()
+            raise CommandError(
+                f"Interrupted after {self._progress.total} messages, rerun with --resume to continue"
+            )
+
+        self._progress.finish()
+        self.stdout.write(self.style.SUCCESS(self._progress.summary()))
+
+    def _score_in_process(self, chunks, output, full, model_version):
+        models = build_models()
+        if not models.load_models():
+            raise CommandError('No trained models found, run manage.py train_models first')
+        for chunk in chunks:
+            results = models.predict_all_models_batch([(r.email, r.content) for r in chunk])
+            self._write(output, chunk, results, full, model_version)
+
+    def _score_in_pool(self, chunks, output, full, model_version, workers):
+        # Chunks are written in input order (so --resume can count lines) and
+        # at most 2 per worker are in flight, which bounds memory use
+        max_in_flight = workers * 2
+        pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker
+        )
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, pool.submit(_score_chunk, [(r.email, r.content) for r in chunk])))
+                if len(pending) >= max_in_flight:
+                    chunk, future = pending.popleft()
+                    self._write(output, chunk, future.result(), full, model_version)
+            while pending:
+                chunk, future = pending.popleft()
+                self._write(output, chunk, future.result(), full, model_version)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _write(self, output, chunk, results, full, model_version):
+        start = self._progress.total
+        for offset, (record, result) in enumerate(zip(chunk, results)):
+            if result['model_version'] != model_version:
+                raise CommandError('The models were retrained during the run, rerun with --resume')
+            row = {'index': start + offset}
+            if record.id is not None:
+                row['id'] = record.id
+            row['email'] = record.email
+            if record.label is not None:
+                row['label'] = record.label
+            row.update(result if full else {field: result[field] for field in COMPACT_FIELDS})
+            output.write(json.dumps(row, ensure_ascii=False) + '\n')
+        output.flush()
+        self._progress.update(results)
+
+    def _prepare_output(self, path, resume, overwrite, model_version):
+        """Number of messages already scored in path (0 unless resuming)"""
+        if not os.path.exists(path) or overwrite:
+            open(path, 'w').close()
+            return 0
+        if not resume:
+            raise CommandError(f"{path} already exists, use --resume to continue it or --overwrite to replace it")
+
+        lines, last_line, complete_size = _scan_output(path)
+        # Drop a line cut short by the interruption
+        os.truncate(path, complete_size)
+        if last_line:
+            previous_version = json.loads(last_line).get('model_version')
+            if previous_version != model_version:
+                raise CommandError(
+                    f"{path} was scored with model version {previous_version}, the current "
+                    f"models are {model_version}; use --overwrite or a new output file"
+                )
+        return lines
+
+
+def _scan_output(path, block_size=1 << 20):
+    """(complete lines, last complete line, size up to its newline) of a JSONL file"""
+    lines = 0
+    complete_size = 0
+    last_start = 0
+    position = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            newlines = block.count(b'\n')
+            if newlines:
+                lines += newlines
+                last_newline = position + block.rindex(b'\n')
+                if newlines > 1:
+                    last_start = position + block.rindex(b'\n', 0, last_newline - position) + 1
+                else:
+                    last_start = complete_size
+                complete_size = last_newline + 1
+            position += len(block)
+        if not lines:
+            return 0, None, 0
+        f.seek(last_start)
+        last_line = f.read(complete_size - last_start).decode('utf-8')
+    return lines, last_line, complete_size
+
+
+class _Progress:
+    """Running count and throughput, reported on stderr"""
+
+    def __init__(self, stream, already_done):
+        self.stream = stream
+        self.total = already_done
+        self.scored = 0
+        self.predictions = Counter()
+        self.started = time.monotonic()
+        self._last_report = 0.0
+
+    def update(self, results):
+        self.total += len(results)
+        self.scored += len(results)
+        self.predictions.update(result['final_prediction'] for result in results)
+        now = time.monotonic()
+        if now - self._last_report >= 1.0:
+            self._last_report = now
+            self.stream.write(f"{self.total} messages, {self.rate():.0f} msg/s", ending='\r')
+            self.stream.flush()
+
+    def finish(self):
+        if self._last_report:
+            self.stream.write('')
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.scored / elapsed if elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"Scored {self.scored} messages in {time.monotonic() - self.started:.1f}s "
+            f"({self.rate():.0f} msg/s): {self.predictions['SPAM']} spam, {self.predictions['HAM']} ham; "
+            f"{self.total} in the output"
+        )
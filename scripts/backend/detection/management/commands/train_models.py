@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.models import TrainingJob
+from detection.training import TrainingInProgress, create_training_job, run_training_job
+
+
+class Command(BaseCommand):
+    help = 'Train the 4 spam detection models as a TrainingJob'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job',
+            help='Run an existing TrainingJob (started by POST /api/train/)'
+        )
+        parser.add_argument(
+            '--corpus',
+            help='Labeled JSONL/CSV corpus to train from out of core (default: settings.ML_TRAINING_CORPUS)'
+        )
+        parser.add_argument(
+            '--select', action='store_true', default=None,
+            help='Cross-validate the hyperparameter grids and train the best candidates '
+                 '(default: ML_MODEL_SELECTION_ENABLED)'
+        )
+
+    def handle(self, *args, **options):
+        job_id = options['job']
+        if job_id is None:
+            try:
+                job_id = create_training_job(pid=os.getpid()).pk
+            except TrainingInProgress as e:
+                raise CommandError(str(e))
+
+        job = run_training_job(job_id, corpus_path=options['corpus'], select=options['select'])
+        if job.status != TrainingJob.STATUS_COMPLETED:
+            raise CommandError(f"Training job {job.pk} failed:\n{job.error}")
+
+        for key, result in job.results.items():
+            accuracy = 'n/a' if result['accuracy'] is None else f"{result['accuracy']:.4f}"
+            self.stdout.write(f"{key}: accuracy {accuracy}, {result['fit_seconds']:.2f}s")
+            selection = result.get('selection')
+            if selection:
+                best = next(c for c in selection['candidates'] if c['params'] == selection['best_params'])
+                self.stdout.write(
+                    f"  best of {len(selection['candidates'])} candidates: {selection['best_params']} "
+                    f"(cv accuracy {best['cv_accuracy']:.4f})"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Training job {job.pk} completed, model version {job.model_version}"))
@@ -0,0 +1,271 @@
+"""
+In-process metrics for the detect path: latency histograms per request
+stage and per model, and counters of requests, messages, votes and errors,
+rendered in the Prometheus text format by GET /api/metrics/.
+Each worker process keeps its own metrics. The stage timers also collect
+the durations of the current request for the optional Server-Timing header.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# (name, seconds) of the stages timed so far in the current request, when collecting
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per combination of label values"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per combination of label values"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last is +Inf), count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted(
+                (labels, (list(counts), count, total))
+                for labels, (counts, count, total) in self._series.items()
+            )
+        lines = []
+        for labels, (counts, count, total) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.label_names, labels, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_count{label_text} {count}")
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of this process, in registration order"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def gauge_lines(name, documentation, samples, metric_type='gauge'):
+    """
+    Prometheus lines for a value read at scrape time;
+    samples is a list of (labels dict, value)
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return lines
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    'spam_detection_requests_total', 'Detect API requests by endpoint and HTTP status', ['endpoint', 'status']
+)
+REQUEST_SECONDS = registry.histogram(
+    'spam_detection_request_seconds', 'Detect API request latency', ['endpoint']
+)
+STAGE_SECONDS = registry.histogram(
+    'spam_detection_stage_seconds',
+    'Time spent in each stage of a detect request (validate, predict, vectorize, keywords, log)',
+    ['stage']
+)
+MODEL_SECONDS = registry.histogram(
+    'spam_detection_model_seconds', 'Time spent scoring one batch of messages per ensemble model', ['model']
+)
+MESSAGES = registry.counter(
+    'spam_detection_messages_total', 'Messages scored by the ensemble by final prediction', ['prediction']
+)
+MODEL_VOTES = registry.counter(
+    'spam_detection_model_votes_total', 'Votes cast by each ensemble model', ['model', 'vote']
+)
+MODEL_ERRORS = registry.counter(
+    'spam_detection_model_errors_total', 'Errors raised while scoring with each ensemble model', ['model']
+)
+NEAR_DUPLICATES = registry.counter(
+    'spam_detection_near_duplicate_lookups_total',
+    'Near-duplicate index lookups by result (hit reuses a neighbor verdict)', ['result']
+)
+MICRO_BATCH_SIZE = registry.histogram(
+    'spam_detection_micro_batch_size', 'Messages scored per micro-batch of concurrent detect requests',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+
+def enabled():
+    return settings.DETECTION_METRICS.get('ENABLED', True)
+
+
+@contextmanager
+def timer(histogram, label):
+    """
+    Time the block into histogram under label, and into the timings of the
+    current request when they are being collected
+    """
+    if not enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, label)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((label, elapsed))
+
+
+def server_timing(timings):
+    """Server-Timing header value for (name, seconds) pairs"""
+    return ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings)
+
+
+def instrument(endpoint):
+    """
+    Decorator for view handlers (sync or async): counts requests by status, records
+    their latency and, when DETECTION_METRICS['SERVER_TIMING'] is set,
+    returns the stage timings in a Server-Timing header
+    """
+    def record(response, timings, started):
+        elapsed = time.perf_counter() - started
+        REQUESTS.inc(endpoint, str(response.status_code))
+        REQUEST_SECONDS.observe(elapsed, endpoint)
+        if settings.DETECTION_METRICS.get('SERVER_TIMING', False):
+            response['Server-Timing'] = server_timing(timings + [('total', elapsed)])
+        return response
+
+    def decorator(handler):
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(view, request, *args, **kwargs):
+                if not enabled():
+                    return await handler(view, request, *args, **kwargs)
+
+                token = _request_timings.set([])
+                started = time.perf_counter()
+                try:
+                    response = await handler(view, request, *args, **kwargs)
+                except Exception:
+                    REQUESTS.inc(endpoint, '500')
+                    raise
+                finally:
+                    timings = _request_timings.get()
+                    _request_timings.reset(token)
+                return record(response, timings, started)
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if not enabled():
+                return handler(view, request, *args, **kwargs)
+
+            token = _request_timings.set([])
+            started = time.perf_counter()
+            try:
+                response = handler(view, request, *args, **kwargs)
+            except Exception:
+                REQUESTS.inc(endpoint, '500')
+                raise
+            finally:
+                timings = _request_timings.get()
+                _request_timings.reset(token)
+            return record(response, timings, started)
+        return wrapper
+    return decorator
@@ -0,0 +1,242 @@
+"""
+Micro-batching of concurrent single-message detections.
+Under a threaded (gunicorn --threads) or ASGI server, several detect
+requests of a worker often score a message at about the same time, each
+paying the fixed cost of vectorizing and calling every model. The batcher
+collects them for up to max_wait seconds or max_batch_size messages and
+scores them in one predict_all_models_batch call from a background thread,
+handing each result back to the request waiting for it.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+
+_STOP = object()
+
+
+class _BatchedModels:
+    """
+    Stand-in for a SpamDetectionModels bundle whose predictions go through
+    the batcher, for callers such as the prediction cache
+    """
+
+    def __init__(self, batcher, models):
+        self._batcher = batcher
+        self._models = models
+        self.version = models.version
+
+    def predict_all_models_batch(self, messages):
+        return self._batcher.predict_batch(self._models, messages)
+
+    def vote(self, email, content, model_results):
+        return self._models.vote(email, content, model_results)
+
+
+class MicroBatcher:
+    """
+    Score concurrent predictions together in one ensemble pass.
+
+    The first queued request opens a batch, which is scored once it holds
+    max_batch_size messages, max_wait seconds after it was opened, or as
+    soon as it holds every request counted by request(), so a lone request
+    does not wait for company. When more than max_queue requests are
+    waiting, new ones are scored in the calling thread instead (counted as
+    overflowed). A request whose batch has not been scored after timeout
+    seconds (the batcher thread stalled or died) is also scored in the
+    calling thread (counted as timed out).
+    """
+
+    def __init__(self, max_wait=0.002, max_batch_size=32, max_queue=1000, timeout=1.0):
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self.batches = 0
+        self.messages = 0
+        self.overflowed = 0
+        self.timed_out = 0
+        self._waiting = 0
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def bind(self, models):
+        """models, with predict_all_models_batch going through the batcher"""
+        return _BatchedModels(self, models)
+
+    def predict_batch(self, models, messages):
+        """
+        Batched equivalent of models.predict_all_models_batch(messages):
+        blocks until the batch holding these messages has been scored
+        """
+        if not messages:
+            return []
+        future = Future()
+        try:
+            self._ensure_started().put_nowait((models, messages, future))
+        except queue.Full:
+            with self._stats_lock:
+                self.overflowed += 1
+            return models.predict_all_models_batch(messages)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The batcher thread skips the request if it has not picked it up yet
+            future.cancel()
+            with self._stats_lock:
+                self.timed_out += 1
+            return models.predict_all_models_batch(messages)
+
+    @contextmanager
+    def request(self):
+        """
+        Count a request that may submit a prediction, so a batch is not held
+        open when no other request can join it
+        """
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._waiting -= 1
+
+    def close(self, timeout=5.0):
+        """Score the queued requests and stop the background thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch_size': self.max_batch_size,
+                'queued': self._queue.qsize() if self._queue is not None else 0,
+                'batches': self.batches,
+                'messages': self.messages,
+                'mean_batch_size': self.messages / self.batches if self.batches else 0.0,
+                'overflowed': self.overflowed,
+                'timed_out': self.timed_out,
+            }
+
+    def _ensure_started(self):
+        # Threads do not survive fork (gunicorn --preload), so each worker
+        # process starts its own queue and thread on first use
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                    self._thread = threading.Thread(
+                        target=self._run, name='detection-micro-batcher', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+                    atexit.register(self.close)
+        return self._queue
+
+    def _run(self):
+        request_queue = self._queue
+        stopping = False
+        while not stopping:
+            item = request_queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            size = len(item[1])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                with self._stats_lock:
+                    alone = len(batch) >= self._waiting
+                if alone:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = request_queue.get(timeout=remaining) if remaining > 0 else request_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[1])
+
+            self._score(batch)
+
+        # Requests queued behind the stop marker are still answered
+        while True:
+            try:
+                item = request_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                self._score([item])
+
+    def _score(self, batch):
+        # A batch can span a model reload: each bundle scores its own requests
+        groups = {}
+        for models, messages, future in batch:
+            # False when the request timed out and scored its messages itself
+            if not future.set_running_or_notify_cancel():
+                continue
+            groups.setdefault(id(models), (models, []))[1].append((messages, future))
+
+        for models, requests in groups.values():
+            messages = [message for request_messages, _ in requests for message in request_messages]
+            if metrics.enabled():
+                metrics.MICRO_BATCH_SIZE.observe(len(messages))
+            try:
+                results = models.predict_all_models_batch(messages)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for request_messages, future in requests:
+                future.set_result(results[start:start + len(request_messages)])
+                start += len(request_messages)
+            with self._stats_lock:
+                self.batches += 1
+                self.messages += len(messages)
+
+
+_batcher_instance = None
+_batcher_lock = threading.Lock()
+
+
+def get_micro_batcher():
+    """
+    Get or create the batcher configured in settings.DETECTION_MICRO_BATCH,
+    or None when micro-batching is disabled
+    """
+    global _batcher_instance
+    config = settings.DETECTION_MICRO_BATCH
+    if not config.get('ENABLED', False):
+        return None
+
+    if _batcher_instance is None:
+        with _batcher_lock:
+            if _batcher_instance is None:
+                _batcher_instance = MicroBatcher(
+                    max_wait=config.get('MAX_WAIT_MS', 2.0) / 1000,
+                    max_batch_size=config.get('MAX_BATCH_SIZE', 32),
+                    max_queue=config.get('MAX_QUEUE', 1000),
+                    timeout=config.get('TIMEOUT_MS', 1000) / 1000
+                )
+    return _batcher_instance
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('email', models.EmailField(max_length=254)),
+                ('content', models.TextField()),
+                ('prediction', models.CharField(max_length=10)),
+                ('probability', models.FloatField()),
+                ('model_used', models.CharField(max_length=50)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
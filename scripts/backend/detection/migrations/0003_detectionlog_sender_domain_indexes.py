@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:43
+
+from django.db import migrations, models
+
+
+def fill_sender_domains(apps, schema_editor):
+    # Logs written before sender_domain existed, see DetectionLog.from_prediction
+    DetectionLog = apps.get_model('detection', 'DetectionLog')
+    for log in DetectionLog.objects.filter(email__contains='@').only('id', 'email').iterator():
+        domain = log.email.rsplit('@', 1)[1].lower()
+        DetectionLog.objects.filter(id=log.id).update(sender_domain=domain)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0002_detectionlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='detectionlog',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='detectionlog',
+            name='sender_domain',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(fill_sender_domains, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='detectionlog',
+            index=models.Index(fields=['created_at', 'id'], name='detection_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionlog',
+            index=models.Index(fields=['prediction', 'created_at', 'id'], name='detection_pred_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionlog',
+            index=models.Index(fields=['sender_domain', 'created_at', 'id'], name='detection_domain_created_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:43
+
+import uuid
+from django.db import migrations, models
+
+
+def fill_detection_ids(apps, schema_editor):
+    # A distinct id per existing log: the AddField default is evaluated once
+    DetectionLog = apps.get_model('detection', 'DetectionLog')
+    for log_id in DetectionLog.objects.values_list('id', flat=True).iterator():
+        DetectionLog.objects.filter(id=log_id).update(detection_id=uuid.uuid4())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0004_trainingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionlog',
+            name='corrected_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='detectionlog',
+            name='corrected_label',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='detectionlog',
+            name='detection_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_detection_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='detectionlog',
+            name='detection_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddField(
+            model_name='detectionlog',
+            name='feedback_applied_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='detectionlog',
+            index=models.Index(condition=models.Q(('corrected_at__isnull', False)), fields=['corrected_at'], name='detection_corrected_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionlog',
+            index=models.Index(condition=models.Q(('corrected_at__isnull', False), ('feedback_applied_at__isnull', True)), fields=['corrected_at'], name='detection_feedback_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0005_detectionlog_feedback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('sender_domain', models.CharField(blank=True, default='', max_length=255)),
+                ('spam_count', models.PositiveIntegerField(default=0)),
+                ('ham_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['hour', 'sender_domain'],
+                'indexes': [models.Index(fields=['sender_domain', 'hour'], name='rollup_domain_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'sender_domain'), name='rollup_hour_domain_unique')],
+            },
+        ),
+    ]
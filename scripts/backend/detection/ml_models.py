@@ -2,15 +2,223 @@
 Machine Learning Models for Email Spam Detection
 Using 4 models: Linear Regression, Logistic Regression, Custom Pipeline, and SVM
 """
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import chain
+
 import numpy as np
-from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.svm import SVC
-from sklearn.feature_extraction.text import TfidfVectorizer
+import scipy.sparse as sp
+import sklearn
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import LinearRegression, LogisticRegression, SGDClassifier, SGDRegressor
+from sklearn.svm import SVC, LinearSVC
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import LabelEncoder
+from sklearn.preprocessing import LabelEncoder, normalize
+from sklearn.utils.sparsefuncs_fast import (
+    inplace_csr_row_normalize_l1,
+    inplace_csr_row_normalize_l2,
+)
 import joblib
 from pathlib import Path
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from . import metrics
+from .compaction import CompactVocabulary, compact_estimator, compact_vectorizer, feature_importance
+from .corpus import read_chunks, read_corpus
+from .fast_inference import FastInferenceEngine
+from .keywords import get_keyword_matcher
+from .model_selection import load_grid, select_hyperparameters
+
+
+# Vectorizer parameters that must match for two vectorizers to share one
+# token stream (everything that happens before n-grams are built)
+SHARED_ANALYSIS_PARAMS = (
+    'input', 'encoding', 'decode_error', 'strip_accents', 'lowercase',
+    'preprocessor', 'tokenizer', 'token_pattern', 'stop_words', 'analyzer',
+)
+
+
+# On-disk bundle format written by save_models
+BUNDLE_FORMAT = 1
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'models.lock'
+# Seconds to wait for another process holding models_lock
+LOCK_TIMEOUT = 600
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def models_lock(models_path, timeout=LOCK_TIMEOUT):
+    """
+    Exclusive lock on the models saved in models_path, held by every
+    process that writes them (training, online feedback updates) so an
+    update is never based on models another process is replacing.
+    Raises TimeoutError when it is not free within timeout seconds.
+    """
+    with open(Path(models_path) / LOCK_FILE, 'a+b') as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    # msvcrt locks a byte range: the first byte of the file
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(
+                        f"Could not lock the models in {models_path} within {timeout} seconds"
+                    )
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _gradient_step(estimator, X, error, learning_rate, limit_to_target=False):
+    """
+    Shallow copy of a fitted linear estimator whose coef_ and intercept_
+    moved by one gradient step on the mean loss of the rows of X, error
+    being the derivative of the loss with respect to each row's score.
+    With limit_to_target, the score is the prediction itself (squared
+    loss, error = prediction - target) and the step is shortened so that
+    no row's prediction moves past its target. The original is left
+    untouched (its weights may be memory-mapped read-only).
+    """
+    stepped = copy.copy(estimator)
+    # Compacted models keep their float32 weights
+    coef = np.array(estimator.coef_)
+    intercept = np.array(estimator.intercept_)
+    coef_gradient = np.asarray(X.T @ error).reshape(coef.shape) / X.shape[0]
+    intercept_gradient = np.mean(error)
+    
+    if limit_to_target:
+        # Change of each row's prediction per unit of learning rate
+        change = -(np.asarray(X @ coef_gradient.ravel()).ravel() + intercept_gradient)
+        toward = change * error < 0
+        if toward.any():
+            learning_rate = min(learning_rate, float(np.min(np.abs(error[toward] / change[toward]))))
+    
+    coef -= learning_rate * coef_gradient
+    intercept -= learning_rate * intercept_gradient
+    stepped.coef_ = coef
+    stepped.intercept_ = intercept
+    return stepped
+
+
+def _tfidf_from_ngrams(docs_ngrams, vectorizer):
+    """
+    Build the TF-IDF matrix a fitted TfidfVectorizer would produce, from
+    n-grams that were already extracted.
+
+    docs_ngrams holds one list per document, where item n-1 is the list of
+    word n-grams of length n.
+    """
+    vocabulary = vectorizer.vocabulary_
+    min_n, max_n = vectorizer.ngram_range
+    
+    if isinstance(vocabulary, CompactVocabulary):
+        # One vectorized lookup for the n-grams of every document
+        X = vocabulary.count_matrix([
+            list(chain.from_iterable(ngrams_by_n[n - 1] for n in range(min_n, max_n + 1)))
+            for ngrams_by_n in docs_ngrams
+        ], vectorizer.dtype)
+    else:
+        indices = []
+        data = []
+        indptr = [0]
+        for ngrams_by_n in docs_ngrams:
+            counts = Counter()
+            for n in range(min_n, max_n + 1):
+                counts.update(j for j in map(vocabulary.get, ngrams_by_n[n - 1]) if j is not None)
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        
+        X = sp.csr_matrix(
+            (np.asarray(data, dtype=vectorizer.dtype), indices, indptr),
+            shape=(len(docs_ngrams), len(vocabulary))
+        )
+    X.sort_indices()
+    
+    # Same steps as TfidfTransformer.transform
+    if vectorizer.binary:
+        X.data.fill(1)
+    if vectorizer.sublinear_tf:
+        np.log(X.data, X.data)
+        X.data += 1
+    if vectorizer.use_idf:
+        X.data *= vectorizer.idf_[X.indices]
+    # Normalize in place without sklearn's per-call parameter validation
+    if vectorizer.norm == 'l2':
+        inplace_csr_row_normalize_l2(X)
+    elif vectorizer.norm == 'l1':
+        inplace_csr_row_normalize_l1(X)
+    elif vectorizer.norm:
+        X = normalize(X, norm=vectorizer.norm, copy=False)
+    return X
+
+
+def _hashed_from_ngrams(docs_ngrams, vectorizer):
+    """
+    Build the matrix a HashingVectorizer would produce, from n-grams that
+    were already extracted (same layout as for _tfidf_from_ngrams)
+    """
+    min_n, max_n = vectorizer.ngram_range
+    hasher = FeatureHasher(
+        n_features=vectorizer.n_features,
+        input_type='string',
+        dtype=vectorizer.dtype,
+        alternate_sign=vectorizer.alternate_sign
+    )
+    X = hasher.transform(
+        chain.from_iterable(ngrams_by_n[n - 1] for n in range(min_n, max_n + 1))
+        for ngrams_by_n in docs_ngrams
+    )
+    
+    # Same steps as HashingVectorizer.transform
+    if vectorizer.binary:
+        X.data.fill(1)
+    if vectorizer.norm == 'l2':
+        inplace_csr_row_normalize_l2(X)
+    elif vectorizer.norm == 'l1':
+        inplace_csr_row_normalize_l1(X)
+    elif vectorizer.norm:
+        X = normalize(X, norm=vectorizer.norm, copy=False)
+    return X
 
 
 class SpamDetectionModels:
@@ -78,9 +286,40 @@ class SpamDetectionModels:
         ("Mom called. She wants you to call her back when you can.", "ham"),
     ]
     
-    def __init__(self, models_path='ml_models'):
-        self.models_path = Path(models_path)
-        self.models_path.mkdir(exist_ok=True)
+    INFERENCE_ENGINES = ('sklearn', 'fast')
+    SVM_MODES = ('exact', 'nystroem')
+    
+    # Ensemble members, cheapest to score first: (key, display name)
+    MODEL_STAGES = (
+        ('linear', 'Regresión Lineal'),
+        ('logistic', 'Regresión Logística'),
+        ('pipeline', 'Pipeline Personalizado'),
+        ('svm', 'SVM'),
+    )
+    
+    # Cap on the reasons listed in a result
+    MAX_REASONS = 6
+    
+    # Size of the Nystroem kernel approximation in 'nystroem' SVM mode
+    NYSTROEM_COMPONENTS = 300
+    
+    # Result keys of train_models for each MODEL_STAGES key
+    RESULT_KEYS = {
+        'linear': 'linear_regression',
+        'logistic': 'logistic_regression',
+        'pipeline': 'pipeline',
+        'svm': 'svm',
+    }
+    
+    def __init__(self, models_path=None, inference_engine='sklearn', svm_mode='exact',
+                 cascade=False, cascade_confidence=None):
+        if inference_engine not in self.INFERENCE_ENGINES:
+            raise ValueError(f"Unknown inference engine: {inference_engine}")
+        if svm_mode not in self.SVM_MODES:
+            raise ValueError(f"Unknown SVM mode: {svm_mode}")
+        
+        self.models_path = Path(models_path or settings.ML_MODELS_PATH)
+        self.models_path.mkdir(parents=True, exist_ok=True)
         
         self.vectorizer = TfidfVectorizer(
             max_features=5000,
@@ -95,10 +334,50 @@ class SpamDetectionModels:
         self.logistic_model = None
         self.pipeline_model = None
         self.svm_model = None
+        self.svm_mode = svm_mode
         self.is_trained = False
+        
+        # Hyperparameters chosen by model selection, per MODEL_STAGES key
+        self.model_params = {}
+        
+        # When the SVM last learned from user feedback, see refresh_svm
+        self.svm_refreshed_at = None
+        
+        # Identifies the trained models, changes on every retrain
+        self.version = None
+        
+        # Optional NumPy-only scorer, see fast_inference.py
+        self.inference_engine = inference_engine
+        self.fast_engine = None
+        self._analyzer_cache = None
+        
+        # Early-exit voting, see predict_all_models_batch
+        self.cascade = cascade
+        self.cascade_confidence = cascade_confidence
+        self._cascade_lock = threading.Lock()
+        self._cascade_counts = Counter()
     
-    def train_models(self):
-        """Train all 4 ML models"""
+    def train_models(self, progress_callback=None, corpus_path=None, select=None):
+        """
+        Train all 4 ML models.
+        progress_callback(key, result), if given, is called as each model
+        finishes, with its test accuracy and fit time in seconds.
+        With a corpus file (corpus_path or settings.ML_TRAINING_CORPUS) the
+        models are trained out of core, see train_models_streaming;
+        otherwise on SAMPLE_DATA.
+        With select (default: settings.ML_MODEL_SELECTION['ENABLED']) each
+        model is fitted with the parameters that cross-validate best on the
+        training split (see model_selection.py), and its result includes
+        the score and fit time of every candidate under 'selection'.
+        """
+        corpus_path = corpus_path or settings.ML_TRAINING_CORPUS
+        selection_settings = settings.ML_MODEL_SELECTION
+        if select is None:
+            select = selection_settings.get('ENABLED', False)
+        if corpus_path:
+            if select:
+                print("Model selection is not available for corpus training, using the fixed parameters")
+            return self.train_models_streaming(corpus_path, progress_callback)
         
         texts = [item[0] for item in self.SAMPLE_DATA]
         labels = [item[1] for item in self.SAMPLE_DATA]
@@ -112,60 +391,389 @@ class SpamDetectionModels:
         y_train_str = self.label_encoder.inverse_transform(y_train)
         y_test_str = self.label_encoder.inverse_transform(y_test)
         
+        selection = {}
+        if select:
+            print("\nSelecting hyperparameters...")
+            started = time.perf_counter()
+            selection = select_hyperparameters(
+                self, X_train, y_train_str,
+                load_grid(selection_settings.get('GRID_PATH'), self.svm_mode),
+                folds=selection_settings.get('FOLDS', 5),
+                n_jobs=selection_settings.get('N_JOBS', -1),
+                cache_dir=selection_settings.get('CACHE_DIR'),
+            )
+            candidates = sum(len(report['candidates']) for report in selection.values())
+            print(f"Cross-validated {candidates} candidates ({time.perf_counter() - started:.2f}s)")
+        params = self.model_params = {key: report['best_params'] for key, report in selection.items()}
+        
         X_train_tfidf = self.vectorizer.fit_transform(X_train)
         X_test_tfidf = self.vectorizer.transform(X_test)
+        # Score the models being trained, not the inference engine of the previous ones
+        self.fast_engine = None
         
         results = {}
         
+        def served_accuracy(key, X):
+            # Labels as the detect endpoints serve them
+            return (self._run_model(key, X)[0] == y_test_str).mean()
+        
+        def record(key, name, started, accuracy):
+            results[key] = {'accuracy': float(accuracy), 'fit_seconds': time.perf_counter() - started}
+            stage = next(stage for stage, result_key in self.RESULT_KEYS.items() if result_key == key)
+            if stage in selection:
+                results[key]['selection'] = selection[stage]
+                print(f"{name} parameters: {selection[stage]['best_params']}")
+            print(f"{name} Accuracy: {accuracy:.4f} ({results[key]['fit_seconds']:.2f}s)")
+            if progress_callback is not None:
+                progress_callback(key, results[key])
+        
         # 1. Linear Regression
         print("\nTraining Linear Regression...")
-        self.linear_model = LinearRegression()
-        self.linear_model.fit(X_train_tfidf.toarray(), y_train)
-        lr_pred = (self.linear_model.predict(X_test_tfidf.toarray()) > 0.5).astype(int)
-        results['linear_regression'] = {'accuracy': (lr_pred == y_test).mean()}
-        print(f"Linear Regression Accuracy: {results['linear_regression']['accuracy']:.4f}")
+        started = time.perf_counter()
+        self.linear_model = self._build_estimator('linear', X_train_tfidf, params.get('linear'))
+        self.linear_model.fit(X_train_tfidf, y_train)
+        record('linear_regression', 'Linear Regression', started, served_accuracy('linear', X_test_tfidf))
         
         # 2. Logistic Regression
         print("\nTraining Logistic Regression...")
-        self.logistic_model = LogisticRegression(max_iter=1000, random_state=42, class_weight='balanced')
+        started = time.perf_counter()
+        self.logistic_model = self._build_estimator('logistic', X_train_tfidf, params.get('logistic'))
         self.logistic_model.fit(X_train_tfidf, y_train_str)
-        results['logistic_regression'] = {'accuracy': self.logistic_model.score(X_test_tfidf, y_test_str)}
-        print(f"Logistic Regression Accuracy: {results['logistic_regression']['accuracy']:.4f}")
+        record('logistic_regression', 'Logistic Regression', started, served_accuracy('logistic', X_test_tfidf))
         
         # 3. Custom Pipeline (TF-IDF + Logistic with different params)
         print("\nTraining Custom Pipeline...")
-        self.pipeline_model = Pipeline([
-            ('tfidf', TfidfVectorizer(max_features=3000, ngram_range=(1, 3), stop_words='english')),
-            ('clf', LogisticRegression(C=0.5, max_iter=1000, random_state=42))
-        ])
+        started = time.perf_counter()
+        self.pipeline_model = self._build_estimator('pipeline', X_train_tfidf, params.get('pipeline'))
         self.pipeline_model.fit(X_train, y_train_str)
-        results['pipeline'] = {'accuracy': self.pipeline_model.score(X_test, y_test_str)}
-        print(f"Custom Pipeline Accuracy: {results['pipeline']['accuracy']:.4f}")
+        record('pipeline', 'Custom Pipeline', started,
+               served_accuracy('pipeline', self.pipeline_model[:-1].transform(X_test)))
         
         # 4. SVM
-        print("\nTraining SVM...")
-        self.svm_model = SVC(kernel='rbf', probability=True, random_state=42, class_weight='balanced')
+        print(f"\nTraining SVM ({self.svm_mode})...")
+        started = time.perf_counter()
+        self.svm_model = self._build_estimator('svm', X_train_tfidf, params.get('svm'))
         self.svm_model.fit(X_train_tfidf, y_train_str)
-        results['svm'] = {'accuracy': self.svm_model.score(X_test_tfidf, y_test_str)}
-        print(f"SVM Accuracy: {results['svm']['accuracy']:.4f}")
+        record('svm', 'SVM', started, served_accuracy('svm', X_test_tfidf))
+        
+        compaction = settings.ML_COMPACTION
+        if compaction.get('ENABLED', False):
+            self.compact(compaction.get('PRUNE_THRESHOLD', 0.05))
+            # Test accuracy of the models that get saved, next to the uncompacted one
+            X_test_tfidf, X_test_pipe = self._extract_features(X_test)
+            for key, name in self.MODEL_STAGES:
+                result = results[self.RESULT_KEYS[key]]
+                labels = self._run_model(key, X_test_pipe if key == 'pipeline' else X_test_tfidf)[0]
+                result['uncompacted_accuracy'] = result['accuracy']
+                result['accuracy'] = float((labels == y_test_str).mean())
+                print(f"{name} accuracy after compaction: {result['accuracy']:.4f}")
+                # Report again: the result given as the model finished was of the uncompacted one
+                if progress_callback is not None:
+                    progress_callback(self.RESULT_KEYS[key], result)
+        
+        self.is_trained = True
+        self.version = uuid.uuid4().hex
+        self.svm_refreshed_at = datetime.now(timezone.utc)
+        self._build_inference_engine()
+        with models_lock(self.models_path):
+            self.save_models()
+        
+        return results
+    
+    def train_models_streaming(self, corpus_path, progress_callback=None):
+        """
+        Train all 4 models out of core from a labeled JSONL/CSV corpus.
+        
+        Texts are hashed (HashingVectorizer, no vocabulary to fit) and each
+        model is an SGD equivalent of the in-memory one, trained with
+        partial_fit one mini-batch at a time, so memory use does not grow
+        with the corpus. A slice of the corpus picked by a hash of the
+        content is held out and evaluated in the same streaming way.
+        """
+        config = settings.ML_STREAMING_TRAINING
+        n_features = config.get('HASH_FEATURES', 2 ** 20)
+        
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), stop_words='english', alternate_sign=False
+        )
+        self.label_encoder.fit(['ham', 'spam'])
+        self.linear_model = SGDRegressor(alpha=1e-6, random_state=42)
+        self.logistic_model = SGDClassifier(loss='log_loss', alpha=1e-6, random_state=42)
+        self.pipeline_model = Pipeline([
+            ('hashing', HashingVectorizer(
+                n_features=n_features, ngram_range=(1, 3), stop_words='english', alternate_sign=False
+            )),
+            ('clf', SGDClassifier(loss='log_loss', alpha=1e-5, random_state=42))
+        ])
+        # modified_huber is a smoothed hinge (SVM) loss that also gives probabilities
+        self.svm_model = SGDClassifier(loss='modified_huber', alpha=1e-6, random_state=42)
+        self.svm_mode = 'sgd'
+        self.fast_engine = None
+        
+        estimators = {
+            'linear': self.linear_model,
+            'logistic': self.logistic_model,
+            'pipeline': self.pipeline_model[-1],
+            'svm': self.svm_model,
+        }
+        classes = self.label_encoder.classes_
+        fit_seconds = Counter()
+        trained = 0
+        
+        for epoch in range(config.get('EPOCHS', 3)):
+            print(f"\nStreaming training, epoch {epoch + 1}...")
+            for texts, labels in self._corpus_batches(corpus_path, holdout=False):
+                X_tfidf, X_pipe = self._extract_features(texts)
+                y = np.asarray(labels)
+                for key, estimator in estimators.items():
+                    started = time.perf_counter()
+                    X = X_pipe if key == 'pipeline' else X_tfidf
+                    if key == 'linear':
+                        estimator.partial_fit(X, (y == 'spam').astype(float))
+                    else:
+                        estimator.partial_fit(X, y, classes=classes)
+                    fit_seconds[key] += time.perf_counter() - started
+                if epoch == 0:
+                    trained += len(texts)
+            print(f"{trained} training messages")
+        
+        if not trained:
+            raise ValueError(f"No training messages in {corpus_path}")
+        
+        compaction = settings.ML_COMPACTION
+        if compaction.get('ENABLED', False):
+            # Hashed features have no vocabulary to prune, only the weights shrink.
+            # Before the evaluation, so the holdout scores the models that get saved.
+            self.compact(compaction.get('PRUNE_THRESHOLD', 0.05))
+        
+        # Holdout evaluation, streamed like the training data
+        print("\nEvaluating on the holdout set...")
+        confusion = {key: Counter() for key in estimators}
+        for texts, labels in self._corpus_batches(corpus_path, holdout=True):
+            X_tfidf, X_pipe = self._extract_features(texts)
+            actual = np.asarray(labels) == 'spam'
+            for key in estimators:
+                predicted = self._run_model(key, X_pipe if key == 'pipeline' else X_tfidf)[0] == 'spam'
+                confusion[key].update({
+                    'tp': int(np.sum(predicted & actual)),
+                    'fp': int(np.sum(predicted & ~actual)),
+                    'fn': int(np.sum(~predicted & actual)),
+                    'tn': int(np.sum(~predicted & ~actual)),
+                })
+        
+        results = {}
+        for key, name in self.MODEL_STAGES:
+            counts = confusion[key]
+            evaluated = sum(counts.values())
+            result_key = self.RESULT_KEYS[key]
+            results[result_key] = {
+                'accuracy': (counts['tp'] + counts['tn']) / evaluated if evaluated else None,
+                'precision': counts['tp'] / (counts['tp'] + counts['fp']) if counts['tp'] + counts['fp'] else None,
+                'recall': counts['tp'] / (counts['tp'] + counts['fn']) if counts['tp'] + counts['fn'] else None,
+                'fit_seconds': fit_seconds[key],
+                'training_messages': trained,
+                'holdout_messages': evaluated,
+            }
+            accuracy = results[result_key]['accuracy']
+            print(f"{name} holdout accuracy: {accuracy:.4f}" if accuracy is not None else f"{name}: empty holdout")
+            if progress_callback is not None:
+                progress_callback(result_key, results[result_key])
         
         self.is_trained = True
-        self.save_models()
+        self.version = uuid.uuid4().hex
+        self.svm_refreshed_at = datetime.now(timezone.utc)
+        self._build_inference_engine()
+        with models_lock(self.models_path):
+            self.save_models()
         
         return results
     
+    def _corpus_batches(self, corpus_path, holdout):
+        """
+        (texts, labels) mini-batches of the training or the holdout part of
+        a corpus. A message is held out when a hash of its content falls in
+        the holdout share, so the split is stable across epochs and runs.
+        Training batches are shuffled within a window of a few batches,
+        since SGD degrades on corpora sorted by label.
+        """
+        config = settings.ML_STREAMING_TRAINING
+        batch_size = config.get('BATCH_SIZE', 1000)
+        holdout_percent = config.get('HOLDOUT_PERCENT', 10)
+        rng = np.random.default_rng(42)
+        
+        def selected():
+            for record in read_corpus(corpus_path):
+                if record.label is None:
+                    raise ValueError(f"Training corpus {corpus_path} has a message without a label")
+                in_holdout = zlib.crc32(record.content.encode('utf-8')) % 100 < holdout_percent
+                if in_holdout == holdout:
+                    yield record
+        
+        window = 1 if holdout else config.get('SHUFFLE_BATCHES', 10)
+        for records in read_chunks(selected(), batch_size * window):
+            if window > 1:
+                records = [records[i] for i in rng.permutation(len(records))]
+            for batch in read_chunks(records, batch_size):
+                yield [f"{r.email} {r.content}" for r in batch], [r.label for r in batch]
+    
+    def _build_estimator(self, key, X_train, params=None):
+        """
+        Unfitted ensemble member for a MODEL_STAGES key, with its default
+        hyperparameters overridden by params (set_params names).
+        X_train is the TF-IDF training matrix, used by the Nystroem SVM.
+        """
+        if key == 'linear':
+            estimator = LinearRegression()
+        elif key == 'logistic':
+            estimator = LogisticRegression(max_iter=1000, random_state=42, class_weight='balanced')
+        elif key == 'pipeline':
+            # TF-IDF + Logistic with different params
+            estimator = Pipeline([
+                ('tfidf', TfidfVectorizer(max_features=3000, ngram_range=(1, 3), stop_words='english')),
+                ('clf', LogisticRegression(C=0.5, max_iter=1000, random_state=42))
+            ])
+        else:
+            estimator = self._build_svm(X_train)
+        return estimator.set_params(**(params or {}))
+    
+    def _build_svm(self, X_train):
+        """
+        Unfitted SVM for the configured mode.
+
+        'exact' is an RBF SVC whose Platt scaling runs an internal
+        cross-validation, so its fit cost grows superlinearly with the
+        corpus and its predict cost with the number of support vectors.
+        'nystroem' maps the input through a fixed-size Nystroem
+        approximation of the same RBF kernel and trains a linear SVM with
+        sigmoid-calibrated probabilities, so fit and predict scale linearly.
+        """
+        if self.svm_mode == 'exact':
+            return SVC(kernel='rbf', probability=True, random_state=42, class_weight='balanced')
+        
+        # Same gamma SVC derives from gamma='scale'
+        variance = X_train.multiply(X_train).mean() - X_train.mean() ** 2
+        gamma = 1.0 / (X_train.shape[1] * variance) if variance != 0 else 1.0
+        return Pipeline([
+            ('nystroem', Nystroem(
+                kernel='rbf',
+                gamma=gamma,
+                n_components=min(self.NYSTROEM_COMPONENTS, X_train.shape[0]),
+                random_state=42
+            )),
+            ('clf', CalibratedClassifierCV(
+                LinearSVC(random_state=42, class_weight='balanced'),
+                method='sigmoid',
+                cv=3
+            ))
+        ])
+    
     def save_models(self):
-        """Save all models to disk"""
-        joblib.dump(self.linear_model, self.models_path / 'linear_model.pkl')
-        joblib.dump(self.logistic_model, self.models_path / 'logistic_model.pkl')
-        joblib.dump(self.pipeline_model, self.models_path / 'pipeline_model.pkl')
-        joblib.dump(self.svm_model, self.models_path / 'svm_model.pkl')
-        joblib.dump(self.vectorizer, self.models_path / 'vectorizer.pkl')
-        joblib.dump(self.label_encoder, self.models_path / 'label_encoder.pkl')
-        print(f"Models saved to {self.models_path}")
-    
-    def load_models(self):
-        """Load models from disk"""
+        """
+        Save all models as a single bundle file plus manifest.json.
+        The bundle is an uncompressed joblib file, so load_models can
+        memory-map its NumPy arrays. The manifest names the bundle and its
+        sha256 and is replaced last, so readers never see a partial bundle.
+        """
+        bundle_name = f'bundle-{self.version}.joblib'
+        bundle_file = self.models_path / bundle_name
+        previous = self.read_manifest(self.models_path)
+        
+        tmp_file = bundle_file.with_name(bundle_name + '.tmp')
+        joblib.dump({
+            'linear_model': self.linear_model,
+            'logistic_model': self.logistic_model,
+            'pipeline_model': self.pipeline_model,
+            'svm_model': self.svm_model,
+            'vectorizer': self.vectorizer,
+            'label_encoder': self.label_encoder,
+            'fast_engine': self.fast_engine,
+            'model_params': self.model_params,
+        }, tmp_file)
+        os.replace(tmp_file, bundle_file)
+        
+        manifest = {
+            'format': BUNDLE_FORMAT,
+            'model_version': self.version,
+            'bundle': bundle_name,
+            'sha256': _file_sha256(bundle_file),
+            'size': bundle_file.stat().st_size,
+            'svm_mode': self.svm_mode,
+            'svm_refreshed_at': self.svm_refreshed_at.isoformat() if self.svm_refreshed_at else None,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'sklearn_version': sklearn.__version__,
+            'numpy_version': np.__version__,
+        }
+        tmp_manifest = self.models_path / (MANIFEST_FILE + '.tmp')
+        tmp_manifest.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_manifest, self.models_path / MANIFEST_FILE)
+        
+        # Keep the previous bundle for workers that are loading it right now;
+        # workers that already mapped an older one keep its pages after unlink
+        keep = {bundle_name, previous['bundle'] if previous else None}
+        for old_file in self.models_path.glob('bundle-*.joblib'):
+            if old_file.name not in keep:
+                old_file.unlink()
+        print(f"Models saved to {bundle_file}")
+    
+    @staticmethod
+    def read_manifest(models_path):
+        """Parsed manifest.json in models_path, or None when there is none"""
+        try:
+            manifest = json.loads((Path(models_path) / MANIFEST_FILE).read_text())
+        except FileNotFoundError:
+            return None
+        if manifest.get('format') != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported model bundle format: {manifest.get('format')}")
+        return manifest
+    
+    @classmethod
+    def saved_version(cls, models_path):
+        """Version of the models saved in models_path, or None"""
+        manifest = cls.read_manifest(models_path)
+        if manifest is not None:
+            return manifest['model_version']
+        try:
+            return (Path(models_path) / 'version.txt').read_text().strip()
+        except FileNotFoundError:
+            return None
+    
+    def load_models(self, mmap_mode='r'):
+        """
+        Load models from disk.
+        Reads the bundle named in manifest.json after checking its sha256;
+        with mmap_mode='r' its arrays are memory-mapped read-only, so every
+        worker shares the same pages. Falls back to the per-model pickles
+        of older versions when there is no manifest.
+        """
+        manifest = self.read_manifest(self.models_path)
+        if manifest is None:
+            return self._load_legacy_models()
+        
+        bundle_file = self.models_path / manifest['bundle']
+        try:
+            checksum = _file_sha256(bundle_file)
+        except FileNotFoundError:
+            return False
+        if checksum != manifest['sha256']:
+            raise ValueError(f"Checksum mismatch for model bundle {bundle_file}")
+        
+        bundle = joblib.load(bundle_file, mmap_mode=mmap_mode)
+        self.linear_model = bundle['linear_model']
+        self.logistic_model = bundle['logistic_model']
+        self.pipeline_model = bundle['pipeline_model']
+        self.svm_model = bundle['svm_model']
+        self.vectorizer = bundle['vectorizer']
+        self.label_encoder = bundle['label_encoder']
+        self.model_params = bundle.get('model_params', {})
+        self.svm_mode = manifest['svm_mode']
+        self.version = manifest['model_version']
+        refreshed_at = manifest.get('svm_refreshed_at')
+        self.svm_refreshed_at = datetime.fromisoformat(refreshed_at) if refreshed_at else None
+        self.is_trained = True
+        self._build_inference_engine(bundle.get('fast_engine'))
+        return True
+    
+    def _load_legacy_models(self):
         try:
             self.linear_model = joblib.load(self.models_path / 'linear_model.pkl')
             self.logistic_model = joblib.load(self.models_path / 'logistic_model.pkl')
@@ -173,72 +781,412 @@ class SpamDetectionModels:
             self.svm_model = joblib.load(self.models_path / 'svm_model.pkl')
             self.vectorizer = joblib.load(self.models_path / 'vectorizer.pkl')
             self.label_encoder = joblib.load(self.models_path / 'label_encoder.pkl')
+            version_file = self.models_path / 'version.txt'
+            self.version = version_file.read_text().strip() if version_file.exists() else uuid.uuid4().hex
             self.is_trained = True
+            self._build_inference_engine()
             return True
         except FileNotFoundError:
             return False
     
+    def apply_feedback(self, texts, labels, learning_rate, linear_learning_rate):
+        """
+        Copy of these models updated with user corrections ('spam'/'ham'
+        labels for texts), for publishing in their place.
+        The linear-family models take one gradient step of their loss on
+        the corrections: the logistic regression and the pipeline's
+        classifier of their log loss with learning_rate, the linear
+        regression of its squared loss with linear_learning_rate, never
+        moving a prediction past its label. The SVM is unchanged, see
+        refresh_svm.
+        """
+        X_tfidf, X_pipe = self._extract_features(texts)
+        is_spam = np.asarray(labels) == 'spam'
+        updated = self._derived()
+        
+        # Squared loss on the 0/1 spam target
+        updated.linear_model = _gradient_step(
+            self.linear_model, X_tfidf, self.linear_model.predict(X_tfidf) - is_spam,
+            linear_learning_rate, limit_to_target=True
+        )
+        # Log loss: the error is P(classes_[1]) - y
+        logistic = self.logistic_model
+        updated.logistic_model = _gradient_step(
+            logistic, X_tfidf,
+            logistic.predict_proba(X_tfidf)[:, 1] - (is_spam == (logistic.classes_[1] == 'spam')),
+            learning_rate
+        )
+        classifier = self.pipeline_model[-1]
+        updated.pipeline_model = Pipeline(self.pipeline_model.steps[:-1] + [(
+            self.pipeline_model.steps[-1][0],
+            _gradient_step(
+                classifier, X_pipe,
+                classifier.predict_proba(X_pipe)[:, 1] - (is_spam == (classifier.classes_[1] == 'spam')),
+                learning_rate
+            )
+        )])
+        updated._build_inference_engine()
+        return updated
+    
+    def refresh_svm(self, texts, labels, refreshed_at):
+        """
+        Copy of these models whose SVM learned the user corrections given.
+        A streaming-trained (SGD) SVM continues training on them with
+        partial_fit, so texts should be the corrections made since
+        svm_refreshed_at; the kernel SVMs are refit on SAMPLE_DATA plus
+        texts, so texts should be all of them.
+        """
+        updated = self._derived()
+        updated.svm_refreshed_at = refreshed_at
+        X_tfidf = self._extract_features(texts)[0]
+        if self.svm_mode == 'sgd':
+            svm = copy.copy(self.svm_model)
+            # Writable copies, in the dtype of the features (float32 once compacted)
+            svm.coef_ = np.array(svm.coef_)
+            svm.intercept_ = np.array(svm.intercept_, dtype=svm.coef_.dtype)
+            svm.partial_fit(X_tfidf, np.asarray(labels))
+        else:
+            X_sample = self._extract_features([item[0] for item in self.SAMPLE_DATA])[0]
+            X = sp.vstack([X_sample, X_tfidf]).tocsr()
+            svm = updated._build_estimator('svm', X, self.model_params.get('svm'))
+            svm.fit(X, [item[1] for item in self.SAMPLE_DATA] + list(labels))
+        updated.svm_model = svm
+        updated._build_inference_engine()
+        return updated
+    
+    def _derived(self):
+        """Trained copy sharing these models, under a new version"""
+        derived = SpamDetectionModels(
+            models_path=self.models_path,
+            inference_engine=self.inference_engine,
+            cascade=self.cascade,
+            cascade_confidence=self.cascade_confidence
+        )
+        for attr in ('linear_model', 'logistic_model', 'pipeline_model', 'svm_model',
+                     'vectorizer', 'label_encoder', 'svm_mode', 'svm_refreshed_at', 'model_params'):
+            setattr(derived, attr, getattr(self, attr))
+        derived.is_trained = True
+        derived.version = uuid.uuid4().hex
+        return derived
+    
+    def compact(self, prune_threshold=0.05):
+        """
+        Shrink the trained models for serving, in place (see compaction.py).
+        A feature of the pipeline's vectorizer is kept when its weight in
+        the pipeline's classifier is at least prune_threshold times the
+        largest one. The shared vectorizer keeps every feature: it also
+        feeds the kernel SVM, whose RBF distances depend on every column of
+        the L2-normalized rows. The vocabularies become CompactVocabulary
+        arrays, and the linear weights and the features become float32.
+        Streaming-trained models have no vocabulary, so they are only cast.
+        Returns the number of features of each vectorizer before and after.
+        """
+        classifier_name, classifier = self.pipeline_model.steps[-1]
+        vectorizer_name, pipeline_vectorizer = self.pipeline_model.steps[0]
+        summary = {}
+        
+        if isinstance(self.vectorizer, HashingVectorizer):
+            self.vectorizer, columns = compact_vectorizer(self.vectorizer)
+            pipeline_vectorizer, pipeline_columns = compact_vectorizer(pipeline_vectorizer)
+        else:
+            n_features = len(self.vectorizer.vocabulary_)
+            vectorizer, columns = compact_vectorizer(self.vectorizer, np.ones(n_features, dtype=bool))
+            pipeline_vectorizer, pipeline_columns = compact_vectorizer(
+                pipeline_vectorizer, feature_importance(classifier) >= prune_threshold
+            )
+            summary = {
+                'vectorizer': {'features': n_features, 'kept': len(columns)},
+                'pipeline': {'features': len(classifier.coef_.ravel()), 'kept': len(pipeline_columns)},
+            }
+            for key, counts in summary.items():
+                print(f"Compaction kept {counts['kept']} of {counts['features']} {key} features")
+            self.vectorizer = vectorizer
+        
+        self.linear_model = compact_estimator(self.linear_model, columns)
+        self.logistic_model = compact_estimator(self.logistic_model, columns)
+        self.svm_model = compact_estimator(self.svm_model, columns)
+        self.pipeline_model = Pipeline([
+            (vectorizer_name, pipeline_vectorizer),
+            (classifier_name, compact_estimator(classifier, pipeline_columns)),
+        ])
+        # An engine exported from the uncompacted weights no longer applies
+        self.fast_engine = None
+        return summary
+    
+    def _build_inference_engine(self, engine=None):
+        """
+        Export the trained models to the fast engine when it is selected,
+        or reuse the engine saved in the bundle
+        """
+        self.fast_engine = None
+        if self.inference_engine != 'fast':
+            return
+        
+        try:
+            if engine is None:
+                engine = FastInferenceEngine(self)
+            max_diff = engine.check_parity(self, [item[0] for item in self.SAMPLE_DATA])
+        except ValueError as e:
+            print(f"Fast inference disabled, falling back to sklearn: {e}")
+            return
+        
+        print(f"Fast inference enabled (max deviation from sklearn: {max_diff:.1e})")
+        self.fast_engine = engine
+    
     def predict_all_models(self, email: str, content: str):
         """
         Predict using all 4 models and return voting results
         """
+        return self.predict_all_models_batch([(email, content)])[0]
+    
+    def predict_all_models_batch(self, messages):
+        """
+        Predict a list of (email, content) pairs using all 4 models.
+        The text is vectorized once for the whole list and each model is
+        called once on the stacked matrix; one voting result is returned
+        per message, in the same shape as predict_all_models.
+        
+        In cascade mode the models run cheapest first and a message stops
+        as soon as the remaining models can no longer change its majority
+        vote (or, if a cascade confidence is set, once every model so far
+        agrees with at least that confidence). The models it skipped are
+        marked with 'skipped': True in model_results.
+        """
         if not self.is_trained:
             raise ValueError("Models not trained. Call train_models() first.")
         
-        full_text = f"{email} {content}"
-        X_tfidf = self.vectorizer.transform([full_text])
+        if not messages:
+            return []
         
-        model_results = []
+        with metrics.timer(metrics.STAGE_SECONDS, 'vectorize'):
+            full_texts = [f"{email} {content}" for email, content in messages]
+            docs_ngrams = self._analyze_texts(full_texts)
+            X_tfidf = self._tfidf_matrix(self.vectorizer, full_texts, docs_ngrams)
         
-        # 1. Linear Regression
-        linear_pred = self.linear_model.predict(X_tfidf.toarray())[0]
-        linear_is_spam = linear_pred > 0.5
-        linear_conf = abs(linear_pred - 0.5) * 200  # Scale to percentage
-        model_results.append({
-            'model': 'Regresión Lineal',
-            'prediction': 'spam' if linear_is_spam else 'ham',
-            'is_spam': bool(linear_is_spam),
-            'confidence': min(95, max(50, linear_conf))
-        })
+        n_messages = len(messages)
+        n_models = len(self.MODEL_STAGES)
+        model_results = [{} for _ in messages]
+        spam_votes = np.zeros(n_messages, dtype=int)
+        min_confidence = np.full(n_messages, np.inf)
+        pending = np.arange(n_messages)
         
-        # 2. Logistic Regression
-        log_pred = self.logistic_model.predict(X_tfidf)[0]
-        log_proba = self.logistic_model.predict_proba(X_tfidf)[0]
-        model_results.append({
-            'model': 'Regresión Logística',
-            'prediction': log_pred,
-            'is_spam': log_pred == 'spam',
-            'confidence': float(max(log_proba)) * 100
-        })
-        
-        # 3. Custom Pipeline
-        pipe_pred = self.pipeline_model.predict([full_text])[0]
-        pipe_proba = self.pipeline_model.predict_proba([full_text])[0]
-        model_results.append({
-            'model': 'Pipeline Personalizado',
-            'prediction': pipe_pred,
-            'is_spam': pipe_pred == 'spam',
-            'confidence': float(max(pipe_proba)) * 100
-        })
+        for position, (key, name) in enumerate(self.MODEL_STAGES):
+            if len(pending) == 0:
+                break
+            
+            # The pipeline's own TF-IDF step counts as part of the pipeline model
+            with metrics.timer(metrics.MODEL_SECONDS, key):
+                if key == 'pipeline':
+                    X = self._tfidf_matrix(
+                        self.pipeline_model[0],
+                        [full_texts[i] for i in pending],
+                        None if docs_ngrams is None else [docs_ngrams[i] for i in pending]
+                    )
+                else:
+                    X = X_tfidf if len(pending) == n_messages else X_tfidf[pending]
+                try:
+                    labels, confidences = self._run_model(key, X)
+                except Exception:
+                    metrics.MODEL_ERRORS.inc(key)
+                    raise
+            spam_count = int(np.count_nonzero(labels == 'spam'))
+            metrics.MODEL_VOTES.inc(key, 'spam', amount=spam_count)
+            metrics.MODEL_VOTES.inc(key, 'ham', amount=len(labels) - spam_count)
+            
+            for i, label, confidence in zip(pending, labels, confidences):
+                model_results[i][key] = {
+                    'model': name,
+                    'prediction': str(label),
+                    'is_spam': bool(label == 'spam'),
+                    'confidence': float(confidence),
+                    'skipped': False
+                }
+            
+            if not self.cascade:
+                continue
+            
+            # Stop the messages whose verdict is already settled
+            spam_votes[pending] += labels == 'spam'
+            models_run = position + 1
+            remaining = n_models - models_run
+            spam = spam_votes[pending]
+            decided = (2 * spam > n_models) | (2 * (spam + remaining) <= n_models)
+            if self.cascade_confidence is not None:
+                min_confidence[pending] = np.minimum(min_confidence[pending], confidences)
+                unanimous = (spam == models_run) | (spam == 0)
+                decided |= unanimous & (min_confidence[pending] >= self.cascade_confidence)
+            pending = pending[~decided]
         
-        # 4. SVM
-        svm_pred = self.svm_model.predict(X_tfidf)[0]
-        svm_proba = self.svm_model.predict_proba(X_tfidf)[0]
-        model_results.append({
-            'model': 'SVM',
-            'prediction': svm_pred,
-            'is_spam': svm_pred == 'spam',
-            'confidence': float(max(svm_proba)) * 100
-        })
-        
-        # Voting
-        spam_votes = sum(1 for r in model_results if r['is_spam'])
-        ham_votes = 4 - spam_votes
+        # Voting, dominated by the keyword scan of each message
+        with metrics.timer(metrics.STAGE_SECONDS, 'keywords'):
+            results = []
+            for i, (email, content) in enumerate(messages):
+                ordered = [
+                    model_results[i].get(key) or {
+                        'model': name,
+                        'prediction': None,
+                        'is_spam': None,
+                        'confidence': None,
+                        'skipped': True
+                    }
+                    for key, name in self.MODEL_STAGES
+                ]
+                results.append(self._vote(email, full_texts[i], ordered))
+        spam_count = sum(result['is_spam'] for result in results)
+        metrics.MESSAGES.inc('SPAM', amount=spam_count)
+        metrics.MESSAGES.inc('HAM', amount=len(results) - spam_count)
+        
+        if self.cascade:
+            self._record_cascade(results)
+        
+        return results
+    
+    def _run_model(self, key, X):
+        """Labels and confidence percentages of one ensemble member"""
+        engine = self.fast_engine
+        
+        if key == 'linear':
+            scores = engine.predict_linear(X) if engine is not None else self.linear_model.predict(X)
+            labels = np.where(scores > 0.5, 'spam', 'ham')
+            confidences = np.clip(np.abs(scores - 0.5) * 200, 50, 95)  # Scale to percentage
+            return labels, confidences
+        
+        if key == 'svm':
+            model = self.svm_model
+            if engine is not None:
+                predicted, probas = engine.predict_svm(X)
+            elif isinstance(model, SVC):
+                # Labels follow the decision function, like SVC.predict: the
+                # Platt-scaled probabilities can disagree with it.
+                # Model selection scores candidates the same way (served_labels)
+                predicted = (model.decision_function(X) > 0).astype(np.intp)
+                probas = model.predict_proba(X)
+            else:
+                probas = model.predict_proba(X)
+                predicted = probas.argmax(axis=1)
+            return model.classes_[predicted], probas.max(axis=1) * 100
+        
+        model = self.logistic_model if key == 'logistic' else self.pipeline_model[-1]
+        if engine is not None:
+            probas = getattr(engine, f'predict_proba_{key}')(X)
+        else:
+            probas = model.predict_proba(X)
+        
+        # Probabilities are computed once and the labels derived from them
+        return model.classes_[probas.argmax(axis=1)], probas.max(axis=1) * 100
+    
+    def _record_cascade(self, results):
+        """Count how many messages each model was skipped for"""
+        with self._cascade_lock:
+            self._cascade_counts['messages'] += len(results)
+            for result in results:
+                for model_result in result['model_results']:
+                    if model_result['skipped']:
+                        self._cascade_counts[model_result['model']] += 1
+    
+    def get_cascade_stats(self):
+        """How often each model was skipped by the cascade"""
+        with self._cascade_lock:
+            messages = self._cascade_counts['messages']
+            return {
+                'enabled': self.cascade,
+                'messages': messages,
+                'skipped': {
+                    name: {
+                        'count': self._cascade_counts[name],
+                        'rate': self._cascade_counts[name] / messages if messages else 0.0
+                    }
+                    for _, name in self.MODEL_STAGES
+                }
+            }
+    
+    def _analyze_texts(self, texts):
+        """
+        Shared analysis stage: preprocess, tokenize and drop stop words once
+        per text, then build every word n-gram length either vectorizer needs.
+        Returns None if the two vectorizers cannot share a token stream.
+        """
+        analyzer = self._shared_analyzer(self.pipeline_model[0])
+        if analyzer is None:
+            return None
+        
+        preprocess, tokenize, stop_words, max_n = analyzer
+        docs_ngrams = []
+        for text in texts:
+            tokens = [t for t in tokenize(preprocess(text)) if t not in stop_words]
+            docs_ngrams.append([
+                [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+                if n > 1 else tokens
+                for n in range(1, max_n + 1)
+            ])
+        return docs_ngrams
+    
+    @staticmethod
+    def _tfidf_matrix(vectorizer, texts, docs_ngrams):
+        """
+        Feature matrix (TF-IDF, or hashed for streaming-trained models)
+        from the shared n-grams, or from the raw texts
+        """
+        if docs_ngrams is None:
+            return vectorizer.transform(texts)
+        if isinstance(vectorizer, HashingVectorizer):
+            return _hashed_from_ngrams(docs_ngrams, vectorizer)
+        return _tfidf_from_ngrams(docs_ngrams, vectorizer)
+    
+    def _extract_features(self, texts):
+        """
+        Shared feature-extraction stage: analyze each text once and build
+        both feature spaces from that single n-gram stream.
+        Returns (X_tfidf, X_pipe): the matrix for the linear, logistic and
+        SVM models, and the matrix for the pipeline's classifier.
+        """
+        docs_ngrams = self._analyze_texts(texts)
+        return (
+            self._tfidf_matrix(self.vectorizer, texts, docs_ngrams),
+            self._tfidf_matrix(self.pipeline_model[0], texts, docs_ngrams),
+        )
+    
+    def _shared_analyzer(self, pipeline_vectorizer):
+        """
+        Build (and cache for the current vectorizers) the preprocessing,
+        tokenizing and stop-word steps both vectorizers have in common.
+        Returns None if their analysis settings differ.
+        """
+        cached = self._analyzer_cache
+        if cached is not None and cached[0] is self.vectorizer and cached[1] is pipeline_vectorizer:
+            return cached[2]
+        
+        shared_params = self.vectorizer.get_params()
+        pipeline_params = pipeline_vectorizer.get_params()
+        if any(shared_params[k] != pipeline_params[k] for k in SHARED_ANALYSIS_PARAMS):
+            analyzer = None
+        else:
+            analyzer = (
+                self.vectorizer.build_preprocessor(),
+                self.vectorizer.build_tokenizer(),
+                self.vectorizer.get_stop_words() or frozenset(),
+                max(self.vectorizer.ngram_range[1], pipeline_vectorizer.ngram_range[1]),
+            )
+        self._analyzer_cache = (self.vectorizer, pipeline_vectorizer, analyzer)
+        return analyzer
+    
+    def vote(self, email: str, content: str, model_results):
+        """
+        Voting result of a message from ensemble results computed
+        elsewhere (the model_results of a near-duplicate), with the
+        keyword scores and reasons of this message
+        """
+        return self._vote(email, f"{email} {content}", model_results)
+    
+    def _vote(self, email: str, full_text: str, model_results):
+        """Combine the individual model results into the final verdict"""
+        counted = [r for r in model_results if not r['skipped']]
+        spam_votes = sum(1 for r in counted if r['is_spam'])
+        ham_votes = len(counted) - spam_votes
         final_is_spam = spam_votes > ham_votes
-        avg_confidence = sum(r['confidence'] for r in model_results) / 4
+        avg_confidence = sum(r['confidence'] for r in counted) / len(counted)
         
-        # Analyze reasons
-        reasons = self._analyze_reasons(email, content)
+        reasons, spam_score, ham_score = self._analyze_keywords(email, full_text)
         
         return {
             'final_prediction': 'SPAM' if final_is_spam else 'HAM',
@@ -246,54 +1194,134 @@ class SpamDetectionModels:
             'confidence': avg_confidence,
             'spam_votes': spam_votes,
             'ham_votes': ham_votes,
-            'spam_score': self._calculate_spam_score(full_text),
-            'ham_score': self._calculate_ham_score(full_text),
+            'spam_score': spam_score,
+            'ham_score': ham_score,
             'reasons': reasons,
-            'model_results': model_results
+            'model_results': model_results,
+            'model_version': self.version
         }
     
-    def _analyze_reasons(self, email: str, content: str):
-        """Extract analysis reasons"""
-        full_text = f"{email} {content}".lower()
+    def _analyze_keywords(self, email: str, full_text: str):
+        """Reasons, spam score and ham score from a single keyword scan"""
         reasons = []
         
-        spam_indicators = ['win', 'free', 'click', 'urgent', 'prize', 'money', 'offer']
-        ham_indicators = ['meeting', 'project', 'thanks', 'please', 'team', 'review']
-        
         domain = email.split('@')[1] if '@' in email else ''
         if any(d in domain for d in ['company', 'corp', 'gmail', 'outlook']):
             reasons.append(f'Dominio reconocido: {domain}')
         elif any(d in domain for d in ['lottery', 'prize', 'winner']):
             reasons.append(f'Dominio sospechoso: {domain}')
         
-        for word in spam_indicators:
-            if word in full_text and len(reasons) < 6:
-                reasons.append(f'Palabra spam: "{word}"')
-        
-        for word in ham_indicators:
-            if word in full_text and len(reasons) < 6:
-                reasons.append(f'Palabra legítima: "{word}"')
+        keyword_reasons, spam_score, ham_score = get_keyword_matcher().analyze(
+            full_text, self.MAX_REASONS - len(reasons)
+        )
+        for entry in keyword_reasons:
+            label = 'Palabra spam' if entry.label == 'spam' else 'Palabra legítima'
+            reasons.append(f'{label}: "{entry.term}"')
         
-        return reasons[:6]
+        return reasons, spam_score, ham_score
+
+
+def build_models(models_path=None):
+    """New, untrained SpamDetectionModels configured from settings"""
+    return SpamDetectionModels(
+        models_path=models_path,
+        inference_engine=settings.ML_INFERENCE_ENGINE,
+        svm_mode=settings.ML_SVM_MODE,
+        cascade=settings.ML_CASCADE,
+        cascade_confidence=settings.ML_CASCADE_CONFIDENCE
+    )
+
+
+class ModelRegistry:
+    """
+    Holds the published SpamDetectionModels bundle.
+    Readers take the current bundle with a single reference read; new
+    models are loaded into a complete bundle off to the side and published
+    with one reference swap, so a request never sees a mix of old and new
+    models.
+    
+    Training runs in a separate process (see training.py) that saves the
+    models to disk. Every reload_interval seconds get() compares the
+    version on disk with the published one and, when it changed, a
+    background thread loads and publishes the new bundle, so every worker
+    picks up a retrain without a restart.
+    """
+    
+    def __init__(self, factory=build_models, reload_interval=None):
+        self._factory = factory
+        self._bundle = None
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_interval = reload_interval
+        self._next_check = 0.0
     
-    def _calculate_spam_score(self, text: str):
-        spam_words = ['win', 'free', 'click', 'urgent', 'prize', 'money', 'offer', 'limited', 'act now']
-        return sum(10 for w in spam_words if w in text.lower())
+    def get(self):
+        """Current bundle, loaded (or trained) exactly once on first use"""
+        bundle = self._bundle
+        if bundle is None:
+            with self._load_lock:
+                if self._bundle is None:
+                    bundle = self._factory()
+                    if not bundle.load_models():
+                        print("Training new models...")
+                        bundle.train_models()
+                    self._bundle = bundle
+                bundle = self._bundle
+        elif self._reload_due():
+            threading.Thread(target=self.reload_if_changed, name='model-reload', daemon=True).start()
+        return bundle
+    
+    def preload(self):
+        """Load the models ahead of the first request"""
+        self.get()
+    
+    def publish(self, bundle):
+        """Atomically replace the bundle served to new requests"""
+        if not bundle.is_trained:
+            raise ValueError("Cannot publish untrained models")
+        self._bundle = bundle
+    
+    def reload_if_changed(self, wait=False):
+        """
+        Load and publish the models on disk if their version differs from
+        the published one. Returns True when a new bundle was published.
+        Skips the check when a reload is already running, unless wait.
+        """
+        if not self._reload_lock.acquire(blocking=wait):
+            return False
+        try:
+            current = self._bundle
+            if current is None or self._disk_version(current) in (None, current.version):
+                return False
+            bundle = self._factory()
+            if not bundle.load_models():
+                return False
+            self.publish(bundle)
+            print(f"Published models version {bundle.version}")
+            return True
+        finally:
+            self._reload_lock.release()
+    
+    def _reload_due(self):
+        interval = self._reload_interval
+        if interval is None:
+            interval = settings.ML_RELOAD_CHECK_INTERVAL
+        if not interval:
+            return False
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + interval
+        return True
     
-    def _calculate_ham_score(self, text: str):
-        ham_words = ['meeting', 'project', 'thanks', 'please', 'team', 'review', 'attached', 'follow up']
-        return sum(10 for w in ham_words if w in text.lower())
+    @staticmethod
+    def _disk_version(bundle):
+        return SpamDetectionModels.saved_version(bundle.models_path)
 
 
-_models_instance = None
+model_registry = ModelRegistry()
 
 
 def get_models():
-    """Get or create the models singleton"""
-    global _models_instance
-    if _models_instance is None:
-        _models_instance = SpamDetectionModels()
-        if not _models_instance.load_models():
-            print("Training new models...")
-            _models_instance.train_models()
-    return _models_instance
+    """Get the currently published models"""
+    return model_registry.get()
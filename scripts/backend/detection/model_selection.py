@@ -0,0 +1,180 @@
+"""
+Hyperparameter search for train_models (model-selection mode).
+Each ensemble member gets a grid of candidate parameters, scored by
+stratified k-fold cross-validation on the training split. Fits run in
+parallel with joblib. The TF-IDF matrices of each fold are computed once
+per vectorizer configuration through joblib.Memory, and every candidate
+and worker process loads them from the cache instead of re-vectorizing:
+the linear, logistic and SVM candidates share the main vectorizer's
+folds, and pipeline candidates share the folds of their tfidf__ params.
+"""
+import json
+import tempfile
+import time
+from itertools import product
+
+import joblib
+import numpy as np
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+
+
+# Candidate parameters per MODEL_STAGES key, set_params names of the estimators
+# SpamDetectionModels._build_estimator returns. Each includes the fixed defaults.
+DEFAULT_GRID = {
+    'linear': {'fit_intercept': [True, False]},
+    'logistic': {'C': [0.25, 1.0, 4.0, 16.0], 'class_weight': ['balanced', None]},
+    'pipeline': {
+        'tfidf__max_features': [3000, 10000],
+        'tfidf__ngram_range': [(1, 2), (1, 3)],
+        'clf__C': [0.5, 2.0, 8.0],
+    },
+    'svm': {'C': [0.5, 1.0, 5.0], 'gamma': ['scale', 0.5]},
+}
+DEFAULT_NYSTROEM_GRID = {'clf__estimator__C': [0.1, 0.5, 1.0, 5.0]}
+
+
+class ModelSelectionError(ValueError):
+    """Invalid grid or too little data to cross-validate"""
+
+
+def load_grid(path=None, svm_mode='exact'):
+    """
+    Parameter grid per model: DEFAULT_GRID, with the models listed in the
+    JSON file at path replacing theirs. A JSON list given as a value (like
+    an ngram_range) is converted to a tuple.
+    """
+    grid = dict(DEFAULT_GRID)
+    if svm_mode == 'nystroem':
+        grid['svm'] = DEFAULT_NYSTROEM_GRID
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                overrides = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ModelSelectionError(f"Cannot read grid {path}: {e}")
+        if not isinstance(overrides, dict):
+            raise ModelSelectionError(f"Grid {path} must be an object keyed by model")
+        for key, params in overrides.items():
+            if key not in grid:
+                raise ModelSelectionError(f"Unknown model in grid: {key} (expected one of {', '.join(grid)})")
+            if not isinstance(params, dict) or not all(isinstance(values, list) for values in params.values()):
+                raise ModelSelectionError(f"Grid of {key} must map each parameter to a list of values")
+            grid[key] = {
+                name: [tuple(value) if isinstance(value, list) else value for value in values]
+                for name, values in params.items()
+            }
+    return grid
+
+
+def _fold_features(vectorizer, train_texts, test_texts):
+    # Cached with joblib.Memory: keyed on the (unfitted) vectorizer and the fold texts
+    vectorizer = clone(vectorizer)
+    X_train = vectorizer.fit_transform(train_texts)
+    return X_train, vectorizer.transform(test_texts)
+
+
+def _split(estimator, vectorizer):
+    """(vectorizer, classifier) a candidate is cross-validated with"""
+    if isinstance(estimator, Pipeline) and isinstance(estimator[0], TfidfVectorizer):
+        return estimator[0], estimator[-1]
+    return vectorizer, estimator
+
+
+def served_labels(key, estimator, X):
+    """
+    'spam'/'ham' labels of a fitted ensemble member for a MODEL_STAGES key
+    (a pipeline without its vectorizer), as SpamDetectionModels._run_model
+    serves them. The linear model is fitted on a boolean spam target.
+    """
+    if key == 'linear':
+        return np.where(estimator.predict(X) > 0.5, 'spam', 'ham')
+    if isinstance(estimator, SVC):
+        # The decision function, not the Platt-scaled probabilities
+        return estimator.classes_[(estimator.decision_function(X) > 0).astype(np.intp)]
+    return estimator.classes_[estimator.predict_proba(X).argmax(axis=1)]
+
+
+def _fit_fold(key, estimator, vectorizer, fold, memory):
+    """Fit a candidate on one fold: (accuracy, fit seconds)"""
+    train_texts, test_texts, y_train, y_test = fold
+    X_train, X_test = memory.cache(_fold_features)(vectorizer, train_texts, test_texts)
+    estimator = clone(estimator)
+    if isinstance(estimator, SVC):
+        # Served labels do not use the Platt scaling, skip its internal cross-validation
+        estimator.set_params(probability=False)
+    started = time.perf_counter()
+    estimator.fit(X_train, y_train == 'spam' if key == 'linear' else y_train)
+    fit_seconds = time.perf_counter() - started
+    accuracy = np.mean(served_labels(key, estimator, X_test) == y_test)
+    return float(accuracy), fit_seconds
+
+
+def select_hyperparameters(models, texts, labels, grid, folds=5, n_jobs=-1, cache_dir=None):
+    """
+    Cross-validate every candidate of grid for each model of models
+    (a SpamDetectionModels) on texts and their 'spam'/'ham' labels.
+    Returns, per MODEL_STAGES key, the best parameters (highest mean
+    accuracy, ties going to the first candidate in grid order) and the
+    mean and standard deviation of the accuracy and the mean fit seconds
+    of every candidate.
+    cache_dir keeps the fold matrices between runs; by default they are
+    cached in a temporary directory removed afterwards.
+    """
+    labels = np.asarray(labels)
+    folds = int(min(folds, *np.unique(labels, return_counts=True)[1]))
+    if folds < 2:
+        raise ModelSelectionError('Model selection needs at least 2 messages of each label')
+    texts = np.asarray(texts, dtype=object)
+    splits = [
+        (list(texts[train]), list(texts[test]), labels[train], labels[test])
+        for train, test in StratifiedKFold(folds, shuffle=True, random_state=42).split(texts, labels)
+    ]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        memory = joblib.Memory(cache_dir or workdir, verbose=0)
+        features = memory.cache(_fold_features)
+        base = clone(models.vectorizer)
+        candidates = []
+        for key, _ in models.MODEL_STAGES:
+            for params in ParameterGrid(grid.get(key, {})):
+                candidates.append((key, params))
+
+        with joblib.Parallel(n_jobs=n_jobs) as parallel:
+            # Every distinct (vectorizer, fold) matrix once, before the fits that load them
+            vectorizers = {joblib.hash(base): base}
+            for key, params in candidates:
+                if key != 'svm':
+                    vectorizer, _ = _split(models._build_estimator(key, None, params), base)
+                    vectorizers.setdefault(joblib.hash(vectorizer), vectorizer)
+            parallel(
+                joblib.delayed(features)(vectorizer, train_texts, test_texts)
+                for vectorizer, (train_texts, test_texts, _, _) in product(vectorizers.values(), splits)
+            )
+
+            tasks = []
+            for (key, params), fold in product(candidates, splits):
+                X_train = None
+                if key == 'svm' and models.svm_mode == 'nystroem':
+                    # The Nystroem SVM derives its kernel from the training matrix
+                    X_train = features(base, fold[0], fold[1])[0]
+                vectorizer, estimator = _split(models._build_estimator(key, X_train, params), base)
+                tasks.append(joblib.delayed(_fit_fold)(key, estimator, vectorizer, fold, memory))
+            scores = parallel(tasks)
+
+    report = {}
+    for position, (key, params) in enumerate(candidates):
+        accuracies, fit_seconds = zip(*scores[position * folds:(position + 1) * folds])
+        report.setdefault(key, {'folds': folds, 'candidates': []})['candidates'].append({
+            'params': params,
+            'cv_accuracy': float(np.mean(accuracies)),
+            'cv_std': float(np.std(accuracies)),
+            'fit_seconds': float(np.mean(fit_seconds)),
+        })
+    for selection in report.values():
+        # max keeps the first of equal candidates
+        selection['best_params'] = max(selection['candidates'], key=lambda c: c['cv_accuracy'])['params']
+    return report
@@ -1,17 +1,120 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 
 class DetectionLog(models.Model):
     """Log of spam detection predictions"""
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the log is built, not when a buffered writer inserts it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     email = models.EmailField()
+    sender_domain = models.CharField(max_length=255, blank=True, default='')
     content = models.TextField()
     prediction = models.CharField(max_length=10)  # spam or ham
     probability = models.FloatField()
     model_used = models.CharField(max_length=50)
+    # Returned as detection_id in the detect responses, to send feedback against
+    detection_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # User feedback: the correct label ('spam' or 'ham'), and when the online
+    # learner applied it to the models (null while pending)
+    corrected_label = models.CharField(max_length=10, blank=True, default='')
+    corrected_at = models.DateTimeField(null=True, blank=True)
+    feedback_applied_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination walks (created_at, id), optionally per prediction or domain
+            models.Index(fields=['created_at', 'id'], name='detection_created_id_idx'),
+            models.Index(fields=['prediction', 'created_at', 'id'], name='detection_pred_created_idx'),
+            models.Index(fields=['sender_domain', 'created_at', 'id'], name='detection_domain_created_idx'),
+            # Feedback, and the part of it the online learner has not applied yet
+            models.Index(
+                fields=['corrected_at'],
+                condition=models.Q(corrected_at__isnull=False),
+                name='detection_corrected_idx',
+            ),
+            models.Index(
+                fields=['corrected_at'],
+                condition=models.Q(corrected_at__isnull=False, feedback_applied_at__isnull=True),
+                name='detection_feedback_pending_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.email} - {self.prediction} - {self.created_at}"
+    
+    @classmethod
+    def from_prediction(cls, email, content, result):
+        """Build an unsaved log entry for an ensemble result"""
+        return cls(
+            email=email,
+            sender_domain=email.rsplit('@', 1)[1].lower() if '@' in email else '',
+            content=content[:500],
+            prediction=result['final_prediction'],
+            probability=result['confidence'] / 100,
+            model_used='ensemble_4_models'
+        )
+
+
+class DetectionRollup(models.Model):
+    """
+    Detection counts per hour and sender domain, added to by the log writer
+    as it inserts DetectionLog rows (see rollups.py), so statistics never
+    scan the logs and outlive their retention
+    """
+    # Start of the hour, UTC
+    hour = models.DateTimeField()
+    sender_domain = models.CharField(max_length=255, blank=True, default='')
+    spam_count = models.PositiveIntegerField(default=0)
+    ham_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['hour', 'sender_domain']
+        constraints = [
+            # One row per bucket: the upsert in rollups.py adds to it
+            models.UniqueConstraint(fields=['hour', 'sender_domain'], name='rollup_hour_domain_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['sender_domain', 'hour'], name='rollup_domain_hour_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.hour} - {self.sender_domain} - {self.spam_count}/{self.ham_count}"
+
+
+class TrainingJob(models.Model):
+    """Background retraining of the 4 models, run in a separate process"""
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    pid = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Per-model {'accuracy', 'fit_seconds'}, filled in as each model finishes
+    results = models.JSONField(default=dict, blank=True)
+    model_version = models.CharField(max_length=32, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # At most one running job, enforced by the database
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status='running'),
+                name='single_running_training_job',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.id} - {self.status}"
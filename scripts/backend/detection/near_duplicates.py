@@ -0,0 +1,249 @@
+"""
+Near-duplicate index of recently classified messages.
+Spam campaigns send many copies of a message that only differ in names,
+links or numbers, which the exact-match prediction cache cannot catch.
+Each message is reduced to a MinHash signature of its normalized content
+(links, email addresses and numbers masked, then character shingles), and
+signatures are indexed with locality-sensitive hashing (LSH bands), so
+finding the neighbors of a message costs a few dictionary lookups instead
+of a scan. A message whose estimated similarity to a confidently
+classified neighbor reaches the threshold reuses that neighbor's model
+votes without running the models; its keyword scores and reasons (which
+depend on the sender and the exact text) are still its own.
+"""
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+
+_URL_RE = re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'\S+@\S+')
+_NUMBER_RE = re.compile(r'\d[\d.,:/-]*')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Shingles are hashed with a polynomial rolling hash modulo a Mersenne prime, then
+# permuted for MinHash by a * x + b with wraparound on 32 bits (a odd)
+_PRIME = (1 << 31) - 1
+_SHINGLE_BASE = 1000003
+_SEED = 20240917
+
+
+def normalize_content(content: str):
+    """Lowercase, mask links, addresses and numbers, collapse whitespace"""
+    text = _URL_RE.sub(' <url> ', content.lower())
+    text = _EMAIL_RE.sub(' <email> ', text)
+    text = _NUMBER_RE.sub('0', text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of confidently classified messages.
+
+    Signatures have bands * rows hash values; two messages become candidates
+    when all the rows of one band match, and a candidate is a hit when the
+    share of equal hash values (the estimated Jaccard similarity of their
+    shingles) is at least threshold. Only verdicts where every model that
+    ran agreed, with at least min_confidence, are indexed. Entries expire
+    after ttl seconds; past max_entries the oldest are evicted. Messages
+    with fewer than min_shingles shingles are too short to compare and
+    always go to the models.
+    """
+
+    def __init__(self, threshold=0.85, ttl=3600, max_entries=50000, min_confidence=70.0,
+                 bands=32, rows=4, shingle_size=5, min_shingles=20):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_confidence = min_confidence
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+
+        rng = np.random.RandomState(_SEED)
+        num_perm = bands * rows
+        self._a = (rng.randint(0, 1 << 31, size=num_perm).astype(np.uint32) << 1) | 1
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint32)
+
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._next_id = 0
+        # entry id -> (expires_at, signature, band keys, model_results), oldest first
+        self._entries = OrderedDict()
+        self._buckets = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+
+    def bind(self, models):
+        """models, with predict_all_models_batch going through the index"""
+        return _IndexedModels(self, models)
+
+    def signature(self, content: str):
+        """MinHash signature of a message's content, or None when it is too short"""
+        codes = np.frombuffer(
+            normalize_content(content).encode('utf-32-le'), dtype=np.uint32
+        ).astype(np.uint64)
+        count = len(codes) - self.shingle_size + 1
+        if count < self.min_shingles:
+            return None
+        # Polynomial rolling hash of every shingle_size-character window
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            hashes = (hashes * _SHINGLE_BASE + codes[offset:offset + count]) % _PRIME
+        hashes = np.unique(hashes).astype(np.uint32)
+        if len(hashes) < self.min_shingles:
+            return None
+        return (hashes[:, None] * self._a + self._b).min(axis=0)
+
+    def lookup(self, signature, model_version):
+        """(similarity, model_results) of the most similar live entry at or above the threshold, or None"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(model_version)
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(key, ()))
+
+            best = None
+            for entry_id in candidates:
+                expires_at, other, _, model_results = self._entries[entry_id]
+                if expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.count_nonzero(signature == other)) / len(signature)
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, model_results)
+        return best
+
+    def add(self, signature, result):
+        """Index the model votes of a result if its verdict is confident enough"""
+        counted = [r for r in result['model_results'] if not r['skipped']]
+        if not counted or result['spam_votes'] not in (0, len(counted)):
+            return
+        if result['confidence'] < self.min_confidence:
+            return
+
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            self._check_version(result['model_version'])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (
+                time.monotonic() + self.ttl, signature, band_keys, copy.deepcopy(result['model_results'])
+            )
+            for bucket, key in zip(self._buckets, band_keys):
+                bucket.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'threshold': self.threshold,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[i:i + rows].tobytes() for i in range(0, self.bands * rows, rows)]
+
+    def _check_version(self, model_version):
+        # Verdicts of other models are not reused: a new version empties the index
+        if model_version != self._version:
+            self._version = model_version
+            self._entries.clear()
+            for bucket in self._buckets:
+                bucket.clear()
+
+    def _remove(self, entry_id):
+        _, _, band_keys, _ = self._entries.pop(entry_id)
+        for bucket, key in zip(self._buckets, band_keys):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del bucket[key]
+
+
+class _IndexedModels:
+    """
+    Stand-in for a SpamDetectionModels bundle that answers near-duplicates
+    from the index and runs the models for the other messages
+    """
+
+    def __init__(self, index, models):
+        self._index = index
+        self._models = models
+        self.version = models.version
+
+    def predict_all_models_batch(self, messages):
+        index = self._index
+        signatures = [index.signature(content) for _, content in messages]
+
+        results = [None] * len(messages)
+        for i, signature in enumerate(signatures):
+            if signature is None:
+                continue
+            match = index.lookup(signature, self.version)
+            if match is not None:
+                similarity, model_results = match
+                email, content = messages[i]
+                results[i] = self._models.vote(email, content, copy.deepcopy(model_results))
+                results[i]['near_duplicate'] = {'similarity': similarity}
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        hits = len(messages) - len(missing)
+        with index._lock:
+            index.hits += hits
+            index.misses += len(missing)
+        if metrics.enabled():
+            metrics.NEAR_DUPLICATES.inc('hit', amount=hits)
+            metrics.NEAR_DUPLICATES.inc('miss', amount=len(missing))
+
+        if missing:
+            predicted = self._models.predict_all_models_batch([messages[i] for i in missing])
+            for i, result in zip(missing, predicted):
+                result['near_duplicate'] = None
+                if signatures[i] is not None:
+                    index.add(signatures[i], result)
+                results[i] = result
+        return results
+
+
+_index_instance = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """
+    Get or create the index configured in settings.NEAR_DUPLICATE_INDEX,
+    or None when it is disabled
+    """
+    global _index_instance
+    config = settings.NEAR_DUPLICATE_INDEX
+    if not config.get('ENABLED', False):
+        return None
+
+    if _index_instance is None:
+        with _index_lock:
+            if _index_instance is None:
+                _index_instance = NearDuplicateIndex(
+                    threshold=config.get('THRESHOLD', 0.85),
+                    ttl=config.get('TTL', 3600),
+                    max_entries=config.get('MAX_ENTRIES', 50000),
+                    min_confidence=config.get('MIN_CONFIDENCE', 70.0)
+                )
+    return _index_instance
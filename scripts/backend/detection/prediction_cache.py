@@ -0,0 +1,178 @@
+"""
+Versioned cache of ensemble predictions.
+Keys are a hash of the normalized (email, content) pair plus the model
+version, so retraining the models invalidates every cached verdict.
+"""
+import copy
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_message(email: str, content: str):
+    """Collapse whitespace so whitespace-level duplicates share one entry"""
+    return email.strip(), _WHITESPACE_RE.sub(' ', content).strip()
+
+
+def cache_key(email: str, content: str, model_version: str):
+    """Cache key for an already normalized message"""
+    digest = hashlib.sha256(
+        '\x00'.join((model_version, email, content)).encode('utf-8')
+    ).hexdigest()
+    return f'spam-prediction:{digest}'
+
+
+class PredictionCache:
+    """
+    Base class for the cache in front of predict_all_models.
+    Subclasses implement _get and _set against their storage.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def predict(self, models, email: str, content: str):
+        """Cached equivalent of models.predict_all_models(email, content)"""
+        return self.predict_batch(models, [(email, content)])[0]
+
+    def predict_batch(self, models, messages):
+        """
+        Cached equivalent of models.predict_all_models_batch(messages).
+        Misses are predicted together in one batch; the models always see
+        the normalized text, so a cached verdict does not depend on which
+        whitespace variant was scored first.
+        """
+        normalized = [normalize_message(email, content) for email, content in messages]
+        keys = [cache_key(email, content, models.version) for email, content in normalized]
+
+        results = [self._get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        with self._stats_lock:
+            self.hits += len(results) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            predicted = models.predict_all_models_batch([normalized[i] for i in missing])
+            for i, result in zip(missing, predicted):
+                self._set(keys[i], result)
+                results[i] = result
+
+        # Callers add fields to the result, never hand out the cached object
+        return [copy.deepcopy(result) for result in results]
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'backend': self.backend_name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+class LocalPredictionCache(PredictionCache):
+    """In-process LRU cache with a TTL, bounded to max_entries"""
+
+    backend_name = 'local'
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        data = super().stats()
+        with self._lock:
+            data['entries'] = len(self._entries)
+        data['max_entries'] = self.max_entries
+        return data
+
+
+class DjangoPredictionCache(PredictionCache):
+    """
+    Cache backed by one of Django's CACHES aliases, so gunicorn workers
+    can share entries when the alias points to a shared backend
+    (Redis, Memcached, database...). Size limits come from that backend.
+    """
+
+    backend_name = 'django'
+
+    def __init__(self, alias='default', ttl=3600):
+        super().__init__(ttl=ttl)
+        self.alias = alias
+
+    def _get(self, key):
+        return caches[self.alias].get(key)
+
+    def _set(self, key, value):
+        caches[self.alias].set(key, value, timeout=self.ttl)
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """
+    Get or create the prediction cache configured in
+    settings.PREDICTION_CACHE, or None when caching is disabled
+    """
+    global _cache_instance
+    config = settings.PREDICTION_CACHE
+    backend = config.get('BACKEND', 'local')
+    if backend == 'none':
+        return None
+
+    with _cache_lock:
+        if _cache_instance is None:
+            if backend == 'local':
+                _cache_instance = LocalPredictionCache(
+                    max_entries=config.get('MAX_ENTRIES', 10000),
+                    ttl=config.get('TTL', 3600)
+                )
+            elif backend == 'django':
+                _cache_instance = DjangoPredictionCache(
+                    alias=config.get('CACHE_ALIAS', 'default'),
+                    ttl=config.get('TTL', 3600)
+                )
+            else:
+                raise ValueError(f"Unknown prediction cache backend: {backend}")
+    return _cache_instance
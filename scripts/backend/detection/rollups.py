@@ -0,0 +1,185 @@
+"""
+Hourly detection counts per sender domain (DetectionRollup).
+The log writer adds each batch of DetectionLog rows it inserts to the
+rollups in the same transaction, with an upsert that increments the
+counters in the database, so writers in other worker processes never
+overwrite each other's counts. GET /api/stats/ reads only these rows:
+its cost depends on the hours and domains asked for, not on the number
+of detections, and old logs can be deleted (manage.py prune_logs)
+without losing the statistics.
+"""
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .log_queries import InvalidLogQuery, parse_time
+from .models import DetectionLog, DetectionRollup
+
+
+BUCKETS = {
+    'hour': (timedelta(hours=1), timedelta(hours=24)),
+    'day': (timedelta(days=1), timedelta(days=30)),
+}
+MAX_BUCKETS = 2000
+DEFAULT_TOP_DOMAINS = 10
+MAX_TOP_DOMAINS = 100
+
+
+def truncate_hour(moment):
+    """Start of the UTC hour holding moment"""
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_sql():
+    quote = connection.ops.quote_name
+    table = quote(DetectionRollup._meta.db_table)
+    hour, domain, spam, ham = (
+        quote(DetectionRollup._meta.get_field(name).column)
+        for name in ('hour', 'sender_domain', 'spam_count', 'ham_count')
+    )
+    # ON CONFLICT ... DO UPDATE: SQLite 3.24+ and PostgreSQL
+    return (
+        f"INSERT INTO {table} ({hour}, {domain}, {spam}, {ham}) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT ({hour}, {domain}) DO UPDATE SET "
+        f"{spam} = {table}.{spam} + excluded.{spam}, {ham} = {table}.{ham} + excluded.{ham}"
+    )
+
+
+def add_to_rollups(logs):
+    """Count DetectionLog instances in their (hour, sender domain) rollups"""
+    counts = Counter(
+        (truncate_hour(log.created_at), log.sender_domain, log.prediction == 'SPAM') for log in logs
+    )
+    totals = {}
+    for (hour, domain, is_spam), count in counts.items():
+        totals.setdefault((hour, domain), [0, 0])[0 if is_spam else 1] += count
+
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(_upsert_sql(), [
+            (adapt(hour), domain, spam, ham) for (hour, domain), (spam, ham) in totals.items()
+        ])
+
+
+def rebuild_rollups():
+    """
+    Recount the rollups of every (hour, sender domain) that still has
+    DetectionLog rows, from those rows. A rollup already counting more
+    detections than the logs left in its bucket is kept: prune_logs
+    deleted the rest (it keeps logs with feedback, so a pruned hour can
+    still have a few), and its counts would be lost.
+    Holds the write lock while the logs are scanned. Returns the number of
+    rollup rows written.
+    """
+    with transaction.atomic():
+        oldest = DetectionLog.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None:
+            return 0
+
+        grouped = (
+            DetectionLog.objects.order_by()
+            .annotate(bucket=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            .values('bucket', 'sender_domain', 'prediction')
+            .annotate(count=Count('id'))
+        )
+        counts = {}
+        for row in grouped.iterator():
+            bucket_counts = counts.setdefault((row['bucket'], row['sender_domain']), [0, 0])
+            bucket_counts[0 if row['prediction'] == 'SPAM' else 1] += row['count']
+
+        existing = {
+            (rollup.hour, rollup.sender_domain): rollup
+            for rollup in DetectionRollup.objects.filter(hour__gte=truncate_hour(oldest)).iterator()
+        }
+        created, updated = [], []
+        for (hour, domain), (spam, ham) in counts.items():
+            rollup = existing.get((hour, domain))
+            if rollup is None:
+                created.append(DetectionRollup(hour=hour, sender_domain=domain, spam_count=spam, ham_count=ham))
+            elif rollup.spam_count + rollup.ham_count <= spam + ham:
+                rollup.spam_count, rollup.ham_count = spam, ham
+                updated.append(rollup)
+        DetectionRollup.objects.bulk_create(created, batch_size=1000)
+        DetectionRollup.objects.bulk_update(updated, ['spam_count', 'ham_count'], batch_size=1000)
+    return len(created) + len(updated)
+
+
+def _counts(spam, ham):
+    spam, ham = spam or 0, ham or 0
+    total = spam + ham
+    return {'spam': spam, 'ham': ham, 'total': total, 'spam_rate': spam / total if total else None}
+
+
+def rollup_stats(params):
+    """
+    Spam/ham counts from the rollups for the filters in params: bucket
+    (hour or day), since and until (ISO 8601, rounded down to the hour;
+    by default the last 24 hours, or 30 days by day), domain, and top (how
+    many of the busiest sender domains to list)
+    """
+    bucket = params.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        raise InvalidLogQuery('Invalid bucket: expected hour or day')
+    step, default_window = BUCKETS[bucket]
+
+    until = parse_time(params, 'until') or timezone.now() + timedelta(hours=1)
+    until = truncate_hour(until)
+    since = parse_time(params, 'since') or until - default_window
+    since = truncate_hour(since)
+    if bucket == 'day':
+        since = since.replace(hour=0)
+    if since >= until:
+        raise InvalidLogQuery('Invalid range: since must be before until')
+    if (until - since) / step > MAX_BUCKETS:
+        raise InvalidLogQuery(f'Invalid range: more than {MAX_BUCKETS} {bucket} buckets')
+
+    try:
+        top = int(params.get('top', DEFAULT_TOP_DOMAINS))
+    except ValueError:
+        raise InvalidLogQuery('Invalid top')
+    if not 0 <= top <= MAX_TOP_DOMAINS:
+        raise InvalidLogQuery(f'Invalid top: expected 0 to {MAX_TOP_DOMAINS}')
+
+    rollups = DetectionRollup.objects.filter(hour__gte=since, hour__lt=until).order_by()
+    domain = params.get('domain')
+    if domain:
+        rollups = rollups.filter(sender_domain=domain.lower().lstrip('@'))
+
+    # Grouped on the stored hour (no date function per row) and folded into days here
+    counts = {}
+    for row in rollups.values('hour').annotate(spam=Sum('spam_count'), ham=Sum('ham_count')):
+        start = row['hour'].astimezone(dt_timezone.utc)
+        if bucket == 'day':
+            start = start.replace(hour=0)
+        bucket_counts = counts.setdefault(start, [0, 0])
+        bucket_counts[0] += row['spam']
+        bucket_counts[1] += row['ham']
+    # Every bucket of the range, with zeros where nothing was detected
+    series = []
+    start = since
+    while start < until:
+        series.append(dict(start=start.isoformat(), **_counts(*counts.get(start, (0, 0)))))
+        start += step
+
+    domains = (
+        rollups.values('sender_domain')
+        .annotate(spam=Sum('spam_count'), ham=Sum('ham_count'))
+        .annotate(total=F('spam') + F('ham'))
+        .order_by('-total', 'sender_domain')[:top]
+    )
+    return {
+        'bucket': bucket,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'totals': _counts(
+            sum(spam for spam, _ in counts.values()), sum(ham for _, ham in counts.values())
+        ),
+        'series': series,
+        'top_domains': [
+            dict(domain=row['sender_domain'], **_counts(row['spam'], row['ham'])) for row in domains
+        ] if top else [],
+    }
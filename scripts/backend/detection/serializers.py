@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import DetectionLog
+from .models import DetectionLog, TrainingJob
 
 
 class DetectionInputSerializer(serializers.Serializer):
@@ -66,12 +66,34 @@ class SpamDetectionInputSerializer(serializers.Serializer):
     content = serializers.CharField(required=True, max_length=10000)
 
 
+class SpamDetectionBatchInputSerializer(serializers.Serializer):
+    """Serializer for batch spam detection input - a list of email/content pairs"""
+    messages = serializers.ListField(
+        child=SpamDetectionInputSerializer(),
+        allow_empty=False,
+        max_length=5000
+    )
+
+
+class FeedbackInputSerializer(serializers.Serializer):
+    """Serializer for feedback - the correct label of a previous detection"""
+    detection_id = serializers.UUIDField(required=True)
+    label = serializers.CharField(required=True)
+    
+    def validate_label(self, value):
+        value = value.lower()
+        if value not in ('spam', 'ham'):
+            raise serializers.ValidationError('Expected spam or ham')
+        return value
+
+
 class ModelResultSerializer(serializers.Serializer):
-    """Serializer for individual model result"""
+    """Serializer for individual model result (null fields when skipped by the cascade)"""
     model = serializers.CharField()
-    prediction = serializers.CharField()
-    is_spam = serializers.BooleanField()
-    confidence = serializers.FloatField()
+    prediction = serializers.CharField(allow_null=True)
+    is_spam = serializers.BooleanField(allow_null=True)
+    confidence = serializers.FloatField(allow_null=True)
+    skipped = serializers.BooleanField(default=False)
 
 
 class SpamDetectionResultSerializer(serializers.Serializer):
@@ -92,3 +114,10 @@ class DetectionLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetectionLog
         fields = '__all__'
+
+
+class TrainingJobSerializer(serializers.ModelSerializer):
+    """Serializer for background training jobs"""
+    class Meta:
+        model = TrainingJob
+        fields = '__all__'
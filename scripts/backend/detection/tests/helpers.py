@@ -0,0 +1,37 @@
+import contextlib
+import io
+import tempfile
+
+from django.test.utils import override_settings
+
+from detection.ml_models import build_models
+from detection.synthetic import generate_corpus
+
+
+def temporary_directory(test_case):
+    """Directory removed when the test class finishes"""
+    workdir = tempfile.TemporaryDirectory(prefix='detection-tests-')
+    test_case.addClassCleanup(workdir.cleanup)
+    return workdir.name
+
+
+def train_models(models_path, corpus_size=300, seed=42, progress_callback=None, **overrides):
+    """
+    (models, train_models results) for models trained on a synthetic corpus
+    in models_path, under the settings in overrides
+    """
+    with override_settings(ML_TRAINING_CORPUS=None, **overrides), contextlib.redirect_stdout(io.StringIO()):
+        models = build_models(models_path=models_path)
+        models.SAMPLE_DATA = corpus(corpus_size, seed)
+        results = models.train_models(progress_callback, select=False)
+    return models, results
+
+
+def corpus(size=300, seed=42):
+    """(content, label) pairs, the SAMPLE_DATA train_models fits the test models on"""
+    return [(record.content, record.label) for record in generate_corpus(size, seed=seed)]
+
+
+def messages(count=100, seed=7):
+    """(email, content) pairs the test models were not trained on"""
+    return [(record.email, record.content) for record in generate_corpus(count, seed=seed)]
@@ -0,0 +1,76 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from detection.async_inference import InferenceExecutor, LoadSheddingMiddleware
+
+
+class HeldApp:
+    """ASGI app answering 200 once released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope, receive, send):
+        self.started += 1
+        await self.release.wait()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+
+async def call(app, path):
+    """(status, headers, body) of one request"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app({'type': 'http', 'method': 'POST', 'path': path, 'headers': []}, receive, send)
+    start, body = messages
+    return start['status'], dict(start['headers']), body['body']
+
+
+class LoadSheddingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.executor = InferenceExecutor(max_pending=2, retry_after=3)
+        patcher = mock.patch('detection.async_inference.get_inference_executor', return_value=self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_past_the_limit_get_503_with_retry_after(self):
+        path = reverse('detect-async')
+
+        async def scenario():
+            inner = HeldApp()
+            app = LoadSheddingMiddleware(inner)
+            admitted = [asyncio.create_task(call(app, path)) for _ in range(2)]
+            while inner.started < 2:
+                await asyncio.sleep(0)
+
+            status, headers, body = await call(app, path)
+            self.assertEqual(status, 503)
+            self.assertEqual(headers[b'retry-after'], b'3')
+            self.assertEqual(json.loads(body), {'error': 'Server busy, retry later'})
+
+            # Other endpoints are not limited
+            health = asyncio.create_task(call(app, reverse('health')))
+            while inner.started < 3:
+                await asyncio.sleep(0)
+
+            inner.release.set()
+            for task in admitted + [health]:
+                self.assertEqual((await task)[0], 200)
+            # Finished requests free their slots
+            self.assertEqual((await call(app, path))[0], 200)
+
+        asyncio.run(scenario())
+        stats = self.executor.stats()
+        self.assertEqual((stats['pending'], stats['rejected'], stats['completed']), (0, 1, 3))
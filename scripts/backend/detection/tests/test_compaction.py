@@ -0,0 +1,77 @@
+import contextlib
+import io
+import pickle
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from detection.compaction import CompactVocabulary, term_hash
+from detection.ml_models import build_models
+
+from . import helpers
+
+
+class CompactVocabularyTests(SimpleTestCase):
+
+    def test_hash_is_stable_across_processes(self):
+        # str hashes change with PYTHONHASHSEED; the index is saved, so its hashes must not
+        self.assertEqual(term_hash('free money'), -6659565388386593722)
+        self.assertEqual(term_hash('reunión'), -8418998844266274926)
+
+    def test_lookups_survive_pickling(self):
+        vocabulary = pickle.loads(pickle.dumps(CompactVocabulary(['win', 'free money', 'reunión'])))
+        self.assertEqual(dict(vocabulary), {'free money': 0, 'reunión': 1, 'win': 2})
+        np.testing.assert_array_equal(vocabulary.columns(['win', 'lose', 'reunión']), [2, -1, 1])
+        self.assertNotIn('lose', vocabulary)
+
+
+class CompactedTrainingTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reported = {}
+        cls.models, cls.results = helpers.train_models(
+            helpers.temporary_directory(cls), progress_callback=cls.reported.__setitem__,
+            ML_COMPACTION={'ENABLED': True, 'PRUNE_THRESHOLD': 0.05}
+        )
+
+    def test_progress_ends_with_the_compacted_results(self):
+        self.assertEqual(self.reported, self.results)
+        for result in self.reported.values():
+            self.assertIn('uncompacted_accuracy', result)
+
+    def test_compacted_vectorizer_transforms_like_the_shared_analysis(self):
+        texts = [content for _, content in helpers.messages(20)]
+        X_tfidf, X_pipe = self.models._extract_features(texts)
+        self.assertEqual(self.models.vectorizer.transform(texts).dtype, np.float32)
+        np.testing.assert_allclose(self.models.vectorizer.transform(texts).toarray(), X_tfidf.toarray(), rtol=1e-6)
+        np.testing.assert_allclose(
+            self.models.pipeline_model[0].transform(texts).toarray(), X_pipe.toarray(), rtol=1e-6
+        )
+
+
+class KernelSvmCompactionTests(SimpleTestCase):
+    """Pruning never changes the inputs of the kernel SVM"""
+
+    def assert_svm_unchanged(self, svm_mode):
+        models_path = helpers.temporary_directory(self)
+        models, _ = helpers.train_models(models_path, ML_SVM_MODE=svm_mode)
+        compacted = build_models(models_path=models_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compacted.load_models()
+            summary = compacted.compact(prune_threshold=0.05)
+        self.assertEqual(summary['vectorizer']['kept'], summary['vectorizer']['features'])
+        self.assertLess(summary['pipeline']['kept'], summary['pipeline']['features'])
+
+        texts = [f"{email} {content}" for email, content in helpers.messages(200)]
+        labels, confidences = models._run_model('svm', models._extract_features(texts)[0])
+        compacted_labels, compacted_confidences = compacted._run_model('svm', compacted._extract_features(texts)[0])
+        np.testing.assert_array_equal(compacted_labels, labels)
+        np.testing.assert_allclose(compacted_confidences, confidences, atol=1e-4)
+
+    def test_exact_svm(self):
+        self.assert_svm_unchanged('exact')
+
+    def test_nystroem_svm(self):
+        self.assert_svm_unchanged('nystroem')
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from detection.log_writer import DetectionLogWriter
+from detection.models import DetectionLog
+
+from . import helpers
+
+
+class DetectBatchViewTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.models, _ = helpers.train_models(helpers.temporary_directory(cls))
+
+    def setUp(self):
+        for target, value in (
+            ('detection.views.get_models', self.models),
+            ('detection.views.get_log_writer', DetectionLogWriter(mode='sync')),
+            ('detection.views.get_prediction_cache', None),
+            ('detection.views.get_near_duplicate_index', None),
+            ('detection.views.get_micro_batcher', None),
+        ):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_results_match_single_detections_in_input_order(self):
+        messages = [{'email': email, 'content': content} for email, content in helpers.messages(12)]
+        response = self.client.post('/api/detect/batch/', {'messages': messages}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['count'], len(messages))
+        for message, result in zip(messages, body['results']):
+            log = DetectionLog.objects.get(detection_id=result['detection_id'])
+            self.assertEqual((log.email, log.content), (message['email'], message['content']))
+
+        for message, result in zip(messages, body['results']):
+            single = self.client.post('/api/detect/', message, content_type='application/json').json()
+            self.assertEqual(result['email'], message['email'])
+            self.assertEqual(set(result), set(single))
+            self.assertNotEqual(result.pop('detection_id'), single.pop('detection_id'))
+            self.assertEqual(result, single)
+
+        self.assertEqual(DetectionLog.objects.count(), 2 * len(messages))
+
+    def test_invalid_batches_are_rejected(self):
+        for body in ({'messages': []}, {'messages': [{'email': 'not-an-email', 'content': 'x'}]}, {}):
+            response = self.client.post('/api/detect/batch/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(DetectionLog.objects.exists())
@@ -0,0 +1,45 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from detection.fast_inference import PARITY_TOLERANCE, FastInferenceEngine
+
+from . import helpers
+
+
+class ParityTests(SimpleTestCase):
+    """The NumPy engine gives the sklearn outputs, in every SVM mode"""
+
+    def assert_parity(self, **overrides):
+        models, _ = helpers.train_models(
+            helpers.temporary_directory(self), ML_INFERENCE_ENGINE='fast', **overrides
+        )
+        # train_models falls back to sklearn when the engine fails its parity check
+        self.assertIsInstance(models.fast_engine, FastInferenceEngine)
+
+        messages = helpers.messages(200)
+        max_diff = models.fast_engine.check_parity(models, [f"{email} {content}" for email, content in messages])
+        self.assertLessEqual(max_diff, PARITY_TOLERANCE)
+
+        fast = models.predict_all_models_batch(messages)
+        engine, models.fast_engine = models.fast_engine, None
+        reference = models.predict_all_models_batch(messages)
+        models.fast_engine = engine
+        for fast_result, reference_result in zip(fast, reference):
+            self.assertEqual(
+                [r['prediction'] for r in fast_result['model_results']],
+                [r['prediction'] for r in reference_result['model_results']],
+            )
+            np.testing.assert_allclose(
+                [r['confidence'] for r in fast_result['model_results']],
+                [r['confidence'] for r in reference_result['model_results']],
+                atol=PARITY_TOLERANCE * 100,
+            )
+
+    def test_exact_svm(self):
+        self.assert_parity(ML_SVM_MODE='exact')
+
+    def test_nystroem_svm(self):
+        self.assert_parity(ML_SVM_MODE='nystroem')
+
+    def test_compacted_exact_svm(self):
+        self.assert_parity(ML_SVM_MODE='exact', ML_COMPACTION={'ENABLED': True, 'PRUNE_THRESHOLD': 0.05})
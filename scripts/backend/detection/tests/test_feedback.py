@@ -0,0 +1,168 @@
+import contextlib
+import io
+import threading
+from unittest import mock
+
+import numpy as np
+import scipy.sparse as sp
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from sklearn.linear_model import LinearRegression, LogisticRegression
+
+from detection.feedback import OnlineLearner, record_feedback
+from detection.ml_models import ModelRegistry, _gradient_step, build_models, models_lock
+from detection.models import DetectionLog
+
+from . import helpers
+
+
+class GradientStepTests(SimpleTestCase):
+
+    def setUp(self):
+        self.estimator = LogisticRegression().fit(
+            sp.csr_matrix([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0], [0.0, 0.0]]), ['spam', 'ham', 'spam', 'ham']
+        )
+
+    def test_step_uses_the_mean_gradient(self):
+        row = sp.csr_matrix([[1.0, 0.5]])
+        once = _gradient_step(self.estimator, row, np.array([0.5]), 1.0)
+        repeated = _gradient_step(self.estimator, sp.vstack([row] * 32), np.full(32, 0.5), 1.0)
+        np.testing.assert_allclose(repeated.coef_, once.coef_)
+        np.testing.assert_allclose(once.coef_, self.estimator.coef_ - [[0.5, 0.25]])
+        np.testing.assert_allclose(once.intercept_, self.estimator.intercept_ - 0.5)
+
+    def test_limited_step_stops_at_the_target(self):
+        regression = LinearRegression().fit(sp.csr_matrix([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]), [1.0, 0.0, 1.0])
+        row = sp.csr_matrix([[0.6, 0.8]])
+        error = regression.predict(row) - 0.0
+        self.assertGreater(error[0], 0.5)
+        stepped = _gradient_step(regression, row, error, 10.0, limit_to_target=True)
+        np.testing.assert_allclose(stepped.predict(row), [0.0], atol=1e-12)
+        unlimited = _gradient_step(regression, row, error, 10.0)
+        self.assertLess(unlimited.predict(row)[0], -1.0)
+
+    def test_original_is_untouched(self):
+        coef = self.estimator.coef_.copy()
+        _gradient_step(self.estimator, sp.csr_matrix([[1.0, 1.0]]), np.array([1.0]), 1.0)
+        np.testing.assert_array_equal(self.estimator.coef_, coef)
+
+
+class ModelsLockTests(SimpleTestCase):
+
+    def test_lock_is_exclusive_across_threads(self):
+        models_path = helpers.temporary_directory(self)
+        inside = threading.Event()
+        release = threading.Event()
+        acquired = []
+
+        def hold():
+            with models_lock(models_path):
+                inside.set()
+                release.wait(5)
+
+        def wait_for_lock():
+            with models_lock(models_path):
+                acquired.append(release.is_set())
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        inside.wait(5)
+        waiter = threading.Thread(target=wait_for_lock)
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        release.set()
+        holder.join(5)
+        waiter.join(5)
+        self.assertEqual(acquired, [True])
+
+    def test_lock_times_out(self):
+        models_path = helpers.temporary_directory(self)
+        errors = []
+
+        def wait_for_lock():
+            try:
+                with models_lock(models_path, timeout=0.2):
+                    pass
+            except TimeoutError as e:
+                errors.append(e)
+
+        with models_lock(models_path):
+            waiter = threading.Thread(target=wait_for_lock)
+            waiter.start()
+            waiter.join(5)
+        self.assertEqual(len(errors), 1)
+        with models_lock(models_path, timeout=0.2):
+            pass
+
+
+class OnlineLearnerTests(TestCase):
+
+    def setUp(self):
+        self.models_path = helpers.temporary_directory(self)
+        self.models, _ = helpers.train_models(self.models_path, corpus_size=120)
+        self.registry = ModelRegistry(factory=lambda: build_models(models_path=self.models_path), reload_interval=0)
+        self.registry.publish(self.models)
+        settings = override_settings(ML_MODELS_PATH=self.models_path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for patcher in (
+            mock.patch('detection.feedback.model_registry', self.registry),
+            mock.patch('detection.feedback.get_online_learner'),
+        ):
+            patched = patcher.start()
+            self.addCleanup(patcher.stop)
+        # The learner started by record_feedback
+        self.notify = patched.return_value.notify
+
+        self.email, self.content = 'promo@deals.com', 'Exclusive discount on your next order, reply to claim it'
+        self.log = DetectionLog.objects.create(
+            email=self.email, sender_domain='deals.com', content=self.content,
+            prediction='HAM', probability=0.6, model_used='ensemble_4_models'
+        )
+        self.learner = OnlineLearner(batch_size=8, svm_refresh_interval=0)
+
+    def test_one_correction_moves_toward_the_label_without_overshooting(self):
+        text = f"{self.email} {self.content}"
+        X = self.models._extract_features([text])[0]
+        before = self.models.linear_model.predict(X)[0]
+        self.assertLess(before, 1.0)
+        for learning_rate in (0.5, 100.0):
+            updated = self.models.apply_feedback([text], ['spam'], learning_rate, learning_rate)
+            after = updated.linear_model.predict(X)[0]
+            self.assertGreater(after, before)
+            self.assertLessEqual(after, 1.0 + 1e-9)
+            self.assertGreater(self.spam_probability(updated), self.spam_probability(self.models))
+        # With a large rate the prediction lands on the label
+        self.assertAlmostEqual(after, 1.0)
+
+    def spam_probability(self, models):
+        logistic = models.logistic_model
+        X = models._extract_features([f"{self.email} {self.content}"])[0]
+        return logistic.predict_proba(X)[0, list(logistic.classes_).index('spam')]
+
+    def run_learner(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.learner.run_once()
+
+    def test_repeated_correction_is_not_queued_again(self):
+        record_feedback(self.log.detection_id, 'spam')
+        corrected_at = DetectionLog.objects.get(pk=self.log.pk).corrected_at
+        record_feedback(self.log.detection_id, 'spam')
+        self.assertEqual(DetectionLog.objects.get(pk=self.log.pk).corrected_at, corrected_at)
+        self.notify.assert_called_once_with()
+
+    def test_correction_is_applied_and_published(self):
+        before = self.spam_probability(self.models)
+        record_feedback(self.log.detection_id, 'spam')
+        self.assertEqual(self.run_learner(), 1)
+
+        published = self.registry.get()
+        self.assertNotEqual(published.version, self.models.version)
+        self.assertEqual(published.saved_version(self.models_path), published.version)
+        self.assertGreater(self.spam_probability(published), before)
+        self.assertEqual(self.spam_probability(self.models), before)
+        self.assertIsNotNone(DetectionLog.objects.get(pk=self.log.pk).feedback_applied_at)
+        # Nothing left to apply
+        self.assertEqual(self.run_learner(), 0)
+        self.assertIs(self.registry.get(), published)
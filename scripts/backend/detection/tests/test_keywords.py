@@ -0,0 +1,78 @@
+import json
+import random
+
+from django.test import SimpleTestCase
+
+from detection.keywords import DEFAULT_LEXICON, KeywordEntry, KeywordMatcher, load_lexicon
+from detection.ml_models import SpamDetectionModels
+
+from . import helpers
+
+
+def baseline_analysis(email, content):
+    """Reasons and scores as computed before the lexicon matcher, one scan per word list"""
+    full_text = f"{email} {content}".lower()
+    reasons = []
+    domain = email.split('@')[1] if '@' in email else ''
+    if any(d in domain for d in ['company', 'corp', 'gmail', 'outlook']):
+        reasons.append(f'Dominio reconocido: {domain}')
+    elif any(d in domain for d in ['lottery', 'prize', 'winner']):
+        reasons.append(f'Dominio sospechoso: {domain}')
+    for word in ['win', 'free', 'click', 'urgent', 'prize', 'money', 'offer']:
+        if word in full_text and len(reasons) < 6:
+            reasons.append(f'Palabra spam: "{word}"')
+    for word in ['meeting', 'project', 'thanks', 'please', 'team', 'review']:
+        if word in full_text and len(reasons) < 6:
+            reasons.append(f'Palabra legítima: "{word}"')
+    spam_score = sum(10 for w in ['win', 'free', 'click', 'urgent', 'prize', 'money', 'offer', 'limited', 'act now']
+                     if w in full_text)
+    ham_score = sum(10 for w in ['meeting', 'project', 'thanks', 'please', 'team', 'review', 'attached', 'follow up']
+                    if w in full_text)
+    return reasons, spam_score, ham_score
+
+
+class KeywordMatcherTests(SimpleTestCase):
+
+    def test_same_reasons_and_scores_as_the_baseline_scan(self):
+        models = SpamDetectionModels(models_path=helpers.temporary_directory(self))
+        messages = helpers.messages(300) + [
+            ('winner@lottery.com', 'URGENT: click to WIN free money, act now! Limited offer, prize inside'),
+            ('jane@company.com', 'Thanks, please review the attached project plan before the team meeting. Follow up soon'),
+            ('a@b.com', ''),
+        ]
+        for email, content in messages:
+            self.assertEqual(
+                models._analyze_keywords(email, f"{email} {content}"), baseline_analysis(email, content),
+                (email, content)
+            )
+
+    def test_regex_and_substring_paths_agree(self):
+        rng = random.Random(3)
+        words = ['win', 'window', 'free', 'freedom', 'act now', 'team', 'teammate', 'follow up', 'reunión']
+        terms = words + [''.join(rng.choice('abcdefgh') for _ in range(rng.randint(2, 5))) for _ in range(200)]
+        entries = [KeywordEntry(term, rng.choice(['spam', 'ham']), rng.randint(1, 20), rng.random() < 0.5)
+                   for term in terms]
+        large = KeywordMatcher(entries)
+        self.assertIsNotNone(large._pattern)
+        texts = [content for _, content in helpers.messages(100)] + [
+            'Windows freedom for the teammate: act now, follow up at the REUNIÓN', 'abcabcdefgh hgfedcba',
+        ]
+        for text in texts:
+            lowered = text.lower()
+            expected = [entry for entry in large.entries if entry.term in lowered]
+            self.assertEqual(large.match(text), expected, text)
+        small = KeywordMatcher(entries[:KeywordMatcher.REGEX_MIN_TERMS])
+        self.assertIsNone(small._pattern)
+
+    def test_custom_lexicon_file(self):
+        path = f"{helpers.temporary_directory(self)}/lexicon.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([{'term': 'Gratis', 'label': 'spam', 'weight': 25, 'reason': True},
+                       {'term': 'reunión', 'label': 'ham'}], f)
+        matcher = KeywordMatcher(load_lexicon(path))
+        reasons, spam_score, ham_score = matcher.analyze('Dinero GRATIS antes de la reunión', 5)
+        self.assertEqual([entry.term for entry in reasons], ['gratis'])
+        self.assertEqual((spam_score, ham_score), (25, 10))
+
+    def test_default_lexicon_has_no_duplicates(self):
+        self.assertEqual(len(KeywordMatcher(DEFAULT_LEXICON).entries), len(DEFAULT_LEXICON))
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from detection.models import DetectionLog
+
+
+class LogCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now().replace(microsecond=0)
+        logs = []
+        for i in range(12):
+            # Pairs of logs share a created_at, so pages must break ties on id
+            logs.append(DetectionLog(
+                created_at=now - timedelta(minutes=i // 2),
+                email=f'user{i}@{"spam.com" if i % 3 == 0 else "corp.com"}',
+                sender_domain='spam.com' if i % 3 == 0 else 'corp.com',
+                content=f'message {i}',
+                prediction='SPAM' if i % 3 == 0 else 'HAM',
+                probability=0.9,
+                model_used='ensemble_4_models',
+            ))
+        DetectionLog.objects.bulk_create(logs)
+        cls.now = now
+
+    def walk(self, **params):
+        """ids of every page of /api/logs/, following X-Next-Cursor"""
+        ids, pages, cursor = [], 0, None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            response = self.client.get('/api/logs/', query)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(log['id'] for log in response.json())
+            pages += 1
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                self.assertNotIn('Link', response.headers)
+                return ids, pages
+            self.assertIn('rel="next"', response.headers['Link'])
+
+    def test_pages_cover_every_log_once_newest_first(self):
+        ids, pages = self.walk(limit=5)
+        expected = list(DetectionLog.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_filters_apply_to_every_page(self):
+        ids, _ = self.walk(limit=2, prediction='spam', domain='spam.com')
+        expected = list(
+            DetectionLog.objects.filter(prediction='SPAM', sender_domain='spam.com')
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 4)
+
+    def test_time_range(self):
+        since = (self.now - timedelta(minutes=2)).isoformat()
+        until = self.now.isoformat()
+        ids, _ = self.walk(since=since, until=until)
+        self.assertEqual(len(ids), 4)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': '0'}, {'prediction': 'maybe'}, {'since': 'yesterday'}):
+            response = self.client.get('/api/logs/', params)
+            self.assertEqual(response.status_code, 400, params)
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.test import TransactionTestCase
+
+from detection.log_writer import DetectionLogWriter
+from detection.models import DetectionLog, DetectionRollup
+
+
+def new_logs(count):
+    return [
+        DetectionLog(
+            email=f'user{i}@corp.com', sender_domain='corp.com', content=f'message {i}',
+            prediction='HAM', probability=0.9, model_used='ensemble_4_models'
+        )
+        for i in range(count)
+    ]
+
+
+class StalledWriter(DetectionLogWriter):
+    """Writer whose thread waits for release before each insert, so its queue fills up"""
+
+    def __init__(self, **kwargs):
+        super().__init__(batch_size=1, **kwargs)
+        self.inserting = threading.Event()
+        self.release = threading.Event()
+
+    def _insert(self, logs):
+        self.inserting.set()
+        self.release.wait(10)
+        super()._insert(logs)
+
+    def fill(self):
+        """Queue one row for the stalled thread and max_queue more"""
+        self.write_many(new_logs(1), block=False)
+        self.inserting.wait(5)
+        self.write_many(new_logs(self.max_queue), block=False)
+
+
+class LogWriterTests(TransactionTestCase):
+
+    def test_flush_waits_for_the_queued_rows_and_their_rollups(self):
+        # Two full batches, then a partial one written after flush_interval
+        writer = DetectionLogWriter(batch_size=10, flush_interval=0.05)
+        self.addCleanup(writer.close)
+        writer.write_many(new_logs(25))
+        writer.write(new_logs(1)[0])
+        writer.flush()
+        self.assertEqual(DetectionLog.objects.count(), 26)
+        self.assertEqual(sum(rollup.ham_count for rollup in DetectionRollup.objects.all()), 26)
+        self.assertEqual(writer.stats()['written'], 26)
+
+    def test_close_writes_everything(self):
+        writer = DetectionLogWriter(batch_size=1000, flush_interval=60)
+        writer.write_many(new_logs(40))
+        writer.close()
+        self.assertEqual(DetectionLog.objects.count(), 40)
+
+    def test_full_queue_drops_new_rows(self):
+        writer = StalledWriter(max_queue=3, overflow='drop')
+        writer.fill()
+        writer.write_many(new_logs(5))
+        self.assertEqual(writer.stats()['dropped'], 5)
+        writer.release.set()
+        writer.close()
+        self.assertEqual(DetectionLog.objects.count(), 4)
+
+    def test_block_waits_once_per_call(self):
+        writer = StalledWriter(max_queue=2, overflow='block', block_timeout=0.2)
+        writer.fill()
+        started = time.monotonic()
+        writer.write_many(new_logs(50))
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(writer.stats()['dropped'], 50)
+        writer.release.set()
+        writer.close()
+        self.assertEqual(DetectionLog.objects.count(), 3)
+
+    def test_sync_mode_writes_immediately(self):
+        DetectionLogWriter(mode='sync').write_many(new_logs(3))
+        self.assertEqual(DetectionLog.objects.count(), 3)
@@ -0,0 +1,135 @@
+import re
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from detection import metrics
+from detection.log_writer import DetectionLogWriter
+
+from . import helpers
+
+
+METRIC_NAME = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+SAMPLE = re.compile(rf'^({METRIC_NAME})(\{{{LABEL}(?:,{LABEL})*\}})? (\S+)$')
+VALUE = re.compile(r'^(?:[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?|\+Inf|-Inf|NaN)$')
+HISTOGRAM_SUFFIXES = ('_bucket', '_count', '_sum')
+
+
+def parse_exposition(test_case, text):
+    """
+    {family: (type, [(sample name, labels text, value)])} of a Prometheus
+    text exposition, failing test_case on any malformed line
+    """
+    test_case.assertTrue(text.endswith('\n'), 'The exposition must end with a newline')
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            name, _, documentation = line[len('# HELP '):].partition(' ')
+            test_case.assertRegex(name, rf'^{METRIC_NAME}$')
+            test_case.assertTrue(documentation, f'Empty HELP for {name}')
+            test_case.assertNotIn(name, families, f'{name} is exposed twice')
+            current = name
+            families[name] = (None, [])
+        elif line.startswith('# TYPE '):
+            name, _, metric_type = line[len('# TYPE '):].partition(' ')
+            test_case.assertEqual(name, current, f'TYPE of {name} does not follow its HELP')
+            test_case.assertIn(metric_type, ('counter', 'gauge', 'histogram'))
+            families[name] = (metric_type, [])
+        else:
+            match = SAMPLE.match(line)
+            test_case.assertIsNotNone(match, f'Malformed sample line: {line!r}')
+            name, labels, value = match.groups()
+            test_case.assertRegex(value, VALUE)
+            metric_type, samples = families[current]
+            suffixes = HISTOGRAM_SUFFIXES if metric_type == 'histogram' else ('',)
+            test_case.assertIn(name, [current + suffix for suffix in suffixes], f'{name} outside its family')
+            samples.append((name, labels or '', value))
+    return families
+
+
+def assert_histogram_buckets(test_case, name, samples):
+    """Cumulative buckets per series, ending in +Inf equal to _count"""
+    buckets = {}
+    counts = {}
+    for sample_name, labels, value in samples:
+        if sample_name == name + '_bucket':
+            series = re.sub(r',?le="[^"]*"', '', labels).replace('{}', '')
+            le = re.search(r'le="([^"]*)"', labels).group(1)
+            buckets.setdefault(series, []).append((le, int(value)))
+        elif sample_name == name + '_count':
+            counts[labels] = int(value)
+    test_case.assertEqual(set(buckets), set(counts))
+    for series, series_buckets in buckets.items():
+        bounds = [le for le, _ in series_buckets]
+        test_case.assertEqual(bounds[-1], '+Inf')
+        test_case.assertEqual([float(le) for le in bounds], sorted(float(le) for le in bounds))
+        values = [count for _, count in series_buckets]
+        test_case.assertEqual(values, sorted(values))
+        test_case.assertEqual(values[-1], counts[series])
+
+
+class ExpositionFormatTests(SimpleTestCase):
+
+    def test_registry_render(self):
+        registry = metrics.MetricsRegistry()
+        requests = registry.counter('test_requests_total', 'Requests', ['endpoint', 'status'])
+        latency = registry.histogram('test_latency_seconds', 'Latency', ['endpoint'], buckets=(0.1, 1.0))
+        registry.counter('test_unused_total', 'Never incremented')
+        requests.inc('detect', '200')
+        requests.inc('detect', '200')
+        requests.inc('say "hi"\\\n', '500')
+        for seconds in (0.05, 0.5, 0.5, 3.0):
+            latency.observe(seconds, 'detect')
+
+        text = registry.render()
+        families = parse_exposition(self, text)
+        self.assertEqual(families['test_requests_total'][0], 'counter')
+        self.assertIn('test_requests_total{endpoint="detect",status="200"} 2', text)
+        self.assertIn(r'test_requests_total{endpoint="say \"hi\"\\\n",status="500"} 1', text)
+        self.assertEqual(families['test_unused_total'], ('counter', []))
+        self.assertIn('test_latency_seconds_bucket{endpoint="detect",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{endpoint="detect",le="1.0"} 3', text)
+        self.assertIn('test_latency_seconds_bucket{endpoint="detect",le="+Inf"} 4', text)
+        self.assertIn('test_latency_seconds_sum{endpoint="detect"} 4.05', text)
+        assert_histogram_buckets(self, 'test_latency_seconds', families['test_latency_seconds'][1])
+
+
+class MetricsViewTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.models, _ = helpers.train_models(helpers.temporary_directory(cls))
+
+    def setUp(self):
+        for target, value in (
+            ('detection.views.get_models', self.models),
+            ('detection.views.get_log_writer', DetectionLogWriter(mode='sync')),
+            ('detection.views.get_prediction_cache', None),
+            ('detection.views.get_near_duplicate_index', None),
+            ('detection.views.get_micro_batcher', None),
+        ):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_metrics_endpoint_is_well_formed(self):
+        for email, content in helpers.messages(3):
+            self.client.post('/api/detect/', {'email': email, 'content': content}, content_type='application/json')
+        self.client.post('/api/detect/', {'email': 'not an email'}, content_type='application/json')
+
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        families = parse_exposition(self, response.content.decode('utf-8'))
+        for name, (metric_type, samples) in families.items():
+            if metric_type == 'histogram':
+                assert_histogram_buckets(self, name, samples)
+        self.assertTrue(families['spam_detection_request_seconds'][1])
+        self.assertTrue(families['spam_detection_model_seconds'][1])
+        self.assertEqual(
+            families['spam_detection_model_info'][1],
+            [('spam_detection_model_info', f'{{version="{self.models.version}",svm_mode="{self.models.svm_mode}"}}', '1')]
+        )
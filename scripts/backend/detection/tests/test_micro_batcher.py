@@ -0,0 +1,83 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from detection.micro_batcher import MicroBatcher
+
+
+class EchoModels:
+    """Models answering each message with its own content, recording the batches"""
+
+    version = 'v1'
+
+    def __init__(self):
+        self.batches = []
+        self.stalled = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def predict_all_models_batch(self, messages):
+        if threading.current_thread().name == 'detection-micro-batcher':
+            self.batches.append(len(messages))
+            if not self.release.is_set():
+                self.stalled.set()
+                self.release.wait(5)
+        return [{'content': content} for _, content in messages]
+
+
+class MicroBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.models = EchoModels()
+
+    def start_batcher(self, **kwargs):
+        batcher = MicroBatcher(**kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_results_go_back_to_their_callers(self):
+        batcher = self.start_batcher(max_wait=0.05, max_batch_size=64)
+        results = {}
+        ready = threading.Barrier(8)
+
+        def detect(i):
+            messages = [('a@b.com', f'{i}-{j}') for j in range(i % 3 + 1)]
+            with batcher.request():
+                ready.wait(5)
+                results[i] = batcher.predict_batch(self.models, messages)
+
+        threads = [threading.Thread(target=detect, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        for i in range(8):
+            self.assertEqual(
+                [result['content'] for result in results[i]], [f'{i}-{j}' for j in range(i % 3 + 1)]
+            )
+        self.assertEqual(sum(self.models.batches), sum(i % 3 + 1 for i in range(8)))
+        self.assertLess(len(self.models.batches), 8)
+
+    def test_lone_request_is_not_held_for_the_window(self):
+        batcher = self.start_batcher(max_wait=10)
+        with batcher.request():
+            result, = batcher.predict_batch(self.models, [('a@b.com', 'hello')])
+        self.assertEqual(result['content'], 'hello')
+
+    def test_stalled_batch_is_scored_inline(self):
+        batcher = self.start_batcher(timeout=0.1)
+        self.models.release.clear()
+        result, = batcher.predict_batch(self.models, [('a@b.com', 'hello')])
+        self.assertTrue(self.models.stalled.is_set())
+        self.assertEqual(result['content'], 'hello')
+        # Queued behind the stalled batch: cancelled, then skipped by the thread
+        result, = batcher.predict_batch(self.models, [('a@b.com', 'queued')])
+        self.assertEqual(result['content'], 'queued')
+        self.assertEqual(batcher.stats()['timed_out'], 2)
+
+        self.models.release.set()
+        result, = batcher.predict_batch(self.models, [('a@b.com', 'after')])
+        self.assertEqual(result['content'], 'after')
+        self.assertEqual(self.models.batches, [1, 1])
+        self.assertEqual(batcher.stats()['timed_out'], 2)
@@ -0,0 +1,78 @@
+import numpy as np
+from django.test import SimpleTestCase
+from sklearn.model_selection import train_test_split
+
+from . import helpers
+
+
+class SvmLabelTests(SimpleTestCase):
+    """The SVM vote served by the API is the label SVC.predict gives"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # On a small corpus the Platt scaling disagrees with predict on many messages
+        cls.models, cls.results = helpers.train_models(
+            helpers.temporary_directory(cls), corpus_size=40,
+            ML_SVM_MODE='exact', ML_INFERENCE_ENGINE='fast'
+        )
+        contents = [content for _, content in helpers.messages(200)]
+        cls.X = cls.models._extract_features(contents)[0]
+
+    def test_fast_engine_labels_match_predict(self):
+        self.assertIsNotNone(self.models.fast_engine)
+        labels, _ = self.models._run_model('svm', self.X)
+        np.testing.assert_array_equal(labels, self.models.svm_model.predict(self.X))
+
+    def test_sklearn_labels_match_predict(self):
+        engine, self.models.fast_engine = self.models.fast_engine, None
+        try:
+            labels, confidence = self.models._run_model('svm', self.X)
+        finally:
+            self.models.fast_engine = engine
+        np.testing.assert_array_equal(labels, self.models.svm_model.predict(self.X))
+        self.assertTrue(((confidence >= 50) & (confidence <= 100)).all())
+
+    def test_reported_accuracy_is_the_served_accuracy(self):
+        # The test split train_models holds out
+        texts, labels = zip(*helpers.corpus(40))
+        _, X_test, _, y_test = train_test_split(
+            texts, labels, test_size=0.2, random_state=42, stratify=labels
+        )
+        X_test = self.models._extract_features(X_test)[0]
+        self.assertAlmostEqual(
+            self.results['svm']['accuracy'],
+            np.mean(self.models.svm_model.predict(X_test) == np.array(y_test)),
+        )
+
+
+class CascadeTests(SimpleTestCase):
+    """Without a cascade confidence, the cascade only skips models that cannot change the vote"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.models, _ = helpers.train_models(helpers.temporary_directory(cls))
+        cls.messages = helpers.messages(300)
+
+    def predict(self, cascade):
+        self.models.cascade = cascade
+        try:
+            return self.models.predict_all_models_batch(self.messages)
+        finally:
+            self.models.cascade = False
+
+    def test_same_verdict_as_the_full_vote(self):
+        full = self.predict(False)
+        cascaded = self.predict(True)
+        skipped = 0
+        for full_result, result in zip(full, cascaded):
+            self.assertEqual(result['final_prediction'], full_result['final_prediction'])
+            self.assertEqual(result['reasons'], full_result['reasons'])
+            for full_model, model in zip(full_result['model_results'], result['model_results']):
+                if model['skipped']:
+                    skipped += 1
+                    self.assertIsNone(model['prediction'])
+                else:
+                    self.assertEqual(model, full_model)
+        self.assertGreater(skipped, 0)
@@ -0,0 +1,48 @@
+import contextlib
+import io
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from detection.ml_models import build_models
+
+from . import helpers
+
+
+class ModelBundleTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.models_path = Path(helpers.temporary_directory(cls))
+        cls.models, _ = helpers.train_models(cls.models_path)
+
+    def load(self, **kwargs):
+        loaded = build_models(models_path=self.models_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(loaded.load_models(**kwargs))
+        return loaded
+
+    def test_memory_mapped_models_predict_like_the_trained_ones(self):
+        loaded = self.load()
+        self.assertIsInstance(loaded.logistic_model.coef_, np.memmap)
+        self.assertFalse(loaded.logistic_model.coef_.flags.writeable)
+        self.assertEqual(loaded.version, self.models.version)
+
+        messages = helpers.messages(50)
+        self.assertEqual(loaded.predict_all_models_batch(messages), self.models.predict_all_models_batch(messages))
+
+    def test_loads_into_memory_without_mmap(self):
+        loaded = self.load(mmap_mode=None)
+        self.assertNotIsInstance(loaded.logistic_model.coef_, np.memmap)
+
+    def test_checksum_mismatch_fails_the_load(self):
+        manifest = self.models.read_manifest(self.models_path)
+        bundle_file = self.models_path / manifest['bundle']
+        original = bundle_file.read_bytes()
+        self.addCleanup(bundle_file.write_bytes, original)
+        bundle_file.write_bytes(original[:-1] + bytes([original[-1] ^ 0xFF]))
+
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch'):
+            build_models(models_path=self.models_path).load_models()
@@ -0,0 +1,50 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from detection.model_selection import select_hyperparameters, served_labels
+
+from . import helpers
+
+
+class ServedLabelsTests(SimpleTestCase):
+    """Candidates are scored with the labels the detect endpoints serve"""
+
+    def assert_matches_run_model(self, models):
+        contents = [content for _, content in helpers.messages(200)]
+        X_tfidf, X_pipe = models._extract_features(contents)
+        estimators = {
+            'linear': models.linear_model,
+            'logistic': models.logistic_model,
+            'pipeline': models.pipeline_model[-1],
+            'svm': models.svm_model,
+        }
+        for key, estimator in estimators.items():
+            X = X_pipe if key == 'pipeline' else X_tfidf
+            with self.subTest(key=key):
+                np.testing.assert_array_equal(served_labels(key, estimator, X), models._run_model(key, X)[0])
+
+    def test_exact_svm(self):
+        # Small corpus: the Platt-scaled probabilities disagree with the decision function
+        models, _ = helpers.train_models(helpers.temporary_directory(self), corpus_size=40)
+        self.assert_matches_run_model(models)
+
+    def test_nystroem_svm(self):
+        models, _ = helpers.train_models(helpers.temporary_directory(self), ML_SVM_MODE='nystroem')
+        self.assert_matches_run_model(models)
+
+
+class SelectHyperparametersTests(SimpleTestCase):
+
+    def test_reports_every_candidate_and_the_best(self):
+        models, _ = helpers.train_models(helpers.temporary_directory(self), corpus_size=40)
+        texts, labels = zip(*helpers.corpus(120))
+        grid = {'logistic': {'C': [0.25, 4.0]}, 'svm': {'C': [0.5, 5.0]}}
+        report = select_hyperparameters(models, texts, labels, grid, folds=3, n_jobs=1)
+
+        self.assertEqual(set(report), {'linear', 'logistic', 'pipeline', 'svm'})
+        for key in ('logistic', 'svm'):
+            candidates = report[key]['candidates']
+            self.assertEqual([candidate['params'] for candidate in candidates], [{'C': c} for c in grid[key]['C']])
+            best = max(candidates, key=lambda candidate: candidate['cv_accuracy'])
+            self.assertEqual(report[key]['best_params'], best['params'])
+            self.assertEqual(report[key]['folds'], 3)
@@ -0,0 +1,76 @@
+from django.test import SimpleTestCase
+
+from detection.near_duplicates import NearDuplicateIndex
+
+from . import helpers
+
+
+SPAM = (
+    "Congratulations {name}! You have been selected to win a free prize of ${amount}. "
+    "Click the link to claim your money now, this limited offer is urgent: {link}"
+)
+
+
+class CountingModels:
+    """Trained models that count the messages they score"""
+
+    def __init__(self, models):
+        self.models = models
+        self.version = models.version
+        self.scored = 0
+
+    def predict_all_models_batch(self, messages):
+        self.scored += len(messages)
+        return self.models.predict_all_models_batch(messages)
+
+    def vote(self, email, content, model_results):
+        return self.models.vote(email, content, model_results)
+
+
+class NearDuplicateTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.models, _ = helpers.train_models(helpers.temporary_directory(cls))
+
+    def setUp(self):
+        self.index = NearDuplicateIndex(min_confidence=0)
+        self.counting = CountingModels(self.models)
+        self.indexed = self.index.bind(self.counting)
+
+    def test_copy_reuses_the_model_votes(self):
+        original, = self.indexed.predict_all_models_batch([
+            ('winner@lottery.com', SPAM.format(name='Ana', amount=1000, link='http://a.example/1')),
+        ])
+        self.assertIn(original['spam_votes'], (0, 4), 'the first message must be unanimous to be indexed')
+        copy, = self.indexed.predict_all_models_batch([
+            ('winner@lottery.com', SPAM.format(name='Bob', amount=2500, link='http://b.example/2')),
+        ])
+        self.assertEqual(self.counting.scored, 1)
+        self.assertGreaterEqual(copy['near_duplicate']['similarity'], self.index.threshold)
+        self.assertEqual(copy['model_results'], original['model_results'])
+        self.assertEqual(copy['final_prediction'], original['final_prediction'])
+
+    def test_copy_gets_its_own_keywords_and_domain_reasons(self):
+        self.indexed.predict_all_models_batch([
+            ('winner@lottery.com', SPAM.format(name='Ana', amount=1000, link='http://a.example/1')),
+        ])
+        email, content = 'jane@company.com', SPAM.format(name='Bob', amount=2500, link='http://b.example/2')
+        copy, = self.indexed.predict_all_models_batch([(email, content)])
+        self.assertIsNotNone(copy['near_duplicate'])
+        expected = self.models.predict_all_models(email, content)
+        for field in ('reasons', 'spam_score', 'ham_score'):
+            self.assertEqual(copy[field], expected[field])
+        self.assertIn('Dominio reconocido: company.com', copy['reasons'])
+        self.assertNotIn('Dominio sospechoso: lottery.com', copy['reasons'])
+
+    def test_different_message_runs_the_models(self):
+        self.indexed.predict_all_models_batch([
+            ('winner@lottery.com', SPAM.format(name='Ana', amount=1000, link='http://a.example/1')),
+        ])
+        other, = self.indexed.predict_all_models_batch([
+            ('jane@company.com', 'Thanks for the review, the project meeting moved to Thursday with the whole team.'),
+        ])
+        self.assertIsNone(other['near_duplicate'])
+        self.assertEqual(self.counting.scored, 2)
@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase
+
+from detection.prediction_cache import LocalPredictionCache
+
+
+class StubModels:
+    """Models that count the messages they score"""
+
+    def __init__(self, version='v1'):
+        self.version = version
+        self.scored = []
+
+    def predict_all_models_batch(self, messages):
+        self.scored.extend(messages)
+        return [
+            {'final_prediction': 'SPAM', 'model_version': self.version, 'reasons': []}
+            for _ in messages
+        ]
+
+
+class PredictionCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LocalPredictionCache(max_entries=10)
+        self.models = StubModels()
+
+    def test_same_message_is_a_hit(self):
+        first = self.cache.predict(self.models, 'a@b.com', 'Win money now')
+        second = self.cache.predict(self.models, 'a@b.com', 'Win money now')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.models.scored), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_whitespace_variants_share_an_entry(self):
+        self.cache.predict(self.models, 'a@b.com', 'Win  money\n now ')
+        self.cache.predict(self.models, ' a@b.com', 'Win money now')
+        self.assertEqual(self.models.scored, [('a@b.com', 'Win money now')])
+
+    def test_new_model_version_invalidates_the_entries(self):
+        self.cache.predict(self.models, 'a@b.com', 'Win money now')
+        retrained = StubModels(version='v2')
+        result = self.cache.predict(retrained, 'a@b.com', 'Win money now')
+        self.assertEqual(len(retrained.scored), 1)
+        self.assertEqual(result['model_version'], 'v2')
+
+    def test_batch_predicts_only_the_misses(self):
+        self.cache.predict(self.models, 'a@b.com', 'first')
+        results = self.cache.predict_batch(self.models, [('a@b.com', 'first'), ('a@b.com', 'second')])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.models.scored, [('a@b.com', 'first'), ('a@b.com', 'second')])
+
+    def test_results_are_copies(self):
+        first = self.cache.predict(self.models, 'a@b.com', 'Win money now')
+        first['reasons'].append('changed by the caller')
+        second = self.cache.predict(self.models, 'a@b.com', 'Win money now')
+        self.assertEqual(second['reasons'], [])
+
+    def test_oldest_entries_are_evicted(self):
+        cache = LocalPredictionCache(max_entries=2)
+        for content in ('one', 'two', 'three'):
+            cache.predict(self.models, 'a@b.com', content)
+        cache.predict(self.models, 'a@b.com', 'one')
+        self.assertEqual(len(self.models.scored), 4)
@@ -0,0 +1,42 @@
+import contextlib
+import io
+
+from django.test import SimpleTestCase
+
+from detection.ml_models import ModelRegistry, build_models
+
+from . import helpers
+
+
+class ModelRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.models_path = helpers.temporary_directory(self)
+        self.first, _ = helpers.train_models(self.models_path, corpus_size=120)
+        self.registry = ModelRegistry(factory=lambda: build_models(models_path=self.models_path), reload_interval=0)
+
+    def reload(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.registry.reload_if_changed(wait=True)
+
+    def test_get_loads_the_saved_models(self):
+        self.assertEqual(self.registry.get().version, self.first.version)
+        self.assertIs(self.registry.get(), self.registry.get())
+
+    def test_retrain_is_published_by_a_reload(self):
+        published = self.registry.get()
+        self.assertFalse(self.reload())
+
+        second, _ = helpers.train_models(self.models_path, corpus_size=120, seed=3)
+        self.assertTrue(self.reload())
+        self.assertEqual(self.registry.get().version, second.version)
+        self.assertIsNot(self.registry.get(), published)
+        # A request still holding the old bundle keeps a complete model set
+        result = published.predict_all_models('a@b.com', 'Claim your free prize money now')
+        self.assertEqual(result['model_version'], self.first.version)
+
+    def test_untrained_models_are_not_published(self):
+        published = self.registry.get()
+        with self.assertRaises(ValueError):
+            self.registry.publish(build_models(models_path=self.models_path))
+        self.assertIs(self.registry.get(), published)
@@ -0,0 +1,67 @@
+import io
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from detection.models import DetectionLog, DetectionRollup
+from detection.rollups import add_to_rollups, rebuild_rollups, rollup_stats, truncate_hour
+
+
+def write_logs(created_at, domain, spam, ham, rollups=True, **fields):
+    """Insert DetectionLog rows as the log writer does"""
+    logs = [
+        DetectionLog(
+            created_at=created_at, email=f'user@{domain}', sender_domain=domain, content='x',
+            prediction=prediction, probability=0.9, model_used='ensemble_4_models', **fields
+        )
+        for prediction in ['SPAM'] * spam + ['HAM'] * ham
+    ]
+    DetectionLog.objects.bulk_create(logs)
+    if rollups:
+        add_to_rollups(logs)
+    return logs
+
+
+def rollup_counts():
+    return {
+        (rollup.hour, rollup.sender_domain): (rollup.spam_count, rollup.ham_count)
+        for rollup in DetectionRollup.objects.all()
+    }
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.hour = truncate_hour(timezone.now())
+
+    def test_writes_add_to_the_hourly_buckets(self):
+        write_logs(self.hour + timedelta(minutes=5), 'a.com', spam=2, ham=1)
+        write_logs(self.hour + timedelta(minutes=50), 'a.com', spam=1, ham=0)
+        write_logs(self.hour + timedelta(minutes=10), 'b.com', spam=0, ham=4)
+        self.assertEqual(rollup_counts(), {(self.hour, 'a.com'): (3, 1), (self.hour, 'b.com'): (0, 4)})
+
+        stats = rollup_stats({'since': self.hour.isoformat(), 'until': (self.hour + timedelta(hours=1)).isoformat()})
+        self.assertEqual(stats['totals'], {'spam': 3, 'ham': 5, 'total': 8, 'spam_rate': 3 / 8})
+        self.assertEqual([row['domain'] for row in stats['top_domains']], ['a.com', 'b.com'])
+
+    def test_rebuild_counts_logs_written_before_the_rollups(self):
+        write_logs(self.hour, 'a.com', spam=2, ham=3, rollups=False)
+        self.assertEqual(rebuild_rollups(), 1)
+        self.assertEqual(rollup_counts(), {(self.hour, 'a.com'): (2, 3)})
+
+    def test_rebuild_after_prune_keeps_the_pruned_counts(self):
+        old_hour = self.hour - timedelta(days=40)
+        write_logs(old_hour, 'a.com', spam=3, ham=2)
+        # Logs with feedback survive the prune, in the otherwise pruned hour
+        write_logs(old_hour, 'a.com', spam=1, ham=0, corrected_label='ham', corrected_at=timezone.now())
+        write_logs(self.hour, 'a.com', spam=1, ham=1)
+        before = rollup_counts()
+
+        call_command('prune_logs', days=30, pause=0, stdout=io.StringIO())
+        self.assertEqual(DetectionLog.objects.filter(created_at__lt=self.hour).count(), 1)
+        rebuild_rollups()
+
+        self.assertEqual(rollup_counts(), before)
+        self.assertEqual(before[(old_hour, 'a.com')], (4, 2))
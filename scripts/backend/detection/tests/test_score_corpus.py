@@ -0,0 +1,57 @@
+import io
+import json
+from pathlib import Path
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from detection.synthetic import generate_corpus, write_jsonl
+
+from . import helpers
+
+
+class ScoreCorpusResumeTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(helpers.temporary_directory(cls))
+        cls.models_path = cls.workdir / 'models'
+        cls.models, _ = helpers.train_models(cls.models_path)
+        cls.corpus_path = cls.workdir / 'corpus.jsonl'
+        write_jsonl(generate_corpus(57, seed=7), cls.corpus_path)
+
+    def score(self, output, *args):
+        stderr = io.StringIO()
+        with override_settings(ML_MODELS_PATH=self.models_path):
+            call_command(
+                'score_corpus', str(self.corpus_path), str(output), '--workers', '1', '--chunk-size', '10',
+                *args, stdout=io.StringIO(), stderr=stderr
+            )
+        return stderr.getvalue()
+
+    def test_resume_continues_after_the_last_complete_line(self):
+        complete = self.workdir / 'complete.jsonl'
+        self.score(complete, '--overwrite')
+        lines = complete.read_text().splitlines(keepends=True)
+        self.assertEqual([json.loads(line)['index'] for line in lines], list(range(57)))
+
+        # Interrupted mid-write: 23 complete lines and part of the 24th
+        interrupted = self.workdir / 'interrupted.jsonl'
+        interrupted.write_text(''.join(lines[:23]) + lines[23][:15])
+        self.assertIn('Resuming after 23 already scored messages', self.score(interrupted, '--resume'))
+        self.assertEqual(interrupted.read_text(), complete.read_text())
+
+    def test_existing_output_needs_resume_or_overwrite(self):
+        output = self.workdir / 'existing.jsonl'
+        output.write_text('')
+        with self.assertRaisesRegex(CommandError, '--resume'):
+            self.score(output)
+
+    def test_resume_refuses_output_of_other_models(self):
+        output = self.workdir / 'other-models.jsonl'
+        output.write_text(json.dumps({'index': 0, 'model_version': 'older'}) + '\n')
+        with self.assertRaisesRegex(CommandError, 'model version older'):
+            self.score(output, '--resume')
+        self.assertEqual(len(output.read_text().splitlines()), 1)
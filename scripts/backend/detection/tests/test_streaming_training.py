@@ -0,0 +1,64 @@
+import contextlib
+import io
+import zlib
+from pathlib import Path
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from detection.ml_models import build_models
+from detection.synthetic import generate_corpus, write_jsonl
+
+from . import helpers
+
+
+STREAMING_TRAINING = {
+    'BATCH_SIZE': 100,
+    'EPOCHS': 3,
+    'HOLDOUT_PERCENT': 20,
+    'HASH_FEATURES': 2 ** 16,
+    'SHUFFLE_BATCHES': 4,
+}
+
+
+class StreamingTrainingTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        workdir = Path(helpers.temporary_directory(cls))
+        cls.records = generate_corpus(800, seed=42)
+        corpus_path = workdir / 'corpus.jsonl'
+        write_jsonl(cls.records, corpus_path)
+
+        cls.reported = {}
+        with override_settings(ML_STREAMING_TRAINING=STREAMING_TRAINING), contextlib.redirect_stdout(io.StringIO()):
+            cls.models = build_models(models_path=workdir / 'models')
+            cls.results = cls.models.train_models_streaming(corpus_path, progress_callback=cls.reported.__setitem__)
+
+    def test_every_model_reports_its_holdout_result(self):
+        holdout = sum(
+            zlib.crc32(record.content.encode('utf-8')) % 100 < STREAMING_TRAINING['HOLDOUT_PERCENT']
+            for record in self.records
+        )
+        self.assertGreater(holdout, 0)
+        self.assertEqual(self.reported, self.results)
+        self.assertEqual(set(self.results), set(self.models.RESULT_KEYS.values()))
+        for key, result in self.results.items():
+            with self.subTest(key):
+                self.assertEqual(result['holdout_messages'], holdout)
+                self.assertEqual(result['training_messages'], len(self.records) - holdout)
+                self.assertGreaterEqual(result['accuracy'], 0.5)
+        # The SGD regressor needs more than 640 messages to predict any spam
+        for key in ('logistic_regression', 'pipeline', 'svm'):
+            self.assertGreater(self.results[key]['accuracy'], 0.9)
+            self.assertGreater(self.results[key]['precision'], 0.9)
+            self.assertGreater(self.results[key]['recall'], 0.9)
+
+    def test_saved_models_score_like_the_trained_ones(self):
+        loaded = build_models(models_path=self.models.models_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(loaded.load_models())
+        self.assertEqual(loaded.svm_mode, 'sgd')
+        messages = helpers.messages(30)
+        self.assertEqual(loaded.predict_all_models_batch(messages), self.models.predict_all_models_batch(messages))
@@ -0,0 +1,37 @@
+import os
+from unittest import mock
+
+from django.test import TestCase
+
+from detection.models import TrainingJob
+
+
+class TrainModelsViewTests(TestCase):
+
+    def setUp(self):
+        # The launched child is this test process, so the job stays alive
+        popen = mock.patch('detection.training.subprocess.Popen', return_value=mock.Mock(pid=os.getpid()))
+        watcher = mock.patch('detection.training.threading.Thread')
+        self.popen = popen.start()
+        watcher.start()
+        self.addCleanup(popen.stop)
+        self.addCleanup(watcher.stop)
+
+    def test_second_request_conflicts_while_a_job_is_running(self):
+        first = self.client.post('/api/train/')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(TrainingJob.objects.get(pk=first.json()['job_id']).pid, os.getpid())
+
+        second = self.client.post('/api/train/')
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.json()['job_id'], first.json()['job_id'])
+        self.assertEqual(self.popen.call_count, 1)
+        self.assertEqual(TrainingJob.objects.count(), 1)
+
+    def test_new_job_starts_once_the_running_one_is_gone(self):
+        first = self.client.post('/api/train/')
+        with mock.patch('detection.training._process_alive', return_value=False):
+            second = self.client.post('/api/train/')
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(TrainingJob.objects.get(pk=first.json()['job_id']).status, TrainingJob.STATUS_FAILED)
+        self.assertEqual(TrainingJob.objects.get(pk=second.json()['job_id']).status, TrainingJob.STATUS_RUNNING)
@@ -0,0 +1,129 @@
+"""
+Background training jobs.
+POST /api/train/ records a TrainingJob and trains the models in a separate
+process (manage.py train_models --job <id>), so the request worker answers
+right away and a long SVC fit cannot hit the gunicorn worker timeout.
+The child saves the models to disk and every worker then picks them up
+through the model registry. The database allows a single running job.
+"""
+import os
+import subprocess
+import sys
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .ml_models import build_models, model_registry
+from .models import TrainingJob
+
+
+# A job with no pid this long after creation lost its launcher
+LAUNCH_GRACE_PERIOD = timedelta(minutes=1)
+
+
+class TrainingInProgress(Exception):
+    """Raised when a training job is already running"""
+
+    def __init__(self, job):
+        super().__init__(f"Training job {job.pk} is already running" if job else "A training job is already running")
+        self.job = job
+
+
+def create_training_job(pid=None):
+    """
+    Record a new running TrainingJob.
+    Raises TrainingInProgress when another job is still running.
+    """
+    fail_orphaned_jobs()
+    try:
+        with transaction.atomic():
+            return TrainingJob.objects.create(pid=pid)
+    except IntegrityError:
+        raise TrainingInProgress(TrainingJob.objects.filter(status=TrainingJob.STATUS_RUNNING).first())
+
+
+def start_training_job():
+    """Create a TrainingJob and train it in a child process"""
+    job = create_training_job()
+    command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'train_models', '--job', str(job.pk)]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL)
+    except OSError as e:
+        _finish(job.pk, TrainingJob.STATUS_FAILED, error=f"Could not start training process: {e}")
+        raise
+
+    TrainingJob.objects.filter(pk=job.pk).update(pid=process.pid)
+    job.pid = process.pid
+    threading.Thread(
+        target=_watch, args=(process, job.pk), name=f'training-job-{job.pk}', daemon=True
+    ).start()
+    return job
+
+
+def run_training_job(job_id, corpus_path=None, select=None):
+    """
+    Train the models for a TrainingJob, recording progress as each model
+    finishes. corpus_path overrides settings.ML_TRAINING_CORPUS and select
+    settings.ML_MODEL_SELECTION['ENABLED'].
+    """
+    if not TrainingJob.objects.filter(pk=job_id, status=TrainingJob.STATUS_RUNNING).exists():
+        return TrainingJob.objects.get(pk=job_id)
+    results = {}
+
+    def progress(key, result):
+        results[key] = result
+        TrainingJob.objects.filter(pk=job_id).update(results=results)
+
+    try:
+        bundle = build_models()
+        bundle.train_models(progress_callback=progress, corpus_path=corpus_path, select=select)
+    except Exception:
+        _finish(job_id, TrainingJob.STATUS_FAILED, error=traceback.format_exc())
+    else:
+        _finish(job_id, TrainingJob.STATUS_COMPLETED, model_version=bundle.version)
+    return TrainingJob.objects.get(pk=job_id)
+
+
+def fail_orphaned_jobs():
+    """Mark running jobs whose process is gone (killed, OOM, host restart) as failed"""
+    now = timezone.now()
+    for job in TrainingJob.objects.filter(status=TrainingJob.STATUS_RUNNING):
+        if job.pid is None:
+            orphaned = now - job.created_at > LAUNCH_GRACE_PERIOD
+        else:
+            orphaned = not _process_alive(job.pid)
+        if orphaned:
+            _finish(job.pk, TrainingJob.STATUS_FAILED, error='Training process is no longer running')
+
+
+def _finish(job_id, status, **fields):
+    TrainingJob.objects.filter(pk=job_id, status=TrainingJob.STATUS_RUNNING).update(
+        status=status, finished_at=timezone.now(), **fields
+    )
+
+
+def _watch(process, job_id):
+    # Runs in the launching worker: reap the child, then publish its models here
+    # right away (other workers notice the new version on their next check)
+    returncode = process.wait()
+    try:
+        _finish(job_id, TrainingJob.STATUS_FAILED,
+                error=f"Training process exited with code {returncode}")
+        if TrainingJob.objects.filter(pk=job_id, status=TrainingJob.STATUS_COMPLETED).exists():
+            model_registry.reload_if_changed()
+    finally:
+        connection.close()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,9 +1,28 @@
 from django.urls import path
-from .views import DetectSpamView, DetectionLogsView, TrainModelsView, HealthCheckView
+from .views import (
+    DetectSpamView,
+    AsyncDetectSpamView,
+    DetectSpamBatchView,
+    DetectionLogsView,
+    DetectionLogsExportView,
+    StatsView,
+    FeedbackView,
+    MetricsView,
+    TrainModelsView,
+    TrainingJobView,
+    HealthCheckView,
+)
 
 urlpatterns = [
     path('detect/', DetectSpamView.as_view(), name='detect'),
+    path('detect/async/', AsyncDetectSpamView.as_view(), name='detect-async'),
+    path('detect/batch/', DetectSpamBatchView.as_view(), name='detect-batch'),
     path('logs/', DetectionLogsView.as_view(), name='logs'),
+    path('logs/export/', DetectionLogsExportView.as_view(), name='logs-export'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('feedback/', FeedbackView.as_view(), name='feedback'),
     path('train/', TrainModelsView.as_view(), name='train'),
+    path('train/<uuid:job_id>/', TrainingJobView.as_view(), name='train-job'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('health/', HealthCheckView.as_view(), name='health'),
 ]
@@ -1,18 +1,68 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import SpamDetectionInputSerializer, DetectionLogSerializer
-from .models import DetectionLog
+from .serializers import (
+    SpamDetectionInputSerializer,
+    SpamDetectionBatchInputSerializer,
+    DetectionLogSerializer,
+    FeedbackInputSerializer,
+    TrainingJobSerializer,
+)
+from .models import DetectionLog, TrainingJob
+from . import metrics
+from .async_inference import get_inference_executor
+from .feedback import get_online_learner, record_feedback
+from .log_queries import InvalidLogQuery, filter_logs, paginate_logs, parse_limit
+from .log_writer import get_log_writer
+from .micro_batcher import get_micro_batcher
 from .ml_models import get_models
+from .near_duplicates import get_near_duplicate_index
+from .prediction_cache import get_prediction_cache
+from .rollups import rollup_stats
+from .training import TrainingInProgress, fail_orphaned_jobs, start_training_job
+
+
+def _predict_batch(models, messages):
+    """
+    Run the ensemble through the prediction cache and the near-duplicate
+    index when they are configured
+    """
+    prediction_cache = get_prediction_cache()
+    near_duplicate_index = get_near_duplicate_index()
+    if near_duplicate_index is not None:
+        models = near_duplicate_index.bind(models)
+    with metrics.timer(metrics.STAGE_SECONDS, 'predict'):
+        if prediction_cache is None:
+            return models.predict_all_models_batch(messages)
+        return prediction_cache.predict_batch(models, messages)
 
 
 class DetectSpamView(APIView):
     """API endpoint for spam detection using 4 ML models"""
     
+    @metrics.instrument('detect')
     def post(self, request):
-        serializer = SpamDetectionInputSerializer(data=request.data)
+        micro_batcher = get_micro_batcher()
+        if micro_batcher is None:
+            return self._detect(request, None)
+        with micro_batcher.request():
+            return self._detect(request, micro_batcher)
+    
+    def _detect(self, request, micro_batcher):
+        with metrics.timer(metrics.STAGE_SECONDS, 'validate'):
+            serializer = SpamDetectionInputSerializer(data=request.data)
+            valid = serializer.is_valid()
         
-        if not serializer.is_valid():
+        if not valid:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         data = serializer.validated_data
@@ -21,17 +71,17 @@ class DetectSpamView(APIView):
         
         try:
             models = get_models()
-            result = models.predict_all_models(email, content)
+            # Concurrent requests of this worker are scored together when micro-batching is on
+            if micro_batcher is not None:
+                models = micro_batcher.bind(models)
+            result = _predict_batch(models, [(email, content)])[0]
             result['email'] = email
             
-            # Log the prediction
-            DetectionLog.objects.create(
-                email=email,
-                content=content[:500],
-                prediction=result['final_prediction'],
-                probability=result['confidence'] / 100,
-                model_used='ensemble_4_models'
-            )
+            # Log the prediction; its detection_id identifies it for feedback
+            with metrics.timer(metrics.STAGE_SECONDS, 'log'):
+                log = DetectionLog.from_prediction(email, content, result)
+                result['detection_id'] = log.detection_id
+                get_log_writer().write(log)
             
             return Response(result, status=status.HTTP_200_OK)
         
@@ -43,6 +93,9 @@ class DetectSpamView(APIView):
     
     def get(self, request):
         """Return API info"""
+        prediction_cache = get_prediction_cache()
+        near_duplicate_index = get_near_duplicate_index()
+        micro_batcher = get_micro_batcher()
         return Response({
             'models_available': [
                 'Regresión Lineal',
@@ -51,39 +104,331 @@ class DetectSpamView(APIView):
                 'SVM (Support Vector Machine)'
             ],
             'description': 'Email spam detection using 4 ML models with voting',
-            'required_fields': ['email', 'content']
+            'required_fields': ['email', 'content'],
+            'cascade': get_models().get_cascade_stats(),
+            'prediction_cache': prediction_cache.stats() if prediction_cache else None,
+            'near_duplicate_index': near_duplicate_index.stats() if near_duplicate_index else None,
+            'micro_batching': micro_batcher.stats() if micro_batcher else None
         })
 
 
+def _predict_one(email, content):
+    # Runs in an inference executor thread
+    return _predict_batch(get_models(), [(email, content)])[0]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncDetectSpamView(View):
+    """
+    Async variant of DetectSpamView for ASGI servers (config/asgi.py, which
+    sheds these requests with a 503 past DETECTION_ASYNC['MAX_PENDING']).
+    Takes a JSON body. The prediction runs in the inference thread pool
+    and the log is enqueued without blocking.
+    """
+    
+    @metrics.instrument('detect_async')
+    async def post(self, request):
+        with metrics.timer(metrics.STAGE_SECONDS, 'validate'):
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                serializer = SpamDetectionInputSerializer(data=data)
+                valid = serializer.is_valid()
+        
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Expected a JSON object body'}, status=status.HTTP_400_BAD_REQUEST)
+        if not valid:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        email = serializer.validated_data['email']
+        content = serializer.validated_data['content']
+        
+        try:
+            result = await get_inference_executor().run(_predict_one, email, content)
+            result['email'] = email
+            
+            with metrics.timer(metrics.STAGE_SECONDS, 'log'):
+                log = DetectionLog.from_prediction(email, content, result)
+                result['detection_id'] = log.detection_id
+                log_writer = get_log_writer()
+                if log_writer.mode == 'sync':
+                    await sync_to_async(log_writer.write)(log)
+                else:
+                    log_writer.write(log, block=False)
+            
+            return JsonResponse(result, status=status.HTTP_200_OK, json_dumps_params={'ensure_ascii': False})
+        
+        except Exception as e:
+            return JsonResponse(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class DetectSpamBatchView(APIView):
+    """API endpoint for batch spam detection using 4 ML models"""
+    
+    @metrics.instrument('detect_batch')
+    def post(self, request):
+        with metrics.timer(metrics.STAGE_SECONDS, 'validate'):
+            serializer = SpamDetectionBatchInputSerializer(data=request.data)
+            valid = serializer.is_valid()
+        
+        if not valid:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        messages = [
+            (item['email'], item['content'])
+            for item in serializer.validated_data['messages']
+        ]
+        
+        try:
+            models = get_models()
+            results = _predict_batch(models, messages)
+            
+            # Log all predictions, inserted in bulk by the log writer
+            with metrics.timer(metrics.STAGE_SECONDS, 'log'):
+                logs = []
+                for (email, content), result in zip(messages, results):
+                    result['email'] = email
+                    log = DetectionLog.from_prediction(email, content, result)
+                    result['detection_id'] = log.detection_id
+                    logs.append(log)
+                get_log_writer().write_many(logs)
+            
+            return Response({
+                'count': len(results),
+                'results': results
+            }, status=status.HTTP_200_OK)
+        
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class DetectionLogsView(APIView):
-    """API endpoint for detection logs"""
+    """
+    API endpoint for detection logs, newest first.
+    Filters: prediction, domain, since, until. Pages are walked with the
+    cursor returned in the Link / X-Next-Cursor headers.
+    """
     
     def get(self, request):
-        logs = DetectionLog.objects.all()[:100]
+        params = request.query_params
+        try:
+            queryset = filter_logs(params)
+            logs, next_cursor = paginate_logs(queryset, params.get('cursor'), parse_limit(params))
+        except InvalidLogQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
         serializer = DetectionLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        if next_cursor:
+            next_params = params.copy()
+            next_params['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{next_params.urlencode()}")
+            response['Link'] = f'<{next_url}>; rel="next"'
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+
+class StatsView(APIView):
+    """
+    API endpoint for spam/ham counts by hour or day and top sender domains,
+    read from the hourly rollups instead of the detection logs.
+    Filters: bucket, since, until, domain, top.
+    """
+    
+    def get(self, request):
+        try:
+            return Response(rollup_stats(request.query_params))
+        except InvalidLogQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class _Echo:
+    """File-like object whose write returns the value, for streaming csv rows"""
+    
+    def write(self, value):
+        return value
+
+
+class DetectionLogsExportView(APIView):
+    """
+    Streaming NDJSON or CSV export of detection logs (?output=ndjson|csv),
+    with the same filters as DetectionLogsView. Rows are read with
+    .iterator() so memory use does not grow with the export size.
+    """
+    
+    EXPORT_FIELDS = (
+        'id', 'created_at', 'email', 'sender_domain', 'prediction',
+        'probability', 'model_used', 'content',
+    )
+    CHUNK_SIZE = 2000
+    
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            return Response(
+                {'error': 'Invalid output: expected ndjson or csv'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            queryset = filter_logs(request.query_params)
+        except InvalidLogQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rows = (
+            dict(zip(self.EXPORT_FIELDS, values), created_at=values[1].isoformat())
+            for values in queryset.values_list(*self.EXPORT_FIELDS).iterator(chunk_size=self.CHUNK_SIZE)
+        )
+        
+        if output == 'csv':
+            writer = csv.DictWriter(_Echo(), fieldnames=self.EXPORT_FIELDS)
+            header = dict(zip(self.EXPORT_FIELDS, self.EXPORT_FIELDS))
+            stream = (writer.writerow(row) for row in _prepend(header, rows))
+            content_type = 'text/csv'
+        else:
+            stream = (json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+            content_type = 'application/x-ndjson'
+        
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="detection_logs.{output}"'
+        return response
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
+
+
+class FeedbackView(APIView):
+    """
+    API endpoint to correct a detection.
+    The correct label is stored on the detection's log entry and the models
+    learn from it in the background (see feedback.py).
+    """
+    
+    def post(self, request):
+        serializer = FeedbackInputSerializer(data=request.data)
+        
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = serializer.validated_data
+        try:
+            log = record_feedback(data['detection_id'], data['label'])
+        except DetectionLog.DoesNotExist:
+            return Response({'error': 'Detection not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        return Response({
+            'detection_id': log.detection_id,
+            'prediction': log.prediction,
+            'corrected_label': log.corrected_label,
+            'corrected_at': log.corrected_at,
+            'applied': log.feedback_applied_at is not None
+        }, status=status.HTTP_202_ACCEPTED)
 
 
 class TrainModelsView(APIView):
-    """API endpoint to retrain models"""
+    """
+    API endpoint to retrain models.
+    Training runs as a background job; poll GET /api/train/<id>/ for its status.
+    """
     
     def post(self, request):
         try:
-            models = get_models()
-            results = models.train_models()
+            job = start_training_job()
+        except TrainingInProgress as e:
             return Response({
-                'message': 'All 4 models trained successfully',
-                'results': results
-            })
+                'error': str(e),
+                'job_id': e.job.pk if e.job else None
+            }, status=status.HTTP_409_CONFLICT)
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        
+        return Response({
+            'message': 'Training started',
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': request.build_absolute_uri(reverse('train-job', args=[job.pk]))
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class TrainingJobView(APIView):
+    """API endpoint for the status, per-model accuracy and timing of a training job"""
+    
+    def get(self, request, job_id):
+        fail_orphaned_jobs()
+        try:
+            job = TrainingJob.objects.get(pk=job_id)
+        except TrainingJob.DoesNotExist:
+            return Response({'error': 'Training job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(TrainingJobSerializer(job).data)
+
+
+class MetricsView(APIView):
+    """
+    Prometheus metrics of the worker process that serves the request:
+    detect latency per stage and per model, requests, votes and errors,
+    plus the log writer, prediction cache and online learning counters
+    """
+    
+    def get(self, request):
+        lines = [metrics.registry.render().rstrip('\n')]
+        
+        log_stats = get_log_writer().stats()
+        lines += metrics.gauge_lines(
+            'spam_detection_log_rows_total', 'DetectionLog rows by outcome (written, dropped, failed)',
+            [({'outcome': key}, log_stats[key]) for key in ('written', 'dropped', 'failed')], 'counter'
+        )
+        lines += metrics.gauge_lines(
+            'spam_detection_log_queue_rows', 'DetectionLog rows waiting to be written', [({}, log_stats['queued'])]
+        )
+        
+        prediction_cache = get_prediction_cache()
+        if prediction_cache is not None:
+            cache_stats = prediction_cache.stats()
+            lines += metrics.gauge_lines(
+                'spam_detection_prediction_cache_requests_total', 'Prediction cache lookups by result',
+                [({'result': 'hit'}, cache_stats['hits']), ({'result': 'miss'}, cache_stats['misses'])], 'counter'
+            )
+        
+        learner_stats = get_online_learner().stats()
+        lines += metrics.gauge_lines(
+            'spam_detection_feedback_applied_total', 'Feedback corrections applied to the models by this worker',
+            [({}, learner_stats['applied'])], 'counter'
+        )
+        
+        models = get_models()
+        lines += metrics.gauge_lines(
+            'spam_detection_model_info', 'Version of the published models',
+            [({'version': models.version, 'svm_mode': models.svm_mode}, 1)]
+        )
+        return HttpResponse('\n'.join(lines) + '\n', content_type=metrics.CONTENT_TYPE)
 
 
 class HealthCheckView(APIView):
     """Health check endpoint"""
     
     def get(self, request):
-        return Response({'status': 'healthy', 'service': 'spam-detection-4-models'})
+        return Response({
+            'status': 'healthy',
+            'service': 'spam-detection-4-models',
+            'log_writer': get_log_writer().stats(),
+            'async_inference': get_inference_executor().stats(),
+            'online_learning': get_online_learner().stats()
+        })